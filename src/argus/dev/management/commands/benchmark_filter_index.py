@@ -0,0 +1,94 @@
+from random import Random
+from time import perf_counter
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from argus.filter import get_filter_backend
+
+
+class Command(BaseCommand):
+    help = "Compare matching incidents against filters with and without the filter index"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-f",
+            "--filters",
+            type=int,
+            nargs="+",
+            default=[100, 1000, 10000],
+            help="Number of filters to benchmark with. Default: 100 1000 10000",
+        )
+        parser.add_argument(
+            "-i", "--incidents", type=int, default=200, help="Number of incidents to match per run. Default: 200"
+        )
+        parser.add_argument("-s", "--sources", type=int, default=50, help="Number of source systems. Default: 50")
+        parser.add_argument("-t", "--tags", type=int, default=1000, help="Number of distinct tags. Default: 1000")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the random generator. Default: 0")
+
+    def handle(self, *args, **options):
+        filter_backend = get_filter_backend()
+        FilterIndex = getattr(filter_backend, "FilterIndex", None)
+        if FilterIndex is None:
+            self.stderr.write(self.style.ERROR("The filter backend does not have a FilterIndex"))
+            return
+
+        self.random = Random(options["seed"])
+        self.sources = [SimpleNamespace(id=i) for i in range(1, options["sources"] + 1)]
+        self.tags = [SimpleNamespace(representation=f"key{i % 20}=value{i}") for i in range(options["tags"])]
+        incidents = [self.make_incident() for _ in range(options["incidents"])]
+
+        self.stdout.write(
+            f"{'filters':>8} {'fitting':>8} {'candidates':>10}"
+            f" {'linear ms/incident':>20} {'indexed ms/incident':>20} {'speedup':>8}"
+        )
+        for num_filters in options["filters"]:
+            filterwrappers = [filter_backend.FilterWrapper(self.make_filterblob()) for _ in range(num_filters)]
+            index = FilterIndex()
+            for key, filterwrapper in enumerate(filterwrappers):
+                index.add(key, filterwrapper)
+
+            start = perf_counter()
+            linear = [{key for key, fw in enumerate(filterwrappers) if fw.incident_fits(i)} for i in incidents]
+            linear_time = (perf_counter() - start) / len(incidents)
+
+            start = perf_counter()
+            indexed = [index.matching(i) for i in incidents]
+            indexed_time = (perf_counter() - start) / len(incidents)
+
+            if linear != indexed:
+                self.stderr.write(self.style.ERROR(f"Index and linear scan disagree with {num_filters} filters"))
+                return
+            fitting = sum(len(found) for found in indexed) / len(incidents)
+            candidates = sum(len(index.candidates(i)) for i in incidents) / len(incidents)
+            self.stdout.write(
+                f"{num_filters:>8} {fitting:>8.1f} {candidates:>10.1f} {linear_time * 1000:>20.3f} {indexed_time * 1000:>20.3f}"
+                f" {linear_time / indexed_time:>7.1f}x"
+            )
+
+    def make_incident(self):
+        stateful = self.random.random() < 0.9
+        return SimpleNamespace(
+            source=self.random.choice(self.sources),
+            deprecated_tags=self.random.sample(self.tags, 4),
+            level=self.random.randint(1, 5),
+            stateful=stateful,
+            open=stateful and self.random.random() < 0.5,
+            acked=self.random.random() < 0.3,
+        )
+
+    def make_filterblob(self):
+        blob = {}
+        kind = self.random.random()
+        if kind < 0.6:
+            blob["sourceSystemIds"] = [source.id for source in self.random.sample(self.sources, 2)]
+        elif kind < 0.9:
+            blob["tags"] = [tag.representation for tag in self.random.sample(self.tags, 1)]
+        if self.random.random() < 0.5:
+            blob["maxlevel"] = self.random.randint(1, 5)
+        for tristate in ("open", "acked", "stateful"):
+            if self.random.random() < 0.2:
+                blob[tristate] = self.random.random() < 0.5
+        if not blob:
+            blob["open"] = True
+        return blob
@@ -0,0 +1,133 @@
+from collections import defaultdict
+from datetime import timedelta
+from random import Random
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from argus.incident.models import (
+    Event,
+    Incident,
+    IncidentTagRelation,
+    SourceSystem,
+    SourceSystemType,
+    Tag,
+)
+from argus.util.datetime_utils import INFINITY_REPR
+
+
+User = get_user_model()
+BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = "Show the query plans of the incident list and filter queries on a generated dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-i", "--incidents", type=int, default=100000, help="Number of incidents to generate. Default: 100000"
+        )
+        parser.add_argument("-s", "--sources", type=int, default=50, help="Number of source systems. Default: 50")
+        parser.add_argument("-t", "--tags", type=int, default=1000, help="Number of distinct tags. Default: 1000")
+        parser.add_argument(
+            "-o", "--open", type=float, default=0.05, help="Share of the incidents that are open. Default: 0.05"
+        )
+        parser.add_argument("--analyze", action="store_true", help="Run the queries and show actual times and rows")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the random generator. Default: 0")
+
+    def handle(self, *args, **options):
+        self.random = Random(options["seed"])
+        # Nothing generated is kept
+        with transaction.atomic():
+            self.generate(options["incidents"], options["sources"], options["tags"], options["open"])
+            with connection.cursor() as cursor:
+                for model in (Incident, Event, IncidentTagRelation, Tag):
+                    cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+            for name, queryset in self.get_queries():
+                self.stdout.write(self.style.MIGRATE_HEADING(name))
+                self.stdout.write(queryset.explain(analyze=options["analyze"]))
+                self.stdout.write("")
+            transaction.set_rollback(True)
+
+    def get_queries(self):
+        sources = self.sources[:2]
+        incident = Incident.objects.order_by("?").first()
+        page = slice(0, 100)
+        # Two values for each key
+        tags_of_three_keys = [
+            tag.representation for key in ("key0", "key1", "key2") for tag in self.tags_by_key[key][:2]
+        ]
+        return [
+            ("Newest incidents", Incident.objects.order_by("-start_time")[page]),
+            ("Newest open incidents", Incident.objects.open().order_by("-start_time")[page]),
+            ("Newest incidents from a source", Incident.objects.filter(source=sources[0])[page]),
+            ("Newest incidents from two sources", Incident.objects.filter(source__in=sources)[page]),
+            ("Newest incidents of level 2 or lower", Incident.objects.filter(level__lte=2)[page]),
+            (
+                "Newest incidents with a tag",
+                Incident.objects.from_tags(self.tags[0].representation).order_by("-start_time")[page],
+            ),
+            (
+                "Newest incidents with tags of three keys",
+                Incident.objects.from_tags(*tags_of_three_keys).order_by("-start_time")[page],
+            ),
+            ("Start event of an incident", Event.objects.filter(incident=incident, type=Event.Type.INCIDENT_START)),
+        ]
+
+    def generate(self, num_incidents, num_sources, num_tags, open_share):
+        # Every source system has its own user
+        users = User.objects.bulk_create([User(username=f"explain-{i}") for i in range(num_sources)])
+        user = users[0]
+        source_type, _ = SourceSystemType.objects.get_or_create(name="explain")
+        self.sources = SourceSystem.objects.bulk_create(
+            [SourceSystem(name=f"explain-{i}", type=source_type, user=user) for i, user in enumerate(users)]
+        )
+        Tag.objects.bulk_create(
+            [Tag(key=f"key{i % 20}", value=f"value{i}") for i in range(num_tags)], ignore_conflicts=True
+        )
+        self.tags = list(Tag.objects.filter(key__startswith="key", value__startswith="value"))
+        self.tags_by_key = defaultdict(list)
+        for tag in self.tags:
+            self.tags_by_key[tag.key].append(tag)
+
+        now = timezone.now()
+        for start in range(0, num_incidents, BATCH_SIZE):
+            incidents = []
+            for _ in range(min(BATCH_SIZE, num_incidents - start)):
+                start_time = now - timedelta(minutes=self.random.randint(0, 365 * 24 * 60))
+                stateful = self.random.random() < 0.9
+                if not stateful:
+                    end_time = None
+                elif self.random.random() < open_share:
+                    end_time = INFINITY_REPR
+                else:
+                    end_time = start_time + timedelta(minutes=self.random.randint(1, 24 * 60))
+                incidents.append(
+                    Incident(
+                        start_time=start_time,
+                        end_time=end_time,
+                        source=self.random.choice(self.sources),
+                        level=self.random.randint(1, 5),
+                        description="generated",
+                    )
+                )
+            Incident.objects.bulk_create(incidents)
+
+            relations = []
+            events = []
+            for incident in incidents:
+                for tag in self.random.sample(self.tags, min(2, len(self.tags))):
+                    relations.append(IncidentTagRelation(tag=tag, incident=incident, added_by=user))
+                first_type = Event.Type.INCIDENT_START if incident.end_time else Event.Type.STATELESS
+                events.append(Event(incident=incident, actor=user, timestamp=incident.start_time, type=first_type))
+                events.append(
+                    Event(incident=incident, actor=user, timestamp=incident.start_time, type=Event.Type.OTHER)
+                )
+                if incident.end_time and incident.end_time != INFINITY_REPR:
+                    events.append(
+                        Event(incident=incident, actor=user, timestamp=incident.end_time, type=Event.Type.INCIDENT_END)
+                    )
+            IncidentTagRelation.objects.bulk_create(relations)
+            Event.objects.bulk_create(events)
@@ -0,0 +1,24 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+__all__ = ["EventStreamRenderer"]
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Accept clients that only accept server-sent events
+
+    Views stream the events themselves, what is rendered here are the errors
+    that happen before streaming starts, sent as a single "error" event.
+    """
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return ("event: error\ndata: " + json.dumps(data, cls=JSONEncoder) + "\n\n").encode(self.charset)
@@ -3,6 +3,7 @@ from .filterwrapper import (  # noqa: F401
     FallbackFilterWrapper,
     ComplexFilterWrapper,
     ComplexFallbackFilterWrapper,
+    get_filterwrapper,
 )
 from .queryset_filters import QuerySetFilter  # noqa: F401
 from .filters import (  # noqa: F401
@@ -12,3 +13,4 @@ from .filters import (  # noqa: F401
     SOURCE_LOCKED_INCIDENT_OPENAPI_PARAMETER_DESCRIPTIONS,
 )
 from .swappable.serializers import FilterBlobSerializer  # noqa: F401
+from .index import FilterIndex  # noqa: F401
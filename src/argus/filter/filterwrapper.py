@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+from functools import lru_cache, partial
+import json
 import logging
 from typing import TYPE_CHECKING, Optional, Any
 
@@ -10,6 +12,7 @@ from argus.compat import StrEnum
 
 if TYPE_CHECKING:
     from argus.incident.models import Event, Incident
+    from argus.notificationprofile.models import Filter
 
 
 __all__ = [
@@ -17,6 +20,7 @@ __all__ = [
     "FallbackFilterWrapper",
     "ComplexFilterWrapper",
     "ComplexFallbackFilterWrapper",
+    "get_filterwrapper",
 ]
 
 
@@ -26,6 +30,8 @@ FilterBlobType = dict[str, Any]  # Validator: drf serializer, depends on API ver
 
 LOG = logging.getLogger(__name__)
 
+FILTERWRAPPER_CACHE_SIZE = 4096
+
 
 class FilterKey(StrEnum):
     OPEN = "open"
@@ -45,19 +51,33 @@ class FilterWrapper:
 
     def __init__(self, filterblob: FilterBlobType):
         self.filter = filterblob.copy()
+        # The checks run for every event, so look up every value only once
+        self._values = {key: self._lookup_filter_value_and_ignored_status(key) for key in self.FILTER_KEYS}
+        self.is_empty = all(ignored for _, ignored in self._values.values())
+        self._incident_checks = self._get_incident_checks()
+
+    @classmethod
+    def get_cache_key(cls) -> str:
+        "Anything besides the filter itself that the result of the checks depend on"
+        return ""
 
     def _get_filter_value(self, key: str) -> Optional[Any]:
         return self.filter.get(key, None)
 
-    def _get_filter_value_and_ignored_status(self, key: str) -> tuple[Optional[Any], bool]:
+    def _lookup_filter_value_and_ignored_status(self, key: str) -> tuple[Optional[Any], bool]:
         filter_ = self._get_filter_value(key)
         if key in self.TRINARY_FILTERS:
             return filter_, filter_ is None
+        if key in self.LIST_FILTERS and filter_:
+            # For fast membership tests
+            filter_ = frozenset(filter_)
         return filter_, not filter_
 
-    @property
-    def is_empty(self) -> bool:
-        return all(self._get_filter_value_and_ignored_status(key)[1] for key in self.FILTER_KEYS)
+    def _get_filter_value_and_ignored_status(self, key: str) -> tuple[Optional[Any], bool]:
+        try:
+            return self._values[key]
+        except KeyError:
+            return self._lookup_filter_value_and_ignored_status(key)
 
     def _incident_fits_maxlevel(self, incident: Incident) -> TriState:
         filter_, ignored = self._get_filter_value_and_ignored_status(FilterKey.MAXLEVEL)
@@ -95,36 +115,69 @@ class FilterWrapper:
             return True
         return event.type in filter_
 
+    def _get_incident_checks(self) -> tuple:
+        # The cheapest checks first, acked and tags may need the database
+        checks = (
+            ("max_level", FilterKey.MAXLEVEL, self._incident_fits_maxlevel),
+            ("source", FilterKey.SOURCE_SYSTEM_IDS, self._incident_fits_source_system),
+            ("open", FilterKey.OPEN, partial(self._incident_fits_tristate, tristate=FilterKey.OPEN)),
+            ("stateful", FilterKey.STATEFUL, partial(self._incident_fits_tristate, tristate=FilterKey.STATEFUL)),
+            ("tags", FilterKey.TAGS, self._incident_fits_tags),
+            ("acked", FilterKey.ACKED, partial(self._incident_fits_tristate, tristate=FilterKey.ACKED)),
+        )
+        return tuple((name, check) for name, key, check in checks if not self._values[key][1])
+
     def incident_fits(self, incident: Incident) -> bool:
         if self.is_empty:
             return False  # Filter is empty!
-        checks = {}
-        checks["source"] = self._incident_fits_source_system(incident)
-        checks["tags"] = self._incident_fits_tags(incident)
-        checks["max_level"] = self._incident_fits_maxlevel(incident)
-        for tristate in self.TRINARY_FILTERS:
-            checks[tristate.value] = self._incident_fits_tristate(incident, tristate)
-
-        any_failed = False in checks.values()
-        if any_failed:
-            LOG.debug("Filter: %s: MISS! checks: %r", self, checks)
-        else:
-            LOG.debug("Filter: %s: HIT!", self)
-        return not any_failed
+        if LOG.isEnabledFor(logging.DEBUG):
+            checks = {name: check(incident) for name, check in self._incident_checks}
+            any_failed = False in checks.values()
+            if any_failed:
+                LOG.debug("Filter: %s: MISS! checks: %r", self, checks)
+            else:
+                LOG.debug("Filter: %s: HIT!", self)
+            return not any_failed
+        # Only the checks of values that are set, the others cannot fail
+        for _, check in self._incident_checks:
+            if check(incident) is False:
+                return False
+        return True
 
 
 class FallbackFilterWrapper(FilterWrapper):
     "Changed by ARGUS_FALLBACK_FILTER setting"
 
     def __init__(self, filterblob: FilterBlobType):
-        super().__init__(filterblob)
+        # Needed by _get_filter_value, which is called when initializing
         self.fallback_filter = getattr(settings, "ARGUS_FALLBACK_FILTER", {})
+        super().__init__(filterblob)
+
+    @classmethod
+    def get_cache_key(cls) -> str:
+        return json.dumps(getattr(settings, "ARGUS_FALLBACK_FILTER", {}), sort_keys=True)
 
     def _get_filter_value(self, key: str) -> Optional[Any]:
         value = super()._get_filter_value(key)
         return value if value else self.fallback_filter.get(key, None)
 
 
+@lru_cache(maxsize=FILTERWRAPPER_CACHE_SIZE)
+def _get_cached_filterwrapper(wrapper_class: type[FilterWrapper], pk, content: str, cache_key: str) -> FilterWrapper:
+    return wrapper_class(json.loads(content))
+
+
+def get_filterwrapper(filter_: Filter, wrapper_class: type[FilterWrapper] = FilterWrapper) -> FilterWrapper:
+    """Get a ``wrapper_class`` for the Filter ``filter_``
+
+    Wrappers are reused for as long as neither the filter nor anything else
+    the wrapper depends on, like the fallback filter, has changed. They must
+    not be modified.
+    """
+    content = json.dumps(filter_.filter, sort_keys=True)
+    return _get_cached_filterwrapper(wrapper_class, filter_.pk, content, wrapper_class.get_cache_key())
+
+
 class ComplexFilterWrapper:
     filterwrapper = FilterWrapper
 
@@ -138,7 +191,7 @@ class ComplexFilterWrapper:
         if not is_selected_by_time:
             return False
         for f in self.profile.filters.only("filter"):
-            if not self.filterwrapper(f.filter).incident_fits(incident):
+            if not get_filterwrapper(f, self.filterwrapper).incident_fits(incident):
                 return False
         return True
 
@@ -147,7 +200,7 @@ class ComplexFilterWrapper:
             return False
         # return as early as possible
         for f in self.profile.filters.only("filter"):
-            if FilterWrapper(f.filter).event_fits(event):
+            if get_filterwrapper(f, FilterWrapper).event_fits(event):
                 return True
         return False
 
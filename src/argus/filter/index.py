@@ -0,0 +1,107 @@
+"""Inverted index from filter criteria to filters
+
+Checking every filter against every incident is O(filters). The index stores
+each filter under the most selective criterion it has, so that an incident only
+needs to be checked against the filters that could possibly fit it:
+
+* filters with source systems are stored per source system id
+* filters with tags, but no source systems, are stored under one of their tags
+* the rest only depend on the maximum level and the tristates, and are stored
+  under those values, which are few enough to be looked up directly
+
+Candidates found via source system or tag are then checked with the filter
+wrapper itself, so the index never changes what fits, only how fast it is found.
+Filter backends can opt in to indexed notification matching by exposing a
+class named ``FilterIndex`` with the same interface.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from itertools import product
+from typing import TYPE_CHECKING, Hashable
+
+from .filterwrapper import FilterKey, FilterWrapper
+
+if TYPE_CHECKING:
+    from argus.incident.models import Incident
+
+
+__all__ = [
+    "FilterIndex",
+]
+
+
+class FilterIndex:
+    TRISTATES = FilterWrapper.TRINARY_FILTERS
+
+    def __init__(self):
+        self.filterwrappers = {}
+        self.by_source = defaultdict(set)
+        self.by_tag = defaultdict(set)
+        # (open, acked, stateful) -> maxlevel -> keys
+        self.by_tristates = defaultdict(lambda: defaultdict(set))
+
+    def __len__(self):
+        return len(self.filterwrappers)
+
+    @staticmethod
+    def _get_value(filterwrapper: FilterWrapper, key: FilterKey):
+        value, ignored = filterwrapper._get_filter_value_and_ignored_status(key)
+        return None if ignored else value
+
+    def add(self, key: Hashable, filterwrapper: FilterWrapper):
+        "Index ``filterwrapper`` under ``key``, typically the pk of the filter"
+        if filterwrapper.is_empty:
+            return  # An empty filter never fits anything
+        self.filterwrappers[key] = filterwrapper
+        source_ids = self._get_value(filterwrapper, FilterKey.SOURCE_SYSTEM_IDS)
+        if source_ids:
+            for source_id in source_ids:
+                self.by_source[source_id].add(key)
+            return
+        tags = self._get_value(filterwrapper, FilterKey.TAGS)
+        if tags:
+            self.by_tag[min(tags)].add(key)
+            return
+        tristates = tuple(self._get_value(filterwrapper, tristate) for tristate in self.TRISTATES)
+        maxlevel = self._get_value(filterwrapper, FilterKey.MAXLEVEL)
+        self.by_tristates[tristates][maxlevel].add(key)
+
+    def _fitting_tristate_keys(self, incident: Incident) -> set:
+        "These are only indexed by values that are all looked up exactly, no need to check them again"
+        found = set()
+        if not self.by_tristates:
+            return found
+        # Only look up tristates that are used, `acked` for instance needs a query
+        used = {i for tristates in self.by_tristates for i, value in enumerate(tristates) if value is not None}
+        values = [
+            (None, getattr(incident, tristate)) if i in used else (None,) for i, tristate in enumerate(self.TRISTATES)
+        ]
+        for tristates in product(*values):
+            by_maxlevel = self.by_tristates.get(tristates)
+            if not by_maxlevel:
+                continue
+            for maxlevel, keys in by_maxlevel.items():
+                if maxlevel is None or incident.level <= maxlevel:
+                    found.update(keys)
+        return found
+
+    def candidates(self, incident: Incident) -> set:
+        "Return the keys of filters that might fit ``incident``, a superset of the fitting ones"
+        found = set(self.by_source.get(incident.source.id, ()))
+        for tag in incident.deprecated_tags:
+            found.update(self.by_tag.get(tag.representation, ()))
+        found.update(self._fitting_tristate_keys(incident))
+        return found
+
+    def matching(self, incident: Incident) -> set:
+        "Return the keys of all filters that fit ``incident``"
+        found = self._fitting_tristate_keys(incident)
+        to_check = set(self.by_source.get(incident.source.id, ()))
+        for tag in incident.deprecated_tags:
+            to_check.update(self.by_tag.get(tag.representation, ()))
+        for key in to_check:
+            if self.filterwrappers[key].incident_fits(incident):
+                found.add(key)
+        return found
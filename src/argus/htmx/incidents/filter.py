@@ -33,6 +33,7 @@ class IncidentFilterForm(forms.Form):
         initial=max(Level).value,
         required=False,
     )
+    search = forms.CharField(required=False, label="Search")
 
     def _tristate(self, onkey, offkey):
         on = self.cleaned_data.get(onkey, None)
@@ -76,4 +77,7 @@ def incident_list_filter(request, qs):
     if form.is_valid():
         filterblob = form.to_filterblob()
         qs = QuerySetFilter.filtered_incidents(filterblob, qs)
+        search = form.cleaned_data.get("search")
+        if search:
+            qs = qs.search(search).order_by("-search_rank", "-start_time")
     return form, qs
@@ -1,18 +1,26 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import logging
-from datetime import datetime
+from datetime import datetime, timezone as dt_timezone
+from typing import Optional
 
 from django import forms
 from django.contrib.auth import get_user_model
+from django.db.models import Count, Max, Q
+from django.db.models.functions import Coalesce
 from django.shortcuts import render, get_object_or_404
 
 from django.views.decorators.http import require_POST, require_GET
 from django.core.paginator import Paginator
 from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import quote_etag
 from django_htmx.middleware import HtmxDetails
-from django_htmx.http import HttpResponseClientRefresh
+from django_htmx.http import HttpResponseClientRefresh, reswap
 
+from argus.auth.context_processors import preferences
 from argus.auth.utils import get_preference, save_preference
 from argus.incident.models import Incident
 from argus.util.datetime_utils import make_aware
@@ -43,13 +51,13 @@ INCIDENT_UPDATE_ACTIONS = {
 }
 
 
+# The id of the incident table, which refreshes itself
+REFRESH_TRIGGER = "table"
+
+
 def prefetch_incident_daughters():
-    return Incident.objects.select_related("source").prefetch_related(
-        "incident_tag_relations",
-        "incident_tag_relations__tag",
-        "events",
-        "events__ack",
-    )
+    # Whether an incident is acked is stored on it, so the events are not needed
+    return Incident.objects.prefetch_default_related()
 
 
 class HtmxHttpRequest(HttpRequest):
@@ -100,49 +108,151 @@ def filter_form(request: HtmxHttpRequest):
     return render(request, "htmx/incidents/_incident_filterbox.html", context=context)
 
 
+def get_incident_list_version(now: datetime) -> tuple[int, int, int]:
+    """The number of the latest change to an incident, the number of incidents,
+    and how many of them are acked or open at ``now``
+
+    Together they change whenever an incident is created, changed or deleted,
+    and when an acknowledgement or an incident runs out on its own.
+    """
+    version = Incident.objects.aggregate(
+        seq=Coalesce(Max("change_seq"), 0),
+        count=Count("pk"),
+        current=Count("pk", filter=Q(acked_until__gt=now)) + Count("pk", filter=Q(end_time__gt=now)),
+    )
+    return version["seq"], version["count"], version["current"]
+
+
+def get_incident_list_etag(request: HtmxHttpRequest, version: tuple[int, int, int]) -> str:
+    "The ETag of the incident list as rendered for this request"
+    parts = [
+        request.user.pk,
+        request.get_full_path(),
+        request.htmx.trigger,
+        *version,
+        preferences(request)["preferences"],
+    ]
+    return quote_etag(hashlib.md5(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest())
+
+
+def get_page_state(seq: int, now: datetime, pks: list[int]) -> str:
+    """What the client shows: the latest change it has seen, when it was
+    sent, and a digest of the incidents on the page"""
+    digest = hashlib.md5(",".join(str(pk) for pk in pks).encode()).hexdigest()[:16]
+    return f"{seq}-{int(now.timestamp())}-{digest}"
+
+
+def get_page_state_since(page_state: str, pks: list[int]) -> Optional[tuple[int, datetime]]:
+    """The latest change seen by a client showing ``page_state`` and when it
+    was sent, or None if it does not show the incidents ``pks``"""
+    seq, _, rest = page_state.partition("-")
+    timestamp, _, _ = rest.partition("-")
+    try:
+        seq = int(seq)
+        then = datetime.fromtimestamp(int(timestamp), tz=dt_timezone.utc)
+    except (ValueError, OverflowError, OSError):
+        return None
+    if get_page_state(seq, then, pks) != page_state:
+        return None
+    return seq, then
+
+
+def has_changed(row: tuple, seq: int, then: datetime, now: datetime) -> bool:
+    "Whether the incident of ``row`` has changed since change ``seq``, or has run out between ``then`` and ``now``"
+    _, change_seq, acked_until, end_time = row
+    if change_seq is not None and change_seq > seq:
+        return True
+    return any(moment is not None and then < moment <= now for moment in (acked_until, end_time))
+
+
+def set_cache_headers(response: HttpResponse, etag: str) -> HttpResponse:
+    response.headers["ETag"] = etag
+    # Let the browser keep the response but always ask whether it is still valid
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ("HX-Request", "HX-Trigger"))
+    return response
+
+
 @require_GET
 def incident_list(request: HtmxHttpRequest) -> HttpResponse:
     columns = get_incident_table_columns()
 
+    page_size = get_preference(request, "argus_htmx", "page_size")
+    success = save_preference(request, request.GET, "argus_htmx", "page_size")
+    if success:
+        page_size = get_preference(request, "argus_htmx", "page_size")
+
+    # Checked before the incidents are loaded, so that nothing newer is missed
+    last_refreshed = make_aware(datetime.now())
+    version = get_incident_list_version(last_refreshed)
+    seq, total_count, _ = version
+
+    # Unchanged since the last refresh? The browser already has the page
+    etag = None
+    if request.htmx:
+        etag = get_incident_list_etag(request, version)
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return set_cache_headers(response, etag)
+
     # Load incidents
     qs = prefetch_incident_daughters().order_by("-start_time")
-    total_count = qs.count()
-    last_refreshed = make_aware(datetime.now())
 
     params = dict(request.GET.items())
 
     incident_list_filter = get_filter_function()
     filter_form, qs = incident_list_filter(request, qs)
-    filtered_count = qs.count()
 
     # Standard Django pagination
 
-    page_size = get_preference(request, "argus_htmx", "page_size")
-    success = save_preference(request, request.GET, "argus_htmx", "page_size")
-    if success:
-        page_size = get_preference(request, "argus_htmx", "page_size")
     paginator = Paginator(object_list=qs, per_page=page_size)
     page_num = params.pop("page", "1")
     page = paginator.get_page(page_num)
+    filtered_count = paginator.count
 
-    # The htmx magic - use a different, minimal base template for htmx
-    # requests, allowing us to skip rendering the unchanging parts of the
-    # template.
-    if request.htmx:
-        base_template = "htmx/incidents/responses/_incident_list_refresh.html"
-    else:
-        base_template = "htmx/incidents/_base.html"
     context = {
         "columns": columns,
         "filtered_count": filtered_count,
         "count": total_count,
-        "filter_form": filter_form,
-        "page_title": "Incidents",
-        "base": base_template,
-        "page": page,
         "last_refreshed": last_refreshed,
         "update_interval": 30,
         "all_page_sizes": ALLOWED_PAGE_SIZES,
     }
 
-    return render(request, "htmx/incidents/incident_list.html", context=context)
+    # When the table refreshes itself and still shows the same incidents,
+    # only send the rows that changed, to be swapped in out of band
+    page_state = request.GET.get("page_state")
+    if page_state and request.htmx and request.htmx.trigger == REFRESH_TRIGGER:
+        rows = list(page.object_list.values_list("pk", "change_seq", "acked_until", "end_time"))
+        pks = [row[0] for row in rows]
+        since = get_page_state_since(page_state, pks)
+        if since is not None:
+            changed = [row[0] for row in rows if has_changed(row, *since, last_refreshed)]
+            incidents = prefetch_incident_daughters().in_bulk(changed)
+            context["incident_list"] = [incidents[pk] for pk in changed if pk in incidents]
+            context["page_state"] = get_page_state(seq, last_refreshed, pks)
+            response = render(request, "htmx/incidents/responses/_incident_list_changes.html", context=context)
+            return set_cache_headers(reswap(response, "none"), etag)
+
+    context["page_state"] = get_page_state(seq, last_refreshed, [incident.pk for incident in page.object_list])
+
+    # The htmx magic - use a different, minimal base template for htmx
+    # requests, allowing us to skip rendering the unchanging parts of the
+    # template.
+    if request.htmx:
+        base_template = "htmx/incidents/responses/_incident_list_refresh.html"
+    else:
+        base_template = "htmx/incidents/_base.html"
+    context.update(
+        {
+            "filter_form": filter_form,
+            "page_title": "Incidents",
+            "base": base_template,
+            "page": page,
+        }
+    )
+
+    response = render(request, "htmx/incidents/incident_list.html", context=context)
+    if etag:
+        set_cache_headers(response, etag)
+    return response
@@ -0,0 +1,55 @@
+"""Act on acknowledgements when they expire
+
+An acknowledgement expires by the passing of time, nothing is saved, so
+without this nobody would learn that an incident is no longer acked until
+they looked. The command `ack_expiry_sweeper` calls ``sweep_expired_acks``
+as acknowledgements expire, in the order they expire.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+import logging
+from typing import Optional
+
+from argus.util.signals import bulk_changed
+from .models import Acknowledgement, Incident
+
+
+__all__ = [
+    "next_ack_expiration",
+    "sweep_expired_acks",
+]
+
+
+LOG = logging.getLogger(__name__)
+
+
+def next_ack_expiration(after: datetime) -> Optional[datetime]:
+    "When the first acknowledgement to expire after ``after`` expires"
+    acks = Acknowledgement.objects.filter(expiration__gt=after).order_by("expiration")
+    return acks.values_list("expiration", flat=True).first()
+
+
+def sweep_expired_acks(since: datetime, until: datetime) -> list[Incident]:
+    """Handle the acknowledgements that expired after ``since`` and up to ``until``
+
+    The stored acknowledgement state of their incidents is brought up to date,
+    and the incidents that are no longer acked at all are announced with
+    ``bulk_changed``. Returns those incidents, in the order their
+    acknowledgements expired.
+    """
+    acks = Acknowledgement.objects.filter(expiration__gt=since, expiration__lte=until).order_by("expiration")
+    incident_ids = list(dict.fromkeys(acks.values_list("event__incident_id", flat=True)))
+    if not incident_ids:
+        return []
+
+    incidents = Incident.objects.filter(pk__in=incident_ids)
+    incidents.update_acked_until()
+    # Another acknowledgement may still be active
+    expired = incidents.filter(acked_until__lte=until).prefetch_default_related().in_bulk()
+    expired = [expired[pk] for pk in incident_ids if pk in expired]
+    if expired:
+        LOG.info("Acknowledgements of %i incidents expired", len(expired))
+        bulk_changed.send(sender=Incident, instances=expired)
+    return expired
@@ -240,7 +240,7 @@ class IncidentAdmin(TextWidgetsOverrideModelAdmin):
     def get_queryset(self, request):
         qs: IncidentQuerySet = super().get_queryset(request)
         # Reduce number of database calls
-        return qs.prefetch_default_related().prefetch_related("events__ack")
+        return qs.prefetch_default_related()
 
 
 class IncidentRelationTypeAdmin(TextWidgetsOverrideModelAdmin):
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 from django.db.models.signals import post_delete, post_save
 
 
@@ -8,15 +9,26 @@ class IncidentConfig(AppConfig):
 
     def ready(self):
         from .signals import (
+            announce_tag_change,
             close_token_incident,
             delete_associated_user,
             delete_associated_event,
             task_send_notification,  # noqa
             task_background_send_notification,
+            task_queue_notification,
+            update_acked_until,
         )
 
         post_delete.connect(delete_associated_user, "argus_incident.SourceSystem")
+        post_delete.connect(update_acked_until, "argus_incident.Acknowledgement")
         post_delete.connect(delete_associated_event, "argus_incident.Acknowledgement")
+        post_save.connect(update_acked_until, "argus_incident.Acknowledgement")
+        post_delete.connect(announce_tag_change, "argus_incident.IncidentTagRelation")
+        post_save.connect(announce_tag_change, "argus_incident.IncidentTagRelation")
         post_delete.connect(close_token_incident, "authtoken.Token")
         post_save.connect(close_token_incident, "authtoken.Token")
-        post_save.connect(task_background_send_notification, "argus_incident.Event", dispatch_uid="send_notification")
+        if getattr(settings, "NOTIFICATION_DELIVERY", "background") == "database":
+            notification_handler = task_queue_notification
+        else:
+            notification_handler = task_background_send_notification
+        post_save.connect(notification_handler, "argus_incident.Event", dispatch_uid="send_notification")
@@ -0,0 +1,109 @@
+"""Stream changes to incidents as server-sent events
+
+Changes are numbered by ``Incident.change_seq`` when they are published, see
+``argus.ws.publish``. The stream checks the number of the latest change every
+:setting:`INCIDENT_STREAM_POLL_INTERVAL` seconds, which is a cheap lookup in
+an index, and only when it has grown looks for the incidents that changed.
+Every incident is sent as an event with its change number as id, so that a
+client that reconnects with ``Last-Event-ID`` gets what it missed.
+
+This needs no channel layer, only the database.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from typing import TYPE_CHECKING
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Incident
+from .serializers import IncidentSerializer
+
+if TYPE_CHECKING:
+    from collections.abc import AsyncIterator, Callable, Iterator
+
+    from django.db.models import QuerySet
+
+
+__all__ = [
+    "IncidentEventStream",
+    "format_event",
+]
+
+
+DEFAULT_POLL_INTERVAL = 1  # seconds
+KEEPALIVE_INTERVAL = 15  # seconds
+# Clients reconnect after this, so that no request lasts forever
+MAX_AGE = 300  # seconds
+RETRY = 1000  # milliseconds
+
+
+def format_event(data=None, event: str = "", id=None) -> str:
+    "Format one event, an event with only an id just moves the Last-Event-ID of the client along"
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if id is not None:
+        lines.append(f"id: {id}")
+    if data is not None:
+        lines.append("data: " + json.dumps(data, cls=JSONEncoder))
+    return "\n".join(lines) + "\n\n"
+
+
+class IncidentEventStream:
+    """The events of the incidents changed after ``seq``
+
+    ``filter_queryset`` narrows down a queryset of changed incidents to the
+    ones to send. Iterate over it when serving WSGI, and asynchronously when
+    serving ASGI. It ends after ``max_age`` seconds.
+    """
+
+    def __init__(self, seq: int, filter_queryset: Callable[[QuerySet], QuerySet], max_age: float = MAX_AGE):
+        self.seq = seq
+        self.filter_queryset = filter_queryset
+        self.poll_interval = getattr(settings, "INCIDENT_STREAM_POLL_INTERVAL", DEFAULT_POLL_INTERVAL)
+        self.end = time.monotonic() + max_age
+        self.keepalive = time.monotonic() + KEEPALIVE_INTERVAL
+
+    @property
+    def ended(self) -> bool:
+        return time.monotonic() >= self.end
+
+    def poll(self) -> list[str]:
+        "The events since the last poll"
+        events = []
+        latest = Incident.objects.last_change_seq()
+        if latest > self.seq:
+            incidents = Incident.objects.changed_since(self.seq).filter(change_seq__lte=latest)
+            incidents = self.filter_queryset(incidents).prefetch_default_related().order_by("change_seq")
+            for incident in incidents.iterator(chunk_size=100):
+                events.append(format_event(IncidentSerializer(incident).data, event="incident", id=incident.change_seq))
+                self.seq = incident.change_seq
+            if self.seq != latest:
+                # The latest changes were not sent, skip them when reconnecting
+                events.append(format_event(id=latest))
+                self.seq = latest
+        if events:
+            self.keepalive = time.monotonic() + KEEPALIVE_INTERVAL
+        elif time.monotonic() >= self.keepalive:
+            events.append(": keepalive\n\n")
+            self.keepalive = time.monotonic() + KEEPALIVE_INTERVAL
+        return events
+
+    def __iter__(self) -> Iterator[str]:
+        yield f"retry: {RETRY}\n\n"
+        while not self.ended:
+            yield from self.poll()
+            time.sleep(self.poll_interval)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        yield f"retry: {RETRY}\n\n"
+        while not self.ended:
+            for event in await sync_to_async(self.poll)():
+                yield event
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,52 @@
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from argus.incident.ack_expiry import next_ack_expiration, sweep_expired_acks
+
+
+def timestamp(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+class Command(BaseCommand):
+    help = "Announce incidents when their acknowledgements expire"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--sleep",
+            type=float,
+            default=60.0,
+            help="Longest time to wait between sweeps, in seconds. Default: 60",
+        )
+        parser.add_argument(
+            "--since",
+            type=timestamp,
+            help="Also handle acknowledgements that expired after this ISO 8601 timestamp. Default: now",
+        )
+        parser.add_argument("--once", action="store_true", help="Handle what has expired and exit instead of looping")
+
+    def handle(self, *args, **options):
+        max_sleep = timedelta(seconds=options["sleep"])
+        verbosity = options["verbosity"]
+        since = options["since"] or timezone.now()
+        try:
+            while True:
+                until = timezone.now()
+                expired = sweep_expired_acks(since, until)
+                if expired and verbosity > 1:
+                    self.stdout.write(f"Acknowledgements of {len(expired)} incidents expired")
+                since = until
+                if options["once"]:
+                    break
+                wake_up = min(next_ack_expiration(until) or until + max_sleep, until + max_sleep)
+                time.sleep(max(0, (wake_up - timezone.now()).total_seconds()))
+        except KeyboardInterrupt:
+            pass
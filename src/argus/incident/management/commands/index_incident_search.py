@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from argus.incident.search_index import DEFAULT_BATCH_SIZE, index_events
+
+
+class Command(BaseCommand):
+    help = "Add the descriptions of new events to the search text of their incidents"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-s",
+            "--sleep",
+            type=float,
+            default=5.0,
+            help="Time to wait when there is nothing to index, in seconds. Default: 5",
+        )
+        parser.add_argument(
+            "-b",
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help=f"Number of events to index at a time. Default: {DEFAULT_BATCH_SIZE}",
+        )
+        parser.add_argument("--once", action="store_true", help="Index what is there and exit instead of looping")
+
+    def handle(self, *args, **options):
+        verbosity = options["verbosity"]
+        try:
+            while True:
+                indexed = index_events(options["batch_size"])
+                if indexed and verbosity > 1:
+                    self.stdout.write(f"Indexed {indexed} events")
+                if indexed:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["sleep"])
+        except KeyboardInterrupt:
+            pass
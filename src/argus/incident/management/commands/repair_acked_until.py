@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from argus.incident.models import Incident
+
+
+class Command(BaseCommand):
+    help = "Fill in or repair when the acknowledgements of incidents expire, as stored on the incidents"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report how many incidents are out of date")
+
+    def handle(self, *args, **options):
+        pks = list(Incident.objects.acked_until_out_of_date().values_list("pk", flat=True))
+        if not options["dry_run"]:
+            Incident.objects.filter(pk__in=pks).update_acked_until()
+        verb = "are" if options["dry_run"] else "were"
+        self.stdout.write(f"{len(pks)} incidents {verb} out of date")
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:17
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+import argus.incident.fields
+
+
+def fill_acked_until(apps, schema_editor):
+    # When the last acknowledgement of each incident expires, if any
+    Incident = apps.get_model('argus_incident', 'Incident')
+    Acknowledgement = apps.get_model('argus_incident', 'Acknowledgement')
+    field = argus.incident.fields.DateTimeInfinityField()
+    until = Coalesce('expiration', Value('infinity', output_field=field), output_field=field)
+    acks = Acknowledgement.objects.filter(event__incident=OuterRef('pk')).annotate(until=until)
+    Incident.objects.update(acked_until=Subquery(acks.order_by('-until').values('until')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('argus_incident', '0008_incident_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incident',
+            name='acked_until',
+            field=argus.incident.fields.DateTimeInfinityField(blank=True, db_index=True, editable=False, help_text='When the last acknowledgement expires. Empty if the incident was never acknowledged.', null=True),
+        ),
+        migrations.RunPython(fill_acked_until, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('argus_incident', '0009_incident_acked_until'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='acknowledgement',
+            name='expiration',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
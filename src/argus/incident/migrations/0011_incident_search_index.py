@@ -0,0 +1,19 @@
+# Generated by Django 5.1.15 on 2026-10-18 04:50
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('argus_incident', '0010_acknowledgement_expiration_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='incident',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.search.CombinedSearchVector(django.contrib.postgres.search.SearchVector('description', config='simple', weight='A'), '||', django.contrib.postgres.search.SearchVector('search_text', config='simple', weight='B'), django.contrib.postgres.search.SearchConfig('simple')), name='incident_search_idx'),
+        ),
+    ]
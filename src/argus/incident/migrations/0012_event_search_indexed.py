@@ -0,0 +1,28 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('argus_incident', '0011_incident_search_index'),
+    ]
+
+    operations = [
+        # The descriptions of existing events are already in the search text
+        migrations.AddField(
+            model_name='event',
+            name='search_indexed',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='event',
+            name='search_indexed',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(condition=models.Q(('search_indexed', False)), fields=['id'], name='event_not_search_indexed_idx'),
+        ),
+    ]
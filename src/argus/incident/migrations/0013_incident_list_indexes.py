@@ -0,0 +1,60 @@
+# Generated by Django 5.1.15 on 2026-10-18 05:31
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    # Do not lock the tables for writing while the indexes are built
+    atomic = False
+
+    dependencies = [
+        ('argus_incident', '0012_event_search_indexed'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='event',
+            index=models.Index(fields=['incident', 'type', 'timestamp'], name='event_incident_type_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='incident',
+            index=models.Index(fields=['-start_time'], name='incident_start_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='incident',
+            index=models.Index(fields=['end_time'], name='incident_end_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='incident',
+            index=models.Index(fields=['source', '-start_time'], name='incident_source_start_time_idx'),
+        ),
+        # The new indexes start with these foreign keys, so their own indexes
+        # are no longer needed. Only drop the indexes, AlterField would also
+        # recreate the foreign key constraint on events.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='event',
+                    name='incident',
+                    field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='events', to='argus_incident.incident'),
+                ),
+                migrations.AlterField(
+                    model_name='incident',
+                    name='source',
+                    field=models.ForeignKey(db_index=False, help_text='The source system that the incident originated in.', on_delete=django.db.models.deletion.PROTECT, related_name='incidents', to='argus_incident.sourcesystem'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS "argus_incident_event_incident_id_a66b0689"',
+                    reverse_sql='CREATE INDEX CONCURRENTLY "argus_incident_event_incident_id_a66b0689" ON "argus_incident_event" ("incident_id")',
+                ),
+                migrations.RunSQL(
+                    'DROP INDEX CONCURRENTLY IF EXISTS "argus_incident_incident_source_id_218f626f"',
+                    reverse_sql='CREATE INDEX CONCURRENTLY "argus_incident_incident_source_id_218f626f" ON "argus_incident_incident" ("source_id")',
+                ),
+            ],
+        ),
+    ]
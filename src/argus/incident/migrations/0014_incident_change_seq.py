@@ -0,0 +1,29 @@
+# Generated by Django 5.1.15 on 2026-10-18 06:33
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The index is built without locking the table for writing
+    atomic = False
+
+    dependencies = [
+        ('argus_incident', '0013_incident_list_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE SEQUENCE IF NOT EXISTS argus_incident_change_seq",
+            "DROP SEQUENCE IF EXISTS argus_incident_change_seq",
+        ),
+        migrations.AddField(
+            model_name='incident',
+            name='change_seq',
+            field=models.BigIntegerField(blank=True, editable=False, help_text='The number of the latest published change. Empty for incidents from before changes were numbered.', null=True),
+        ),
+        AddIndexConcurrently(
+            model_name='incident',
+            index=models.Index(condition=models.Q(('change_seq__isnull', False)), fields=['change_seq'], name='incident_change_seq_idx'),
+        ),
+    ]
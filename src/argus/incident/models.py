@@ -2,18 +2,23 @@ from collections import defaultdict
 from datetime import datetime, timedelta
 from functools import reduce
 import logging
-from operator import and_
+from operator import or_
 from random import randint, choice
+import re
 from urllib.parse import urljoin
 
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
-from django.db import models
-from django.db.models import F, Q
+from django.db import connection, models, transaction
+from django.db.models import Count, F, Func, Max, OuterRef, Prefetch, Q, Subquery, Value
+from django.db.models.functions import Cast, Coalesce
 from django.utils import timezone
 
 from argus.util.datetime_utils import INFINITY_REPR, get_infinity_repr
+from argus.util.signals import bulk_changed
 from .constants import Level
 from .fields import DateTimeInfinityField
 from .validators import validate_lowercase, validate_key
@@ -142,6 +147,15 @@ class TagQuerySet(models.QuerySet):
         key, value = Tag.split(tag)
         return self.create(key=key, value=value)
 
+    def get_or_create_many(self, key_values):
+        "Return a dict of (key, value) to tag, creating the tags that are missing"
+        key_values = set(key_values)
+        if not key_values:
+            return {}
+        self.bulk_create([Tag(key=key, value=value) for key, value in key_values], ignore_conflicts=True)
+        lookup = reduce(or_, (Q(key=key, value=value) for key, value in key_values))
+        return {(tag.key, tag.value): tag for tag in self.filter(lookup)}
+
 
 class Tag(models.Model):
     TAG_DELIMITER = "="
@@ -217,28 +231,65 @@ class Event(models.Model):
     }
     ALLOWED_TYPES_FOR_END_USERS = {Type.CLOSE, Type.REOPEN, Type.ACKNOWLEDGE, Type.OTHER}
 
-    incident = models.ForeignKey(to="Incident", on_delete=models.PROTECT, related_name="events")
+    # Indexed first in event_incident_type_time_idx
+    incident = models.ForeignKey(to="Incident", on_delete=models.PROTECT, related_name="events", db_index=False)
     actor = models.ForeignKey(to=User, on_delete=models.PROTECT, related_name="caused_events")
     timestamp = models.DateTimeField()
     received = models.DateTimeField(default=timezone.now)
     type = models.TextField(choices=Type.choices)
     description = models.TextField(blank=True)
+    # Whether the description has been added to Incident.search_text, see argus.incident.search_index
+    search_indexed = models.BooleanField(default=False, editable=False)
 
     class Meta:
+        indexes = [
+            models.Index(fields=["id"], condition=Q(search_indexed=False), name="event_not_search_indexed_idx"),
+            # Incident.start_event, end_event and the like
+            models.Index(fields=["incident", "type", "timestamp"], name="event_incident_type_time_idx"),
+        ]
         ordering = ["-timestamp"]
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        # update incident.search_text
-        if self.description in self.incident.search_text:
-            return
-        self.incident.search_text += " " + self.description
-        self.incident.save(force_update=True, update_fields=["search_text"])
+        # Anything written by post_save receivers, like queued notifications,
+        # is committed together with the event
+        with transaction.atomic():
+            adding = self._state.adding
+            super().save(*args, **kwargs)
+            if adding:
+                bulk_changed.send(sender=Incident, instances=[self.incident])
 
     def __str__(self):
         return f"'{self.get_type_display()}': {self.incident.description}, {self.actor} @ {self.timestamp}"
 
 
+# No stemming or stop words, so that host names, ids and the like are found as written
+SEARCH_CONFIG = "simple"
+
+
+def get_incident_search_vector():
+    "The document searched by ``IncidentQuerySet.search``, must match the index on ``Incident``"
+    return SearchVector("description", weight="A", config=SEARCH_CONFIG) + SearchVector(
+        "search_text", weight="B", config=SEARCH_CONFIG
+    )
+
+
+def get_incident_search_query(text: str):
+    """Match incidents having all the words in ``text``, or words starting with them
+
+    Words are separated by whitespace or commas, like for DRF's ``SearchFilter``.
+    Returns None if there are no words to look for.
+    """
+    terms = [term for term in re.split(r"[\s,]+", text) if re.search(r"\w", term)]
+    if not terms:
+        return None
+    quoted = ("'" + term.replace("\\", "\\\\").replace("'", "''") + "':*" for term in terms)
+    return SearchQuery(" & ".join(quoted), config=SEARCH_CONFIG, search_type="raw")
+
+
+# Gives every published change to an incident a number higher than the ones before
+CHANGE_SEQUENCE = "argus_incident_change_seq"
+
+
 class IncidentQuerySet(models.QuerySet):
     def stateful(self):
         return self.filter(end_time__isnull=False)
@@ -253,10 +304,10 @@ class IncidentQuerySet(models.QuerySet):
         return self.filter(end_time__lte=timezone.now())
 
     def acked(self):
-        return self.filter(id__in=self._get_acked_incident_ids())
+        return self.filter(acked_until__gt=timezone.now())
 
     def not_acked(self):
-        return self.exclude(id__in=self._get_acked_incident_ids())
+        return self.filter(Q(acked_until__isnull=True) | Q(acked_until__lte=timezone.now()))
 
     def has_ticket(self):
         return self.exclude(ticket_url="")
@@ -265,15 +316,56 @@ class IncidentQuerySet(models.QuerySet):
         return self.filter(ticket_url="")
 
     def prefetch_default_related(self):
-        return self.prefetch_related("incident_tag_relations__tag", "source__type")
+        "Fetch what serializing incidents needs, in one extra query for the tags"
+        tag_relations = IncidentTagRelation.objects.select_related("tag")
+        return self.select_related("source__type").prefetch_related(Prefetch("incident_tag_relations", tag_relations))
+
+    def search(self, text: str):
+        "Incidents matching ``text``, annotated with how well they match as ``search_rank``"
+        query = get_incident_search_query(text)
+        if query is None:
+            return self.none()
+        vector = get_incident_search_vector()
+        # ts_rank() returns a real, which does not survive the round trip through Python exactly
+        rank = Cast(SearchRank(vector, query), models.FloatField())
+        return self.alias(search_vector=vector).filter(search_vector=query).annotate(search_rank=rank)
+
+    def bump_change_seq(self) -> int:
+        """Give the incidents a ``change_seq`` higher than that of any earlier change
+
+        The numbers are handed out one transaction at a time, and so committed
+        in order. Otherwise a reader could see a change before one with a lower
+        number is committed, and skip that one for good when it moves on.
+        """
+        nextval = Func(Value(CHANGE_SEQUENCE), function="nextval", output_field=models.BigIntegerField())
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Held until the numbers are committed
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [CHANGE_SEQUENCE])
+            return self.update(change_seq=nextval)
+
+    def changed_since(self, seq: int):
+        "Incidents changed after the change numbered ``seq``, oldest change first"
+        return self.filter(change_seq__gt=seq).order_by("change_seq")
+
+    def last_change_seq(self) -> int:
+        "The ``change_seq`` of the latest change, 0 if there are none"
+        return self.aggregate(seq=Coalesce(Max("change_seq"), 0))["seq"]
 
     def from_tags(self, *tags):
+        """Incidents that for every key in ``tags`` have at least one of the tags with that key
+
+        The incidents are found with a single grouped subquery on their tag
+        relations, so nothing is looked up before the incidents are.
+        """
         tag_qss = Tag.objects.parse(*tags)
-        qs = []
-        for tag_qs in tag_qss:
-            qs.append(self.filter(incident_tag_relations__tag__in=tag_qs))
-        qs = reduce(and_, qs)
-        return qs.distinct()
+        relations = (
+            IncidentTagRelation.objects.filter(tag__in=reduce(or_, tag_qss))
+            .values("incident_id")
+            .annotate(matched_keys=Count("tag__key", distinct=True))
+            .filter(matched_keys=len(tag_qss))
+        )
+        return self.filter(pk__in=relations.values("incident_id"))
 
     def is_longer_than_minutes(self, minutes):
         min_duration = timedelta(minutes=minutes)
@@ -290,16 +382,46 @@ class IncidentQuerySet(models.QuerySet):
 
         return self.filter(source_id=argus_source_system.id).filter(incident_tag_relations__tag=token_expiry_tag)
 
-    # Cannot be a constant, because `timezone.now()` would have been evaluated at compile time
     @staticmethod
-    def _get_acked_incident_ids():
-        current_acks = Acknowledgement.objects.active().prefetch_related("event__incident")
-        return current_acks.values_list("event__incident", flat=True).distinct()
+    def _get_acked_until():
+        "Subquery for when the last acknowledgement of an incident expires"
+        latest_expiration = Coalesce(
+            "expiration",
+            Value(INFINITY_REPR, output_field=DateTimeInfinityField()),
+            output_field=DateTimeInfinityField(),
+        )
+        acks = Acknowledgement.objects.filter(event__incident=OuterRef("pk")).annotate(until=latest_expiration)
+        return Subquery(acks.order_by("-until").values("until")[:1])
+
+    def acked_until_out_of_date(self):
+        "Incidents whose ``acked_until`` does not match their acknowledgements"
+        qs = self.annotate(expected_acked_until=self._get_acked_until())
+        return qs.filter(
+            Q(acked_until__lt=F("expected_acked_until"))
+            | Q(acked_until__gt=F("expected_acked_until"))
+            | Q(acked_until__isnull=True, expected_acked_until__isnull=False)
+            | Q(acked_until__isnull=False, expected_acked_until__isnull=True)
+        )
+
+    def update_acked_until(self):
+        """Recompute ``acked_until`` from the acknowledgements
+
+        The incidents it changes are announced with ``bulk_changed``. Returns
+        the number of changed incidents.
+        """
+        pks = list(self.acked_until_out_of_date().values_list("pk", flat=True))
+        if not pks:
+            return 0
+        changed = self.model.objects.filter(pk__in=pks)
+        count = changed.update(acked_until=self._get_acked_until())
+        bulk_changed.send(sender=self.model, instances=list(changed))
+        return count
 
     def create_acks(self, actor: User, timestamp=None, description="", expiration=None):
         events = self.create_events(actor, Event.Type.ACKNOWLEDGE, timestamp, description)
         ack_objs = [Acknowledgement(event=event, expiration=expiration) for event in events]
         Acknowledgement.objects.bulk_create(ack_objs)
+        self.update_acked_until()
         qs = Acknowledgement.objects.filter(event__in=events)
         return qs
 
@@ -307,7 +429,8 @@ class IncidentQuerySet(models.QuerySet):
         """
         Create events of type ``event_type``, does not change dependent objects
 
-        This means that no signals are sent. On CLOSE, INCIDENT_END or REOPEN,
+        Only the search text of the incidents is updated. This means that no
+        signals are sent. On CLOSE, INCIDENT_END or REOPEN,
         the incident for the event keeps its original end_time. Also, it is not
         possible to set an expiration time for an ack.
         """
@@ -332,6 +455,108 @@ class IncidentQuerySet(models.QuerySet):
         )
         return qs
 
+    def create_incidents(self, user: User, source: SourceSystem, incidents_data: list[dict]):
+        """
+        Create incidents with their tags and first events in a few queries
+
+        Every dict in ``incidents_data`` holds the fields of one incident and
+        a list of tags as dicts of key and value, like the validated data of
+        ``IncidentSerializer``. Like ``create_events``, no signals are sent.
+        Returns the new incidents and their first events.
+        """
+        with transaction.atomic():
+            tags = Tag.objects.get_or_create_many(
+                (tag_data["key"], tag_data["value"]) for data in incidents_data for tag_data in data["tags"]
+            )
+            end_time_field = Incident._meta.get_field("end_time")
+            incidents = []
+            for data in incidents_data:
+                data = {key: value for key, value in data.items() if key != "tags"}
+                incident = Incident(source=source, **data)
+                incident.end_time = end_time_field.to_python(incident.end_time)
+                incidents.append(incident)
+            self.bulk_create(incidents)
+
+            relations = {}
+            for incident, data in zip(incidents, incidents_data):
+                for tag_data in data["tags"]:
+                    tag = tags[(tag_data["key"], tag_data["value"])]
+                    relations[(tag.pk, incident.pk)] = IncidentTagRelation(tag=tag, incident=incident, added_by=user)
+            IncidentTagRelation.objects.bulk_create(relations.values())
+
+            events = [
+                Event(
+                    incident=incident,
+                    actor=source.user,
+                    timestamp=incident.start_time,
+                    type=Event.Type.INCIDENT_START if incident.stateful else Event.Type.STATELESS,
+                    description=incident.description,
+                )
+                for incident in incidents
+            ]
+            Event.objects.bulk_create(events)
+        return incidents, events
+
+    def upsert(self, source: SourceSystem, data: dict):
+        """
+        Create an incident, or update the one of ``source`` with the same source_incident_id
+
+        Only the fields in ``Incident.UPSERT_FIELDS`` that are in ``data`` are
+        updated, in the same statement as the insert and only if any of them
+        changed. Like ``create_events``, no signals are sent and no events are
+        created. Returns the incident, whether it was created, and the old
+        values of the fields that were changed.
+        """
+        incident = Incident(source=source, **data)
+        incident.end_time = Incident._meta.get_field("end_time").to_python(incident.end_time)
+        fields = [field for field in Incident._meta.concrete_fields if not field.primary_key]
+        values = [field.get_db_prep_save(field.pre_save(incident, True), connection) for field in fields]
+        update_fields = [Incident._meta.get_field(name) for name in Incident.UPSERT_FIELDS if name in data]
+
+        qn = connection.ops.quote_name
+        table = qn(Incident._meta.db_table)
+        selected = ["COALESCE(new.id, old.id)", "COALESCE(new.created, false)", "new.id IS NOT NULL"]
+        selected.extend(f"old.{qn(field.column)}" for field in update_fields)
+        if update_fields:
+            existing = ", ".join(f"{table}.{qn(field.column)}" for field in update_fields)
+            excluded = ", ".join(f"EXCLUDED.{qn(field.column)}" for field in update_fields)
+            assignments = ", ".join(f"{qn(field.column)} = EXCLUDED.{qn(field.column)}" for field in update_fields)
+            on_conflict = f"DO UPDATE SET {assignments} WHERE ROW({existing}) IS DISTINCT FROM ROW({excluded})"
+        else:
+            on_conflict = "DO NOTHING"
+        # "old" sees the row as it was before the insert, since all parts of
+        # the statement see the same snapshot
+        sql = f"""
+            WITH old AS (
+                SELECT * FROM {table} WHERE source_id = %s AND source_incident_id = %s
+            ), new AS (
+                INSERT INTO {table} ({", ".join(qn(field.column) for field in fields)})
+                VALUES ({", ".join(["%s"] * len(fields))})
+                ON CONFLICT (source_incident_id, source_id) WHERE source_incident_id > ''
+                {on_conflict}
+                RETURNING id, xmax = 0 AS created
+            )
+            SELECT {", ".join(selected)}
+            FROM old FULL JOIN new ON old.id = new.id
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [source.pk, incident.source_incident_id, *values])
+            row = cursor.fetchone()
+        if row is None:
+            # Created by someone else after this statement started, unchanged
+            return self.get(source=source, source_incident_id=incident.source_incident_id), False, {}
+
+        pk, created, written, *old_values = row
+        incident = self.get(pk=pk)
+        changed = {}
+        if written and not created:
+            for field, old_value in zip(update_fields, old_values):
+                if hasattr(field, "from_db_value"):
+                    old_value = field.from_db_value(old_value, None, connection)
+                if old_value != getattr(incident, field.attname):
+                    changed[field.name] = old_value
+        return incident, created, changed
+
     def close(self, actor: User, timestamp=None, description=""):
         "Close incidents correctly and create the needed events"
         qs = self.open()
@@ -374,6 +599,7 @@ class Incident(models.Model):
         on_delete=models.PROTECT,
         related_name="incidents",
         help_text="The source system that the incident originated in.",
+        db_index=False,  # Indexed first in incident_source_start_time_idx
     )
     source_incident_id = models.TextField(blank=True, default="", verbose_name="source incident ID")
     details_url = models.TextField(blank=True, validators=[URLValidator], verbose_name="details URL")
@@ -387,9 +613,29 @@ class Incident(models.Model):
     )
     search_text = models.TextField(blank=True, default="", verbose_name="Search Text")
     metadata = models.JSONField(blank=True, default=dict)
+    # Kept up to date from the acknowledgements, so that filtering on acked is cheap
+    acked_until = DateTimeInfinityField(
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=True,
+        help_text="When the last acknowledgement expires. Empty if the incident was never acknowledged.",
+    )
+    # Set when a change is published, see argus.ws.publish
+    change_seq = models.BigIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="The number of the latest published change. Empty for incidents from before changes were numbered.",
+    )
 
     objects = IncidentQuerySet.as_manager()
 
+    # Fields that a source system may change by posting the incident again
+    UPSERT_FIELDS = ("details_url", "description", "level", "ticket_url", "metadata")
+    # Fields only changed by queries of their own, never by saving an instance
+    DATABASE_MAINTAINED_FIELDS = ("search_text", "acked_until", "change_seq")
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -398,6 +644,16 @@ class Incident(models.Model):
                 name="%(class)s_unique_source_incident_id_per_source",
             ),
         ]
+        indexes = [
+            GinIndex(get_incident_search_vector(), name="incident_search_idx"),
+            # Paging through incidents, newest first
+            models.Index(fields=["-start_time"], name="incident_start_time_idx"),
+            # Open incidents, which are few compared to the closed ones
+            models.Index(fields=["end_time"], name="incident_end_time_idx"),
+            models.Index(fields=["source", "-start_time"], name="incident_source_start_time_idx"),
+            # Catching up on changes
+            models.Index(fields=["change_seq"], name="incident_change_seq_idx", condition=Q(change_seq__isnull=False)),
+        ]
         ordering = ["-start_time"]
 
     def __str__(self):
@@ -407,6 +663,13 @@ class Incident(models.Model):
     def save(self, *args, **kwargs):
         # Parse and replace `end_time`, to avoid having to call `refresh_from_db()`
         self.end_time = self._meta.get_field("end_time").to_python(self.end_time)
+        if not (args or self._state.adding or kwargs.get("force_insert") or kwargs.get("update_fields") is not None):
+            # Do not write back the stale values of an instance loaded earlier
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.DATABASE_MAINTAINED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     @property
@@ -465,15 +728,12 @@ class Incident(models.Model):
 
     @property
     def acked(self):
-        acks_query = Q(ack__isnull=False)
-        acks_not_expired_query = Q(ack__expiration__isnull=True) | Q(ack__expiration__gt=timezone.now())
-        # This is specifically for when acks are just created
-        # The event (with type ACK) is created before the acknowledgement
-        # which triggers the notification sending which uses this function
-        # which is why we have to have this additional check
-        ack_is_just_being_created = Q(type=Event.Type.ACKNOWLEDGE) & Q(ack__isnull=True)
+        return self.acked_until is not None and self.acked_until > timezone.now()
 
-        return self.events.filter((acks_query & acks_not_expired_query) | ack_is_just_being_created).exists()
+    def refresh_acked_until(self):
+        "Recompute ``acked_until`` from the acknowledgements"
+        Incident.objects.filter(pk=self.pk).update_acked_until()
+        self.refresh_from_db(fields=["acked_until"])
 
     def is_acked_by(self, group: str) -> bool:
         return group in self.acks.active().group_names()
@@ -656,7 +916,7 @@ class AcknowledgementQuerySet(models.QuerySet):
 
 class Acknowledgement(models.Model):
     event = models.OneToOneField(to=Event, on_delete=models.PROTECT, primary_key=True, related_name="ack")
-    expiration = models.DateTimeField(null=True, blank=True)
+    expiration = models.DateTimeField(null=True, blank=True, db_index=True)
 
     objects = AcknowledgementQuerySet.as_manager()
 
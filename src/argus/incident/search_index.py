@@ -0,0 +1,82 @@
+"""Catch up on event descriptions missing from the search text of incidents
+
+``Incident.search_text`` holds the descriptions of the events of an incident,
+so that searching for incidents finds words in them. Adding to it when each
+event is saved would cost an extra UPDATE of the incident on every event.
+Instead new events are marked as not indexed, and ``index_events`` adds their
+descriptions in batches. The command `index_incident_search` runs it
+continuously.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+import logging
+
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+
+from .models import Event, Incident
+
+
+__all__ = [
+    "index_events",
+]
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def index_events(batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Add the descriptions of up to ``batch_size`` new events to the search text of their incidents
+
+    Events that are being indexed by someone else are skipped. Returns the
+    number of events indexed.
+    """
+    with transaction.atomic():
+        events = list(
+            Event.objects.filter(search_indexed=False)
+            .order_by("pk")
+            .select_for_update(skip_locked=True)
+            .only("pk", "incident_id", "description")[:batch_size]
+        )
+        if not events:
+            return 0
+        _add_to_search_text(events)
+        Event.objects.filter(pk__in=[event.pk for event in events]).update(search_indexed=True)
+    LOG.debug("Indexed %i events", len(events))
+    return len(events)
+
+
+def _add_to_search_text(events: list[Event]):
+    """Append the descriptions of ``events`` to the search text of their incidents
+
+    A description is added once per incident: it is skipped if another
+    indexed event of the incident has the same description, which is looked up
+    among the events instead of searched for in the search text.
+    """
+    pks = [event.pk for event in events]
+    descriptions = {event.description for event in events if event.description}
+    if not descriptions:
+        return
+    incident_ids = {event.incident_id for event in events}
+    seen = set(
+        Event.objects.filter(incident_id__in=incident_ids, description__in=descriptions, search_indexed=True)
+        .exclude(pk__in=pks)
+        .values_list("incident_id", "description")
+    )
+    texts = defaultdict(str)
+    for event in events:
+        key = (event.incident_id, event.description)
+        if event.description and key not in seen:
+            seen.add(key)
+            texts[event.incident_id] += " " + event.description
+    incidents = []
+    for incident_id, text in texts.items():
+        incident = Incident(pk=incident_id)
+        incident.search_text = Concat(F("search_text"), Value(text))
+        incidents.append(incident)
+    Incident.objects.bulk_update(incidents, ["search_text"])
@@ -3,6 +3,7 @@ from collections import OrderedDict
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.core.validators import URLValidator
+from django.db import transaction
 from django.utils import timezone
 
 from rest_framework import serializers
@@ -139,6 +140,46 @@ class IncidentSerializer(serializers.ModelSerializer):
 
         return incident
 
+    @transaction.atomic
+    def upsert(self, user: User, source: SourceSystem) -> tuple[bool, bool]:
+        """
+        Create the incident, or update the one with the same source_incident_id
+
+        An existing incident gets the posted tags it lacks, and the posted
+        values of ``Incident.UPSERT_FIELDS``, with a change event for each.
+        Returns whether the incident was created and whether it was changed.
+        """
+        validated_data = dict(self.validated_data)
+        tags_data = validated_data.pop("tags")
+        incident, created, changed = Incident.objects.upsert(source, validated_data)
+        self.instance = incident
+
+        tags = Tag.objects.get_or_create_many((tag_data["key"], tag_data["value"]) for tag_data in tags_data)
+        existing_tags = set()
+        if not created:
+            existing_tags = {relation.tag for relation in incident.incident_tag_relations.select_related("tag")}
+        add_tags = set(tags.values()) - existing_tags
+        IncidentTagRelation.objects.bulk_create(
+            [IncidentTagRelation(tag=tag, incident=incident, added_by=user) for tag in add_tags]
+        )
+
+        if created:
+            incident.create_first_event()
+            return True, True
+
+        timestamp = timezone.now()
+        for attr, old_value in changed.items():
+            description = ChangeEvent.format_description(attr, old_value, getattr(incident, attr))
+            ChangeEvent.objects.create(incident=incident, actor=user, timestamp=timestamp, description=description)
+        if add_tags:
+            description = ChangeEvent.format_description(
+                "tags",
+                [str(tag) for tag in existing_tags],
+                [str(tag) for tag in existing_tags | add_tags],
+            )
+            ChangeEvent.objects.create(incident=incident, actor=user, timestamp=timestamp, description=description)
+        return False, bool(changed or add_tags)
+
     def update(self, *args, **kwargs):
         """
         Use `IncidentPureDeserializer` instead.
@@ -148,7 +189,7 @@ class IncidentSerializer(serializers.ModelSerializer):
     def to_representation(self, instance: Incident):
         incident_repr = super().to_representation(instance)
 
-        tags_field: IncidentTagRelationSerializer = self.get_fields()["tags"]
+        tags_field: IncidentTagRelationSerializer = self.fields["tags"]
         incident_repr["tags"] = tags_field.to_representation(instance.incident_tag_relations.all())
 
         incident_repr["details_url"] = instance.pp_details_url()
@@ -435,6 +476,11 @@ class RequestBulkTicketUrlSerializer(serializers.ModelSerializer):
         ]
 
 
+class RequestBulkIncidentSerializer(serializers.Serializer):
+    # Every incident is validated on its own with IncidentSerializer
+    incidents = serializers.ListField(child=serializers.DictField(), allow_empty=False)
+
+
 class ResponseBulkSerializer(serializers.Serializer):
     changes = serializers.JSONField()
 
@@ -1,13 +1,18 @@
+from django.conf import settings
 from django.db.models import Q
 from rest_framework.authtoken.models import Token
 
 from argus.notificationprofile.media import send_notifications_to_users
 from argus.notificationprofile.media import background_send_notification
 from argus.notificationprofile.media import send_notification
+from argus.notificationprofile.media.digest import get_digest_window
+from argus.notificationprofile.outbox import enqueue_notifications
+from argus.util.signals import bulk_changed
 from .models import (
     Acknowledgement,
     Event,
     Incident,
+    IncidentTagRelation,
     SourceSystem,
     Tag,
     get_or_create_default_instances,
@@ -18,6 +23,8 @@ __all__ = [
     "delete_associated_user",
     "send_notification",
     "delete_associated_event",
+    "update_acked_until",
+    "announce_tag_change",
     "close_token_incident",
 ]
 
@@ -31,8 +38,36 @@ def task_send_notification(sender, instance: Event, *args, **kwargs):
     send_notifications_to_users(instance)
 
 
+def get_background_send():
+    "Digests are also sent in the background, so leave them to ``send_notifications_to_users``"
+    return None if get_digest_window() else background_send_notification
+
+
 def task_background_send_notification(sender, instance: Event, *args, **kwargs):
-    send_notifications_to_users(instance, send=background_send_notification)
+    send_notifications_to_users(instance, send=get_background_send())
+
+
+def task_queue_notification(sender, instance: Event, *args, **kwargs):
+    enqueue_notifications(instance)
+
+
+def send_notifications_for_events(*events: Event):
+    "Notify about events that were created without sending post_save"
+    if not events:
+        return
+    if getattr(settings, "NOTIFICATION_DELIVERY", "background") == "database":
+        enqueue_notifications(*events)
+    else:
+        send_notifications_to_users(*events, send=get_background_send())
+
+
+def update_acked_until(sender, instance: Acknowledgement, *args, **kwargs):
+    instance.event.incident.refresh_acked_until()
+
+
+def announce_tag_change(sender, instance: IncidentTagRelation, *args, **kwargs):
+    # A lazy queryset, the incident may be gone if it is being deleted
+    bulk_changed.send(sender=Incident, instances=Incident.objects.filter(pk=instance.incident_id))
 
 
 def delete_associated_event(sender, instance: Acknowledgement, *args, **kwargs):
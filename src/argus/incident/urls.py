@@ -27,11 +27,16 @@ tag_detail = views.IncidentTagViewSet.as_view({"get": "retrieve", "delete": "des
 ticket_plugin_detail = views.TicketPluginViewSet.as_view({"put": "update"})
 ticket_url_bulk_list = views.BulkTicketUrlViewSet.as_view({"post": "create"})
 
+incidents_bulk_list = views.BulkIncidentViewSet.as_view({"post": "create"})
+incidents_ingest = views.IncidentIngestViewSet.as_view({"post": "create"})
+
 app_name = "incident"
 urlpatterns = [
     path("acks/bulk/", acks_bulk_list, name="incident-acks-bulk"),
+    path("bulk/", incidents_bulk_list, name="incidents-bulk"),
     path("events/", all_events_list, name="events"),
     path("events/bulk/", events_bulk_list, name="incident-events-bulk"),
+    path("ingest/", incidents_ingest, name="incidents-ingest"),
     path("mine/", sourced_incident_list, name="source_locked_incidents"),
     path("ticket_url/bulk/", ticket_url_bulk_list, name="incident-ticket-url-bulk"),
     path("<int:incident_pk>/events/", event_list, name="incident-events"),
@@ -1,15 +1,20 @@
+from itertools import islice
+import json
 import logging
 import secrets
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import IntegrityError
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 
 from django_filters import rest_framework as filters
 from rest_framework.filters import SearchFilter
 from drf_rw_serializers import viewsets as rw_viewsets
 from drf_spectacular.utils import extend_schema, extend_schema_view
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, OpenApiResponse
 from rest_framework import mixins, serializers, status, viewsets
 from rest_framework.decorators import action
@@ -17,14 +22,18 @@ from rest_framework.exceptions import ValidationError, PermissionDenied, MethodN
 from rest_framework.generics import get_object_or_404
 from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.utils.encoders import JSONEncoder
 
 from argus.drf.permissions import IsSuperuserOrReadOnly
+from argus.drf.renderers import EventStreamRenderer
 from argus.filter import get_filter_backend
 from argus.util.datetime_utils import INFINITY_REPR
 from argus.util.signals import bulk_changed
 
+from .event_stream import IncidentEventStream
 from .forms import AddSourceSystemForm
 from .models import (
     Acknowledgement,
@@ -35,6 +44,7 @@ from .models import (
     SourceSystemType,
     Tag,
 )
+from .signals import send_notifications_for_events
 from .serializers import (
     UpdateAcknowledgementSerializer,
     EmptySerializer,
@@ -45,6 +55,7 @@ from .serializers import (
     RequestAcknowledgementSerializer,
     RequestBulkAcknowledgementSerializer,
     RequestBulkEventSerializer,
+    RequestBulkIncidentSerializer,
     RequestBulkTicketUrlSerializer,
     ResponseAcknowledgementSerializer,
     ResponseBulkSerializer,
@@ -76,15 +87,61 @@ User = get_user_model()
 
 LOG = logging.getLogger(__name__)
 
+SOURCE_INCIDENT_ID_CONSTRAINT = "incident_unique_source_incident_id_per_source"
 
-def send_changed_incidents(incidents):
-    bulk_changed.send(sender=Incident, instances=incidents)
+
+def send_changed_incidents(incidents, created=False):
+    bulk_changed.send(sender=Incident, instances=incidents, created=created)
+
+
+def send_bulk_notifications(events):
+    "Events created in bulk send no post_save, so notify about them here if enabled"
+    if getattr(settings, "SEND_BULK_NOTIFICATIONS", False):
+        send_notifications_for_events(*events)
+
+
+def get_source_for_incidents(user, data) -> SourceSystem:
+    "Get the source of incidents posted by ``user``, only superusers may pick one"
+    if "source" in data:
+        if not user.is_superuser:
+            raise serializers.ValidationError("You must be a superuser to be allowed to specify the 'source' field.")
+
+        source_pk = data["source"]
+        try:
+            return SourceSystem.objects.get(pk=int(source_pk))
+        except (TypeError, ValueError):
+            raise ValidationError(f"'source' must be the pk of a SourceSystem, not {source_pk!r}.")
+        except SourceSystem.DoesNotExist:
+            raise ValidationError(f"SourceSystem with pk={source_pk} does not exist.")
+    try:
+        return user.source_system
+    except SourceSystem.DoesNotExist:
+        raise ValidationError("The requesting user must have a connected source system.")
 
 
 class IncidentPagination(CursorPagination):
     ordering = "-start_time"
     page_size_query_param = "page_size"
 
+    def get_ordering(self, request, queryset, view):
+        # Best matches first when searching
+        if "search_rank" in queryset.query.annotations:
+            return ("-search_rank", "-start_time")
+        return super().get_ordering(request, queryset, view)
+
+
+class IncidentSearchFilter(SearchFilter):
+    search_description = (
+        "Full text search in the description of incidents and their events. Incidents must have all the words,"
+        " or words starting with them."
+    )
+
+    def filter_queryset(self, request, queryset, view):
+        search_terms = self.get_search_terms(request)
+        if not search_terms:
+            return queryset
+        return queryset.search(" ".join(search_terms))
+
 
 class EventPagination(CursorPagination):
     ordering = "-timestamp"
@@ -146,7 +203,6 @@ class BaseIncidentViewSet(
     pagination_class = IncidentPagination
     permission_classes = [IsAuthenticated]
     queryset = Incident.objects.prefetch_default_related()
-    search_fields = ["description", "search_text"]
 
     def get_serializer_class(self):
         if self.request.method in {"PUT", "PATCH"}:
@@ -160,25 +216,37 @@ class BaseIncidentViewSet(
             return Response(response_dict)
         return super().list(request, *args, **kwargs)
 
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name="upsert",
+                description="Update the incident with the same source incident ID instead of failing.",
+                type=bool,
+            ),
+        ],
+        responses={201: IncidentSerializer, 200: IncidentSerializer},
+    )
+    def create(self, request, *args, **kwargs):
+        upsert = request.query_params.get("upsert", "").lower() in {"true", "1"}
+        if not upsert:
+            return super().create(request, *args, **kwargs)
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not serializer.validated_data.get("source_incident_id"):
+            # Nothing to look for
+            self.perform_create(serializer)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        source = get_source_for_incidents(request.user, serializer.initial_data)
+        created, changed = serializer.upsert(user=request.user, source=source)
+        if changed:
+            send_changed_incidents([serializer.instance], created=created)
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
     def perform_create(self, serializer):
         user = self.request.user
-
-        if "source" in serializer.initial_data:
-            if not user.is_superuser:
-                raise serializers.ValidationError(
-                    "You must be a superuser to be allowed to specify the 'source' field."
-                )
-
-            source_pk = serializer.initial_data["source"]
-            try:
-                source = SourceSystem.objects.get(pk=source_pk)
-            except SourceSystem.DoesNotExist:
-                raise ValidationError(f"SourceSystem with pk={source_pk} does not exist.")
-        else:
-            try:
-                source = user.source_system
-            except SourceSystem.DoesNotExist:
-                raise ValidationError("The requesting user must have a connected source system.")
+        source = get_source_for_incidents(user, serializer.initial_data)
 
         # TODO: send notifications to users
         try:
@@ -256,15 +324,50 @@ class IncidentViewSet(BaseIncidentViewSet):
     Paged using a cursor
     """
 
-    filter_backends = [filters.DjangoFilterBackend, SearchFilter]
+    filter_backends = [filters.DjangoFilterBackend, IncidentSearchFilter]
     filterset_class = IncidentFilter
 
     def get_queryset(self):
         if self.request.method != "GET":
             return super().get_queryset()
-        return (
-            Incident.objects.prefetch_default_related().select_related("source").prefetch_related("events__ack").all()
-        )
+        return Incident.objects.prefetch_default_related().all()
+
+    @extend_schema(
+        parameters=[
+            *INCIDENT_OPENAPI_PARAMETER_DESCRIPTIONS,
+            OpenApiParameter(
+                name="since",
+                description="Send the changes after this event id. The header Last-Event-ID takes precedence.",
+                type=int,
+            ),
+        ],
+        responses={(200, "text/event-stream"): OpenApiTypes.STR},
+    )
+    @action(detail=False, methods=["get"], renderer_classes=[EventStreamRenderer, JSONRenderer])
+    def stream(self, request):
+        """Stream changes to incidents as server-sent events
+
+        Takes the same filter parameters as the list of incidents. Every
+        changed incident that fits them is sent as an "incident" event, with
+        the number of the change as id. Without ``since`` or ``Last-Event-ID``
+        only changes from now on are sent. The stream ends after a few minutes,
+        clients are expected to reconnect.
+        """
+        seq = request.headers.get("Last-Event-ID") or request.query_params.get("since")
+        if seq is None:
+            seq = Incident.objects.last_change_seq()
+        else:
+            seq = serializers.IntegerField(min_value=0).run_validation(seq)
+        # Fail on invalid filter parameters before streaming starts
+        self.filter_queryset(Incident.objects.none())
+
+        stream = IncidentEventStream(seq, self.filter_queryset)
+        content = stream.__aiter__() if isinstance(request._request, ASGIRequest) else iter(stream)
+        response = StreamingHttpResponse(content, content_type="text/event-stream")
+        response["Cache-Control"] = "no-cache"
+        # Do not let nginx hold back the events
+        response["X-Accel-Buffering"] = "no"
+        return response
 
 
 @extend_schema_view(
@@ -433,27 +536,11 @@ class AllEventsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
         return Event.objects.all()
 
 
-@extend_schema_view(
-    list=extend_schema(
-        operation_id="api_v2_events_per_incident_list",
-        parameters=[
-            OpenApiParameter(name="cursor", description="The pagination cursor value.", type=str),
-        ],
-    )
-)
-class EventViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
-    queryset = Incident.objects.none()  # For OpenAPI
-    permission_classes = [IsAuthenticated]
-    serializer_class = EventSerializer
-
-    def get_queryset(self):
-        incident_pk = self.kwargs["incident_pk"]
-        incident = get_object_or_404(Incident.objects.all(), pk=incident_pk)
-        return incident.events.all()
+class EventHelper:
+    """Methods that views creating events need"""
 
-    def perform_create(self, serializer: EventSerializer):
+    def save_event(self, serializer: EventSerializer, incident: Incident):
         user = self.request.user
-        incident = Incident.objects.get(pk=self.kwargs["incident_pk"])
 
         event_type = serializer.validated_data["type"]
         self.validate_event_type_for_user(event_type, user)
@@ -520,6 +607,35 @@ class EventViewSet(mixins.ListModelMixin, mixins.CreateModelMixin, mixins.Retrie
         raise serializers.ValidationError({"type": message})
 
 
+@extend_schema_view(
+    list=extend_schema(
+        operation_id="api_v2_events_per_incident_list",
+        parameters=[
+            OpenApiParameter(name="cursor", description="The pagination cursor value.", type=str),
+        ],
+    )
+)
+class EventViewSet(
+    EventHelper,
+    mixins.ListModelMixin,
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet,
+):
+    queryset = Incident.objects.none()  # For OpenAPI
+    permission_classes = [IsAuthenticated]
+    serializer_class = EventSerializer
+
+    def get_queryset(self):
+        incident_pk = self.kwargs["incident_pk"]
+        incident = get_object_or_404(Incident.objects.all(), pk=incident_pk)
+        return incident.events.all()
+
+    def perform_create(self, serializer: EventSerializer):
+        incident = Incident.objects.get(pk=self.kwargs["incident_pk"])
+        self.save_event(serializer, incident)
+
+
 @extend_schema_view(
     create=extend_schema(
         request=RequestAcknowledgementSerializer,
@@ -614,14 +730,17 @@ class BulkAcknowledgementViewSet(BulkHelper, viewsets.ViewSet):
 
         qs, changes, status_codes_seen = self.bulk_setup(incident_ids)
 
-        acks = qs.create_acks(actor, timestamp, description, expiration)
-        # send notifications manually
+        acks = (
+            qs.create_acks(actor, timestamp, description, expiration)
+            .select_related("event__incident__source__type")
+            .prefetch_related("event__incident__incident_tag_relations__tag")
+        )
 
-        event_ids = []
+        events = []
         incidents = []
         for ack in acks:
             event = ack.event
-            event_ids.append(event.id)
+            events.append(event)
             incident_id = event.incident_id
             incidents.append(event.incident)
             changes[str(incident_id)] = {
@@ -632,6 +751,7 @@ class BulkAcknowledgementViewSet(BulkHelper, viewsets.ViewSet):
             status_codes_seen.add(status.HTTP_201_CREATED)
 
         send_changed_incidents(incidents)
+        send_bulk_notifications(events)
 
         all_bad = status_codes_seen == set((status.HTTP_400_BAD_REQUEST,))
         return Response(
@@ -673,7 +793,9 @@ class BulkEventViewSet(BulkHelper, viewsets.ViewSet):
             events = qs.reopen(actor, timestamp, description)
         else:
             events = qs.create_events(actor, event_type, timestamp, description)
-        # send notifications manually
+        events = list(
+            events.select_related("incident__source__type").prefetch_related("incident__incident_tag_relations__tag")
+        )
 
         incidents = []
         for event in events:
@@ -687,6 +809,7 @@ class BulkEventViewSet(BulkHelper, viewsets.ViewSet):
             status_codes_seen.add(status.HTTP_201_CREATED)
 
         send_changed_incidents(incidents)
+        send_bulk_notifications(events)
 
         all_bad = status_codes_seen == set((status.HTTP_400_BAD_REQUEST,))
         return Response(
@@ -704,7 +827,7 @@ class BulkTicketUrlViewSet(BulkHelper, viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
     serializer_class = ResponseBulkSerializer
     write_serializer_class = RequestBulkTicketUrlSerializer
-    queryset = Incident.objects.all()
+    queryset = Incident.objects.prefetch_default_related()
     change_key = "ticket_url"
 
     def create(self, request):
@@ -733,3 +856,225 @@ class BulkTicketUrlViewSet(BulkHelper, viewsets.ViewSet):
         return Response(
             data={"changes": changes}, status=status.HTTP_400_BAD_REQUEST if all_bad else status.HTTP_201_CREATED
         )
+
+
+class BulkIncidentHelper:
+    """Methods and attributes that views creating incidents in bulk need"""
+
+    change_key = "incident"
+
+    def bulk_create_incidents(self, source: SourceSystem, incidents_data: dict) -> dict:
+        """Validate and create incidents, and notify about them
+
+        ``incidents_data`` maps keys, like the position in the request, to the
+        posted data of each incident. Returns the changes by the same keys.
+        """
+        changes = {}
+        valid_data = {}
+        for key, incident_data in incidents_data.items():
+            serializer = IncidentSerializer(data=incident_data, context={"request": self.request})
+            if serializer.is_valid():
+                valid_data[key] = serializer.validated_data
+            else:
+                changes[key] = self._bulk_error(serializer.errors)
+
+        for key in self._find_duplicates(source, valid_data):
+            del valid_data[key]
+            changes[key] = self._bulk_error(
+                {"source_incident_id": ["An incident with this source incident ID already exists for this source."]}
+            )
+
+        if not valid_data:
+            return changes
+
+        try:
+            incidents, events = Incident.objects.create_incidents(self.request.user, source, list(valid_data.values()))
+        except IntegrityError:
+            # Find out which incidents cannot be created by trying them one by one
+            incidents, events = [], []
+            for key, incident_data in list(valid_data.items()):
+                try:
+                    created, created_events = Incident.objects.create_incidents(
+                        self.request.user, source, [incident_data]
+                    )
+                except IntegrityError as e:
+                    del valid_data[key]
+                    changes[key] = self._bulk_error(self._integrity_errors(e))
+                else:
+                    incidents.extend(created)
+                    events.extend(created_events)
+            if not incidents:
+                return changes
+
+        # Fetch the tags for the representations in one go
+        pks = [incident.pk for incident in incidents]
+        incidents_by_pk = Incident.objects.prefetch_default_related().in_bulk(pks)
+        incidents = [incidents_by_pk[pk] for pk in pks]
+        for key, incident in zip(valid_data, incidents):
+            changes[key] = {
+                self.change_key: IncidentSerializer(instance=incident).to_representation(instance=incident),
+                "status": status.HTTP_201_CREATED,
+                "errors": None,
+            }
+
+        send_changed_incidents(incidents, created=True)
+        send_notifications_for_events(*events)
+        return changes
+
+    def _bulk_error(self, errors):
+        return {
+            self.change_key: None,
+            "status": status.HTTP_400_BAD_REQUEST,
+            "errors": errors,
+        }
+
+    @staticmethod
+    def _integrity_errors(error: IntegrityError) -> dict:
+        constraint = getattr(getattr(error.__cause__, "diag", None), "constraint_name", None)
+        if constraint == SOURCE_INCIDENT_ID_CONSTRAINT:
+            # Another request created the incident just now
+            return {"source_incident_id": ["An incident with this source incident ID already exists for this source."]}
+        LOG.warning("Could not create incident: %s", error)
+        return {"non_field_errors": ["The incident could not be saved."]}
+
+    @staticmethod
+    def _find_duplicates(source, incidents_data):
+        "Return the keys of incidents whose source incident ID is already taken"
+        source_incident_ids = {
+            data["source_incident_id"] for data in incidents_data.values() if data.get("source_incident_id")
+        }
+        taken = set(
+            Incident.objects.filter(source=source, source_incident_id__in=source_incident_ids).values_list(
+                "source_incident_id", flat=True
+            )
+        )
+        duplicates = []
+        for key, data in incidents_data.items():
+            source_incident_id = data.get("source_incident_id")
+            if not source_incident_id:
+                continue
+            if source_incident_id in taken:
+                duplicates.append(key)
+            taken.add(source_incident_id)
+        return duplicates
+
+
+@extend_schema_view(
+    create=extend_schema(
+        request=RequestBulkIncidentSerializer,
+        responses=ResponseBulkSerializer,
+    )
+)
+class BulkIncidentViewSet(BulkIncidentHelper, viewsets.ViewSet):
+    """Create many incidents at once
+
+    The changes are keyed by the position of the incident in the request.
+    """
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = ResponseBulkSerializer
+    write_serializer_class = RequestBulkIncidentSerializer
+
+    def create(self, request):
+        serializer = self.write_serializer_class(data=request.data, context={"request": request})
+
+        if not serializer.is_valid():
+            return Response(data=serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        source = get_source_for_incidents(request.user, request.data)
+
+        incidents_data = {str(index): data for index, data in enumerate(serializer.validated_data["incidents"])}
+        changes = self.bulk_create_incidents(source, incidents_data)
+        status_codes_seen = {change["status"] for change in changes.values()}
+
+        all_bad = status_codes_seen == set((status.HTTP_400_BAD_REQUEST,))
+        return Response(
+            data={"changes": changes}, status=status.HTTP_400_BAD_REQUEST if all_bad else status.HTTP_201_CREATED
+        )
+
+
+@extend_schema_view(
+    create=extend_schema(
+        request={"application/x-ndjson": OpenApiTypes.STR},
+        responses={(200, "application/x-ndjson"): OpenApiTypes.STR},
+        parameters=[
+            OpenApiParameter(name="source", description="The source system, only for superusers.", type=int),
+        ],
+    )
+)
+class IncidentIngestViewSet(BulkIncidentHelper, EventHelper, viewsets.ViewSet):
+    """Create incidents and events from a stream of newline delimited JSON
+
+    Every line is either ``{"incident": {...}}`` or ``{"event": {...}}`` with
+    the incident of the event given by either ``"incident": pk`` or
+    ``"source_incident_id": id`` next to ``"event"``. The lines are handled
+    in batches, and the result of each line is streamed back as a line of
+    JSON as soon as its batch is done.
+    """
+
+    permission_classes = [IsAuthenticated]
+    batch_size = 100
+
+    def create(self, request):
+        source = get_source_for_incidents(request.user, request.query_params)
+        # Read the body line by line instead of parsing it all up front
+        lines = request.stream or ()
+        results = (json.dumps(result, cls=JSONEncoder) + "\n" for result in self.ingest(source, lines))
+        return StreamingHttpResponse(results, content_type="application/x-ndjson")
+
+    def ingest(self, source: SourceSystem, lines):
+        numbered_lines = enumerate(lines, start=1)
+        while batch := list(islice(numbered_lines, self.batch_size)):
+            changes = self.ingest_batch(source, batch)
+            for line_number in sorted(changes):
+                yield {"line": line_number, **changes[line_number]}
+
+    def ingest_batch(self, source: SourceSystem, batch) -> dict:
+        changes = {}
+        incidents_data = {}
+        for line_number, line in batch:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                changes[line_number] = self._line_error(f"Invalid JSON: {e}")
+                continue
+            if isinstance(item, dict) and "incident" in item and "event" not in item:
+                incidents_data[line_number] = item["incident"]
+            elif isinstance(item, dict) and "event" in item:
+                # The event may be about an incident on one of the lines before it
+                changes.update(self.bulk_create_incidents(source, incidents_data))
+                incidents_data = {}
+                changes[line_number] = self.ingest_event(source, item)
+            else:
+                changes[line_number] = self._line_error('Every line must have either "incident" or "event".')
+        changes.update(self.bulk_create_incidents(source, incidents_data))
+        return changes
+
+    def ingest_event(self, source: SourceSystem, item: dict) -> dict:
+        incidents = Incident.objects.filter(source=source)
+        try:
+            if "incident" in item:
+                incident = incidents.get(pk=item["incident"])
+            else:
+                incident = incidents.get(source_incident_id=item["source_incident_id"])
+        except (KeyError, ValueError, TypeError, Incident.DoesNotExist):
+            return {
+                "event": None,
+                "status": status.HTTP_400_BAD_REQUEST,
+                "errors": {"incident": "The incident of the event could not be found."},
+            }
+
+        serializer = EventSerializer(data=item["event"], context={"request": self.request})
+        try:
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                self.save_event(serializer, incident)
+        except serializers.ValidationError as e:
+            return {"event": None, "status": status.HTTP_400_BAD_REQUEST, "errors": e.detail}
+        return {"event": serializer.data, "status": status.HTTP_201_CREATED, "errors": None}
+
+    @staticmethod
+    def _line_error(message: str) -> dict:
+        return {"status": status.HTTP_400_BAD_REQUEST, "errors": {"line": message}}
@@ -2,7 +2,8 @@ from django.contrib import admin
 from django.db.models.functions import Concat
 from django.utils.html import format_html_join
 
-from .models import DestinationConfig, Filter, Media, NotificationProfile, TimeRecurrence, Timeslot
+from .matching import invalidate_profile_matcher
+from .models import DestinationConfig, Filter, Media, NotificationJob, NotificationProfile, TimeRecurrence, Timeslot
 
 
 @admin.action(description="Toggle activation for selected profiles")
@@ -15,11 +16,13 @@ def toggle_activation(modeladmin, request, queryset):
 @admin.action(description="Activate selected profiles")
 def activate_profiles(modeladmin, request, queryset):
     queryset.update(active=True)
+    invalidate_profile_matcher()
 
 
 @admin.action(description="Deactivate selected profiles")
 def deactivate_profiles(modeladmin, request, queryset):
     queryset.update(active=False)
+    invalidate_profile_matcher()
 
 
 class TimeslotAdmin(admin.ModelAdmin):
@@ -87,6 +90,21 @@ class DestinationConfigAdmin(admin.ModelAdmin):
     ordering = ("user",)
 
 
+class NotificationJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "event",
+        "status",
+        "attempts",
+        "next_attempt",
+        "claimed",
+    )
+    list_filter = ("status",)
+    list_select_related = ("event__incident",)
+    raw_id_fields = ("event",)
+    readonly_fields = ("created", "claimed", "last_error")
+
+
 class DestinationConfigInline(admin.TabularInline):
     model = NotificationProfile.destinations.through
 
@@ -155,3 +173,4 @@ admin.site.register(Filter, FilterAdmin)
 admin.site.register(Media, MediaAdmin)
 admin.site.register(DestinationConfig, DestinationConfigAdmin)
 admin.site.register(NotificationProfile, NotificationProfileAdmin)
+admin.site.register(NotificationJob, NotificationJobAdmin)
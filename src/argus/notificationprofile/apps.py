@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save, post_migrate
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save
 
 
 class NotificationprofileConfig(AppConfig):
@@ -17,3 +17,16 @@ class NotificationprofileConfig(AppConfig):
         post_save.connect(create_default_timeslot, "argus_auth.User")
         post_save.connect(sync_email_destination, "argus_auth.User")
         post_migrate.connect(sync_media, sender=self)
+
+        # Keep the in-memory profile matcher in sync
+        from .matching import invalidate_profile_matcher
+        from .models import NotificationProfile
+
+        for model in ("NotificationProfile", "Filter", "Timeslot", "TimeRecurrence", "DestinationConfig"):
+            sender = f"argus_notificationprofile.{model}"
+            post_save.connect(invalidate_profile_matcher, sender, dispatch_uid=f"invalidate_matcher_save_{model}")
+            post_delete.connect(invalidate_profile_matcher, sender, dispatch_uid=f"invalidate_matcher_delete_{model}")
+        for through in (NotificationProfile.filters.through, NotificationProfile.destinations.through):
+            m2m_changed.connect(
+                invalidate_profile_matcher, through, dispatch_uid=f"invalidate_matcher_{through.__name__}"
+            )
@@ -0,0 +1,52 @@
+from datetime import timedelta
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from argus.notificationprofile.models import NotificationJob
+from argus.notificationprofile.outbox import claim_jobs, process_jobs
+
+
+class Command(BaseCommand):
+    help = "Send queued notifications, see the NOTIFICATION_DELIVERY setting"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-b", "--batch-size", type=int, default=100, help="Number of jobs to claim at a time. Default: 100"
+        )
+        parser.add_argument(
+            "-s", "--sleep", type=float, default=1.0, help="Seconds to wait when there are no jobs. Default: 1"
+        )
+        parser.add_argument("--once", action="store_true", help="Send what is due and exit instead of looping")
+        parser.add_argument(
+            "--purge-after",
+            type=int,
+            default=24,
+            help="Delete jobs that were sent more than this many hours ago. 0 keeps them. Default: 24",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        purge_after = options["purge_after"]
+        verbosity = options["verbosity"]
+        try:
+            while True:
+                jobs = claim_jobs(batch_size)
+                if jobs:
+                    sent, failed = process_jobs(jobs)
+                    if verbosity > 1:
+                        self.stdout.write(f"Sent {sent} notification jobs, {failed} failed")
+                    if len(jobs) == batch_size:
+                        continue  # there is probably more
+                if options["once"]:
+                    break
+                if purge_after:
+                    self.purge(timedelta(hours=purge_after))
+                time.sleep(options["sleep"])
+        except KeyboardInterrupt:
+            pass
+
+    def purge(self, age: timedelta):
+        # done jobs are no longer claimed so the claim time tells when it was sent, approximately
+        NotificationJob.objects.done().filter(claimed__lt=timezone.now() - age).delete()
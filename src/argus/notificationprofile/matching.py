@@ -0,0 +1,290 @@
+"""In-memory index of active notification profiles
+
+Finding the destinations for an event used to cost several queries per active
+notification profile: one for the filters, one for the time recurrences and
+one for the destinations. The ``ProfileMatcher`` loads all of that once, keeps
+it as plain Python structures and answers "which destinations match this
+event" without touching the database again.
+
+The matcher is rebuilt lazily whenever one of the models it is built from is
+saved or deleted. Invalidation is immediate for the current process. Other
+processes notice the change through a version kept in a database sequence,
+which is bumped when the change is committed and read before every match.
+"""
+
+from __future__ import annotations
+
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import cached_property
+import logging
+from typing import TYPE_CHECKING
+
+from django.db import connection, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+
+from argus.filter import get_filter_backend
+
+from .models import DestinationConfig, NotificationProfile
+from .weekbitmap import WeekBitmap
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from argus.incident.models import Event, Incident  # noqa: Break circular import
+
+
+__all__ = [
+    "IncidentFacts",
+    "CompiledTimeslot",
+    "CompiledProfile",
+    "ProfileMatcher",
+    "get_profile_matcher",
+    "get_shared_version",
+    "invalidate_profile_matcher",
+]
+
+
+LOG = logging.getLogger(__name__)
+
+filter_backend = get_filter_backend()
+
+# Bumped whenever anything the matchers are built from changes, in any process
+VERSION_SEQUENCE = "argus_notificationprofile_version_seq"
+
+_matcher = None
+
+
+class IncidentFacts:
+    """Read-only stand-in for an incident while it is checked against filters
+
+    Properties that hit the database, like the tags, are looked up once
+    instead of once per filter. Everything else is read from the wrapped
+    incident.
+    """
+
+    def __init__(self, incident: Incident, being_acked: bool = False):
+        self._incident = incident
+        # The acknowledgement of an ACK event is saved after the event
+        self._being_acked = being_acked
+
+    def __getattr__(self, name):
+        if name == "_incident":
+            raise AttributeError(name)
+        return getattr(self._incident, name)
+
+    @classmethod
+    def for_events(cls, events: Iterable[Event]) -> dict[int, IncidentFacts]:
+        """Look up the incidents of ``events`` in one go
+
+        Returns a dict of event pk to ``IncidentFacts``, with the incident,
+        its source and its tags already loaded. Events of the same incident
+        share the loaded incident, but only an ACK event counts it as acked.
+        The number of queries does not depend on the number of events.
+        """
+        from argus.incident.models import Event, Incident
+
+        incident_ids = {event.incident_id for event in events}
+        incidents = (
+            Incident.objects.filter(pk__in=incident_ids)
+            .select_related("source")
+            .prefetch_related("incident_tag_relations__tag")
+            .in_bulk()
+        )
+        return {
+            event.pk: cls(incidents[event.incident_id], event.type == Event.Type.ACKNOWLEDGE)
+            for event in events
+            if event.incident_id in incidents
+        }
+
+    @cached_property
+    def acked(self) -> bool:
+        return self._being_acked or self._incident.acked
+
+    @cached_property
+    def open(self) -> bool:
+        return self._incident.open
+
+    @cached_property
+    def stateful(self) -> bool:
+        return self._incident.stateful
+
+    @cached_property
+    def deprecated_tags(self):
+        prefetch_related_objects([self._incident], "incident_tag_relations__tag")
+        return self._incident.deprecated_tags
+
+
+@dataclass(frozen=True)
+class CompiledTimeslot:
+    pk: int
+    bitmap: WeekBitmap
+
+    def timestamp_is_within(self, timestamp: datetime) -> bool:
+        return self.bitmap.timestamp_is_within(timestamp)
+
+    @classmethod
+    def from_timeslot(cls, timeslot):
+        return cls(pk=timeslot.pk, bitmap=timeslot.week_bitmap)
+
+
+@dataclass(eq=False)
+class CompiledProfile:
+    """The parts of a notification profile needed to match events
+
+    Mirrors the logic of ``ComplexFallbackFilterWrapper``: all filters must fit
+    the incident, and at least one filter must fit the event.
+    """
+
+    pk: int
+    label: str
+    timeslot: CompiledTimeslot
+    filter_pks: tuple[int, ...] = field(default_factory=tuple)
+    incident_filters: tuple = field(default_factory=tuple)
+    event_filters: tuple = field(default_factory=tuple)
+    destinations: frozenset[DestinationConfig] = field(default_factory=frozenset)
+
+    def timeslot_fits(self, incident: Incident) -> bool:
+        return self.timeslot.timestamp_is_within(incident.start_time)
+
+    def incident_fits(self, incident: Incident) -> bool:
+        if not self.timeslot_fits(incident):
+            return False
+        return all(fw.incident_fits(incident) for fw in self.incident_filters)
+
+    def event_fits(self, event: Event) -> bool:
+        return any(fw.event_fits(event) for fw in self.event_filters)
+
+    @classmethod
+    def from_profile(cls, profile: NotificationProfile, timeslot: CompiledTimeslot, wrappers: dict):
+        "``wrappers`` maps filter pks to (incident filterwrapper, event filterwrapper)"
+        filter_pks = tuple(f.pk for f in profile.filters.all())
+        return cls(
+            pk=profile.pk,
+            label=f'"{profile}" ({profile.user.username})',
+            timeslot=timeslot,
+            filter_pks=filter_pks,
+            incident_filters=tuple(wrappers[pk][0] for pk in filter_pks),
+            event_filters=tuple(wrappers[pk][1] for pk in filter_pks),
+            destinations=frozenset(profile.destinations.all()),
+        )
+
+
+class ProfileMatcher:
+    """Find the notification profiles that fit an event
+
+    If the filter backend has a ``FilterIndex``, only the profiles whose
+    filters are all found via the index are checked further, otherwise every
+    profile is checked.
+    """
+
+    def __init__(self, profiles: Iterable[CompiledProfile], token=None, filter_index=None):
+        self.profiles = tuple(profiles)
+        self.token = token
+        self.filter_index = filter_index
+        self.profiles_by_filter = defaultdict(list)
+        for profile in self.profiles:
+            for filter_pk in profile.filter_pks:
+                self.profiles_by_filter[filter_pk].append(profile)
+
+    def __len__(self):
+        return len(self.profiles)
+
+    @classmethod
+    def build(cls, token=None):
+        "Load all active profiles with everything needed for matching"
+        qs = (
+            NotificationProfile.objects.filter(active=True)
+            .select_related("user", "timeslot")
+            .prefetch_related(
+                "filters",
+                "timeslot__time_recurrences",
+                Prefetch("destinations", queryset=DestinationConfig.objects.select_related("media")),
+            )
+        )
+        incident_filterwrapper = filter_backend.ComplexFallbackFilterWrapper.filterwrapper
+        filter_index_class = getattr(filter_backend, "FilterIndex", None)
+        filter_index = filter_index_class() if filter_index_class else None
+        timeslots = {}
+        wrappers = {}
+        profiles = []
+        for profile in qs:
+            timeslot = timeslots.get(profile.timeslot_id)
+            if timeslot is None:
+                timeslot = CompiledTimeslot.from_timeslot(profile.timeslot)
+                timeslots[profile.timeslot_id] = timeslot
+            for f in profile.filters.all():
+                if f.pk not in wrappers:
+                    wrappers[f.pk] = (incident_filterwrapper(f.filter), filter_backend.FilterWrapper(f.filter))
+                    if filter_index is not None:
+                        filter_index.add(f.pk, wrappers[f.pk][0])
+            profiles.append(CompiledProfile.from_profile(profile, timeslot, wrappers))
+        LOG.debug("Notification: compiled %i active profiles with %i filters", len(profiles), len(wrappers))
+        return cls(profiles, token=token, filter_index=filter_index)
+
+    def _fitting_profiles_by_index(self, incident) -> list[CompiledProfile]:
+        fitting_filters = Counter()
+        for filter_pk in self.filter_index.matching(incident):
+            for profile in self.profiles_by_filter[filter_pk]:
+                fitting_filters[profile] += 1
+        return [
+            profile
+            for profile, count in fitting_filters.items()
+            if count == len(profile.filter_pks) and profile.timeslot_fits(incident)
+        ]
+
+    def find_profiles(self, event: Event, incident=None) -> list[CompiledProfile]:
+        "Return the compiled profiles that want to be notified about ``event``"
+        if incident is None:
+            from argus.incident.models import Event
+
+            incident = IncidentFacts(event.incident, event.type == Event.Type.ACKNOWLEDGE)
+        if self.filter_index is not None:
+            return [profile for profile in self._fitting_profiles_by_index(incident) if profile.event_fits(event)]
+        found = []
+        for profile in self.profiles:
+            LOG.debug("Notification: checking profile %s for event %s", profile.label, event)
+            if profile.incident_fits(incident) and profile.event_fits(event):
+                found.append(profile)
+        return found
+
+    def find_destinations(self, event: Event, incident=None) -> set[DestinationConfig]:
+        destinations = set()
+        for profile in self.find_profiles(event, incident):
+            destinations.update(profile.destinations)
+        return destinations
+
+
+def get_shared_version() -> int:
+    "The version of the notification profiles and filters, as seen by all processes"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {VERSION_SEQUENCE}")
+        return cursor.fetchone()[0]
+
+
+def get_profile_matcher() -> ProfileMatcher:
+    "Return an up to date matcher, rebuilding it if anything has changed"
+    global _matcher
+    token = get_shared_version()
+    if _matcher is None or _matcher.token != token:
+        _matcher = ProfileMatcher.build(token)
+    return _matcher
+
+
+def _bump_shared_version():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(%s)", [VERSION_SEQUENCE])
+
+
+def invalidate_profile_matcher(*args, **kwargs):
+    """Mark the matcher as stale
+
+    Can be used directly as a signal receiver. Call this after changing
+    notification profiles and their related models in ways that do not send
+    signals, like ``QuerySet.update()`` and ``bulk_update()``.
+    """
+    global _matcher
+    _matcher = None
+    # Other processes should only rebuild once the change is visible to them
+    transaction.on_commit(_bump_shared_version)
@@ -1,20 +1,23 @@
 from __future__ import annotations
 
+from functools import partial
 import logging
-from multiprocessing import Process
 from typing import TYPE_CHECKING
 
 from django.conf import settings
-from django.db import connections
+from django.db import transaction
 from rest_framework.exceptions import ValidationError
 
 from argus.filter import get_filter_backend
 from argus.util.utils import import_class_from_dotted_path
 
-from ..models import DestinationConfig, Media, NotificationProfile
+from ..matching import IncidentFacts, get_profile_matcher
+from ..models import DestinationConfig, Media
+from .digest import get_digest_buffer, get_digest_window
+from .pool import get_worker_pool
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Iterable, Mapping, Sequence
 
     from argus.incident.models import Event  # noqa: Break circular import
 
@@ -29,6 +32,8 @@ __all__ = [
     "api_safely_get_medium_object",
     "send_notification",
     "background_send_notification",
+    "digest_send_notification",
+    "send_digests",
     "find_destinations_for_event",
     "find_destinations_for_many_events",
     "send_notifications_to_users",
@@ -54,11 +59,10 @@ def send_notification(destinations: Iterable[DestinationConfig], *events: Iterab
     if not events:
         return
     media = get_notification_media(destinations)
-    media_count = len(media)
-    for event in events:
-        LOG.info('Notification: sending event "%s" to %i mediums', event, media_count)
-        for medium in media:
-            sent = medium.send(event=event, destinations=destinations)
+    LOG.info("Notification: sending %i events to %i mediums", len(events), len(media))
+    for medium in media:
+        results = medium.send_batch([(event, destinations) for event in events])
+        for event, sent in zip(events, results):
             if sent:
                 LOG.info('Notification: sent event "%s" to "%s"', event, medium.MEDIA_SLUG)
             else:
@@ -66,43 +70,86 @@ def send_notification(destinations: Iterable[DestinationConfig], *events: Iterab
 
 
 def background_send_notification(destinations: Iterable[DestinationConfig], *events: Event):
-    connections.close_all()
+    """Send notifications via the pool of background workers
+
+    The job is queued when the current transaction is committed, so that the
+    workers, which use their own database connections, can see the events.
+    """
     LOG.info("Notification: backgrounded: about to send %i events", len(events))
-    p = Process(target=send_notification, args=(destinations, *events))
-    p.start()
-    return p
+    pool = get_worker_pool()
+    transaction.on_commit(partial(pool.submit, send_notification, destinations, *events))
+
+
+def send_digests(digests: Mapping[DestinationConfig, Sequence[Event]]):
+    "Send one message to each destination about all its events"
+    if not digests:
+        return
+    for medium in get_notification_media(digests.keys()):
+        batch = [
+            (events, [destination])
+            for destination, events in digests.items()
+            if destination.media_id == medium.MEDIA_SLUG
+        ]
+        results = medium.send_digests(batch)
+        for (events, _), sent in zip(batch, results):
+            if sent:
+                LOG.info('Notification: sent digest of %i events to "%s"', len(events), medium.MEDIA_SLUG)
+            else:
+                LOG.warn('Notification: could not send digest of %i events to "%s"', len(events), medium.MEDIA_SLUG)
+
+
+def digest_send_notification(destinations: Iterable[DestinationConfig], *events: Event):
+    """Hold back the events and send them later in digests
+
+    See :setting:`NOTIFICATION_DIGEST_WINDOW`.
+    """
+    LOG.info("Notification: digesting: holding back %i events", len(events))
+    buffer = get_digest_buffer(send_digests)
+    transaction.on_commit(partial(buffer.add, destinations, *events))
 
 
 def find_destinations_for_event(event: Event):
-    destinations = set()
-    incident = event.incident
-    qs = NotificationProfile.objects.filter(active=True)
-    for profile in qs.prefetch_related("destinations").select_related("user"):
-        fw = ComplexFallbackFilterWrapper(profile=profile)
-        LOG.debug('Notification: checking profile "%s" (%s) for event "%s"', profile, profile.user.username, event)
-        if fw.incident_fits(incident) and fw.event_fits(event):
-            destinations.update(profile.destinations.all())
+    matcher = get_profile_matcher()
+    destinations = matcher.find_destinations(event)
     LOG.info('Notification: found %i listeners for "%s"', len(destinations), event)
     return destinations
 
 
 def find_destinations_for_many_events(events: Iterable[Event]):
+    """Find destinations for several events at once
+
+    Profiles are matched in memory and the incidents of all the events are
+    loaded together, so the number of queries does not grow with the number of
+    events.
+    """
+    events = list(events)
+    matcher = get_profile_matcher()
+    facts = IncidentFacts.for_events(events)
     destinations = dict()
     for event in events:
-        found = find_destinations_for_event(event)
+        found = matcher.find_destinations(event, facts[event.pk])
         if found:
             destinations[event] = found
+    LOG.info("Notification: found listeners for %i of %i events", len(destinations), len(events))
     return destinations
 
 
-def send_notifications_to_users(*events: Iterable[Event], send=send_notification):
+def send_notifications_to_users(*events: Iterable[Event], send=None):
+    """Send notifications about ``events`` to everyone who wants them
+
+    Unless the caller chooses how with ``send``, the events are held back for
+    digests when :setting:`NOTIFICATION_DIGEST_WINDOW` is set and sent right
+    away otherwise.
+    """
     if not events:
         LOG.warn("Notification: no events to send, programming error?")
         return
     if not getattr(settings, "SEND_NOTIFICATIONS", False):
         LOG.info("Notification: turned off sitewide, not sending any")
         return
-    # TODO: only send one notification per medium per user
+    if send is None:
+        # Coalesce the events per destination
+        send = digest_send_notification if get_digest_window() else send_notification
     LOG.debug('Fallback filter set to "%s"', getattr(settings, "ARGUS_FALLBACK_FILTER", {}))
     all_destinations = find_destinations_for_many_events(events)
     if not all_destinations:
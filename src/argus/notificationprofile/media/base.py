@@ -4,7 +4,7 @@ from abc import ABC, abstractmethod
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Iterable, Sequence
 
     from types import NoneType
     from typing import Union
@@ -66,6 +66,30 @@ class NotificationMedium(ABC):
         """Sends message about a given event to the given destinations"""
         pass
 
+    @classmethod
+    def send_batch(cls, notifications: Iterable[tuple[Event, Iterable[DestinationConfig]]]) -> Sequence[bool]:
+        """
+        Sends messages about several events, each to its own destinations
+
+        Returns, in order, whether each event was sent. Override this to
+        share work between the events, like the connection to a server.
+        """
+        return [cls.send(event=event, destinations=destinations) for event, destinations in notifications]
+
+    @classmethod
+    def send_digests(cls, digests: Iterable[tuple[Sequence[Event], Iterable[DestinationConfig]]]) -> Sequence[bool]:
+        """
+        Sends one message about all the events of each digest to its
+        destinations, a digest being a pair of events and destinations
+
+        Returns, in order, whether each digest was sent. This sends the events
+        one by one, override it to combine them into one message.
+        """
+        results = []
+        for events, destinations in digests:
+            results.append(all(cls.send_batch([(event, destinations) for event in events])))
+        return results
+
     @classmethod
     def raise_if_not_deletable(cls, destination: DestinationConfig) -> NoneType:
         """
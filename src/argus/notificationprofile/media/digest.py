@@ -0,0 +1,116 @@
+"""Combine notifications to the same destination into digests
+
+When :setting:`NOTIFICATION_DIGEST_WINDOW` is set, events are not sent as
+soon as they have been matched. Instead they are held back for up to that many
+seconds and grouped by destination, and every destination then gets one
+message about all its events. A destination that only got a single event in
+the window gets the ordinary message.
+"""
+
+from __future__ import annotations
+
+import atexit
+from datetime import datetime, timezone
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+
+from .pool import get_worker_pool
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Mapping, Sequence
+
+    from argus.incident.models import Event  # noqa: Break circular import
+    from ..models import DestinationConfig
+
+    Digests = Mapping[DestinationConfig, Sequence[Event]]
+
+
+__all__ = [
+    "DigestBuffer",
+    "end_of_window",
+    "get_digest_buffer",
+    "get_digest_window",
+]
+
+
+LOG = logging.getLogger(__name__)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_digest_window() -> int:
+    "The digest window in seconds, 0 if digests are turned off"
+    return max(0, getattr(settings, "NOTIFICATION_DIGEST_WINDOW", 0) or 0)
+
+
+def end_of_window(timestamp: datetime, window: int) -> datetime:
+    """Returns when the window ``timestamp`` falls in ends
+
+    The windows are aligned to the epoch, so events that happen close together
+    are due at the very same time, wherever they were created.
+    """
+    seconds = timestamp.timestamp()
+    return datetime.fromtimestamp((seconds // window + 1) * window, tz=timezone.utc)
+
+
+class DigestBuffer:
+    """Hold back events and group them by destination
+
+    ``send`` is called with a mapping from destination to its events when the
+    window is over.
+    """
+
+    def __init__(self, window: float, send: Callable[[Digests], None]):
+        self.window = window
+        self.send = send
+        self.pid = os.getpid()
+        self.pending = {}
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} window={self.window}s destinations={len(self.pending)}>"
+
+    def add(self, destinations: Iterable[DestinationConfig], *events: Event):
+        with self.lock:
+            for destination in destinations:
+                self.pending.setdefault(destination, []).extend(events)
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self._timeout)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _timeout(self):
+        # Send from the worker pool, which takes care of database connections
+        get_worker_pool().submit(self.flush)
+
+    def flush(self):
+        "Send everything that is held back right away"
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if pending:
+            LOG.info(
+                "Notification: sending digests of %i events to %i destinations",
+                sum(len(events) for events in pending.values()),
+                len(pending),
+            )
+            self.send(pending)
+
+
+def get_digest_buffer(send: Callable[[Digests], None]) -> DigestBuffer:
+    "Get the digest buffer of this process, creating it if necessary"
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None or _buffer.pid != os.getpid():
+            _buffer = DigestBuffer(get_digest_window(), send)
+            # Do not lose what is held back when the process exits
+            atexit.register(_buffer.flush)
+        return _buffer
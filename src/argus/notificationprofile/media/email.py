@@ -1,21 +1,24 @@
 from __future__ import annotations
 
+from itertools import chain
 import logging
+import smtplib
 from typing import TYPE_CHECKING
 
 from django import forms
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
 from rest_framework.exceptions import ValidationError
 
 from argus.incident.models import Event
 from .base import NotificationMedium
+from ..matching import invalidate_profile_matcher
 from ..models import DestinationConfig
 from argus.util.datetime_utils import INFINITY, LOCAL_INFINITY
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Iterable, Sequence
 
     from types import NoneType
     from typing import Union
@@ -30,6 +33,7 @@ if TYPE_CHECKING:
 LOG = logging.getLogger(__name__)
 
 __all__ = [
+    "log_connection_refused",
     "send_email_safely",
     "EmailNotification",
 ]
@@ -41,21 +45,25 @@ def modelinstance_to_dict(obj):
     return dict_
 
 
+def log_connection_refused(additional_error=None):
+    EMAIL_HOST = getattr(settings, "EMAIL_HOST", None)
+    if not EMAIL_HOST:
+        LOG.error("Notification: Email: EMAIL_HOST not set, cannot send")
+    EMAIL_PORT = getattr(settings, "EMAIL_PORT", None)
+    if not EMAIL_PORT:
+        LOG.error("Notification: Email: EMAIL_PORT not set, cannot send")
+    if EMAIL_HOST and EMAIL_PORT:
+        LOG.error('Notification: Email: Connection refused to "%s", port "%s"', EMAIL_HOST, EMAIL_PORT)
+    if additional_error:
+        LOG.error(*additional_error)
+
+
 def send_email_safely(function, additional_error=None, *args, **kwargs) -> int:
     try:
         result = function(*args, **kwargs)
         return result
     except ConnectionRefusedError:
-        EMAIL_HOST = getattr(settings, "EMAIL_HOST", None)
-        if not EMAIL_HOST:
-            LOG.error("Notification: Email: EMAIL_HOST not set, cannot send")
-        EMAIL_PORT = getattr(settings, "EMAIL_PORT", None)
-        if not EMAIL_PORT:
-            LOG.error("Notification: Email: EMAIL_PORT not set, cannot send")
-        if EMAIL_HOST and EMAIL_PORT:
-            LOG.error('Notification: Email: Connection refused to "%s", port "%s"', EMAIL_HOST, EMAIL_PORT)
-        if additional_error:
-            LOG.error(*additional_error)
+        log_connection_refused(additional_error)
         # TODO: Store error as incident
 
 
@@ -123,6 +131,7 @@ class EmailNotification(NotificationMedium):
             )
             destination.settings = validated_data["settings"]
             DestinationConfig.objects.bulk_update([destination], fields=["settings"])
+            invalidate_profile_matcher()
             new_synced_destination.save()
             return destination
         return None
@@ -175,42 +184,145 @@ class EmailNotification(NotificationMedium):
 
         return subject, message, html_message
 
+    @staticmethod
+    def create_digest_context(events: Sequence[Event]):
+        """Creates the subject, message and html message for an email about several events"""
+        title = f"{len(events)} events"
+        template_context = {
+            "title": title,
+            "events": events,
+        }
+        subject = f"{settings.NOTIFICATION_SUBJECT_PREFIX}{title}"
+        message = render_to_string("notificationprofile/email_digest.txt", template_context)
+        html_message = render_to_string("notificationprofile/email_digest.html", template_context)
+
+        return subject, message, html_message
+
+    @staticmethod
+    def _create_messages(context: tuple[str, str, str], email_addresses: Iterable[str]):
+        subject, message, html_message = context
+        messages = []
+        for email_address in sorted(email_addresses):
+            email = EmailMultiAlternatives(subject=subject, body=message, to=[email_address])
+            email.attach_alternative(html_message, "text/html")
+            messages.append(email)
+        return messages
+
+    @classmethod
+    def create_messages(cls, event: Event, email_addresses: Iterable[str]) -> list[EmailMultiAlternatives]:
+        """Creates one email per address, the templates are only rendered once"""
+        if not email_addresses:
+            return []
+        return cls._create_messages(cls.create_message_context(event=event), email_addresses)
+
+    @classmethod
+    def create_digest_messages(
+        cls, events: Sequence[Event], email_addresses: Iterable[str]
+    ) -> list[EmailMultiAlternatives]:
+        """Creates one email per address about all the events"""
+        if not email_addresses:
+            return []
+        if len(events) == 1:
+            return cls.create_messages(events[0], email_addresses)
+        return cls._create_messages(cls.create_digest_context(events), email_addresses)
+
+    @staticmethod
+    def send_messages(messages: Iterable[EmailMultiAlternatives]) -> list[EmailMultiAlternatives]:
+        """
+        Sends the given emails over a single connection to the email server
+
+        Returns the emails that could not be sent
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        failed = []
+        connection = get_connection()
+        try:
+            connection.open()
+        except ConnectionRefusedError:
+            log_connection_refused()
+            return messages
+        try:
+            for message in messages:
+                try:
+                    sent = connection.send_messages([message])
+                except (smtplib.SMTPException, OSError) as e:
+                    LOG.warning("Email: Failed to send to %s: %s", ", ".join(message.to), e)
+                    if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)):
+                        # The connection is likely broken, the next message will reconnect
+                        connection.close()
+                    sent = 0
+                if not sent:
+                    failed.append(message)
+        finally:
+            connection.close()
+        return failed
+
+    @classmethod
+    def _send_all(cls, labelled_messages: list[tuple[str, list[EmailMultiAlternatives]]]) -> list[bool]:
+        failed = set(cls.send_messages(chain.from_iterable(messages for _, messages in labelled_messages)))
+
+        results = []
+        for label, messages in labelled_messages:
+            if not messages:
+                results.append(False)
+                continue
+            failed_addresses = [message.to[0] for message in messages if message in failed]
+            if len(failed_addresses) == len(messages):
+                LOG.error('Email: Failed to send "%s" to any addresses', label)
+                results.append(False)
+                continue
+            if failed_addresses:
+                LOG.warning(
+                    'Email: Failed to send "%s" to %i of %i addresses',
+                    label,
+                    len(failed_addresses),
+                    len(messages),
+                )
+                LOG.debug("Email: Failed to send to: %s", " ".join(failed_addresses))
+            results.append(True)
+        return results
+
+    @classmethod
+    def send_batch(cls, notifications: Iterable[tuple[Event, Iterable[DestinationConfig]]]) -> Sequence[bool]:
+        """
+        Sends emails about several events, each to its own email destinations,
+        over a single connection to the email server
+
+        Returns, in order, whether each event was sent to at least one address
+        """
+        return cls._send_all(
+            [
+                (event, cls.create_messages(event, cls.get_relevant_addresses(destinations=destinations)))
+                for event, destinations in notifications
+            ]
+        )
+
+    @classmethod
+    def send_digests(cls, digests: Iterable[tuple[Sequence[Event], Iterable[DestinationConfig]]]) -> Sequence[bool]:
+        """
+        Sends one email about all the events of each digest to its email
+        destinations, over a single connection to the email server
+
+        Returns, in order, whether each digest was sent to at least one address
+        """
+        return cls._send_all(
+            [
+                (
+                    f"{len(events)} events",
+                    cls.create_digest_messages(events, cls.get_relevant_addresses(destinations=destinations)),
+                )
+                for events, destinations in digests
+            ]
+        )
+
     @classmethod
     def send(cls, event: Event, destinations: Iterable[DestinationConfig], **_) -> bool:
         """
         Sends email about a given event to the given email destinations
 
-        Returns False if no email destinations were given and
-        True if emails were sent
+        Returns False if no email destinations were given or no emails could
+        be sent and True if emails were sent
         """
-        email_addresses = cls.get_relevant_addresses(destinations=destinations)
-        if not email_addresses:
-            return False
-        num_emails = len(email_addresses)
-
-        subject, message, html_message = cls.create_message_context(event=event)
-
-        failed = set()
-        for email_address in email_addresses:
-            sent = send_email_safely(
-                send_mail,
-                subject=subject,
-                message=message,
-                from_email=None,
-                recipient_list=[email_address],
-                html_message=html_message,
-            )
-            if not sent:  # 0 for failure otherwise 1
-                failed.add(email_address)
-
-        if failed:
-            if num_emails == len(failed):
-                LOG.error("Email: Failed to send to any addresses")
-                return False
-            LOG.warn(
-                "Email: Failed to send to %i of %i addresses",
-                len(failed),
-                num_emails,
-            )
-            LOG.debug("Email: Failed to send to:", " ".join(failed))
-        return True
+        return cls.send_batch([(event, destinations)])[0]
@@ -0,0 +1,206 @@
+"""A long-lived pool of threads that send notifications in the background
+
+Forking a process per event makes the number of processes and database
+connections grow with the number of events. The pool has a fixed number of
+worker threads draining a bounded queue instead. When the queue is full, the
+caller waits up to :setting:`NOTIFICATION_QUEUE_TIMEOUT` seconds for room and
+then does the work itself, which slows down the producer rather than letting
+the queue and memory use grow without bounds.
+
+The pool keeps counters in :class:`PoolStats` and logs them every
+``STATS_LOG_INTERVAL`` seconds while busy, and once more when it stops.
+"""
+
+from __future__ import annotations
+
+import atexit
+from dataclasses import dataclass, field
+import logging
+import os
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.db import close_old_connections
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+
+
+__all__ = [
+    "NotificationWorkerPool",
+    "PoolStats",
+    "get_worker_pool",
+]
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_QUEUE_TIMEOUT = 5.0
+STATS_LOG_INTERVAL = 300.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+@dataclass
+class PoolStats:
+    "Counters for monitoring the pool, latencies are in seconds"
+
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    ran_in_foreground: int = 0
+    max_queue_depth: int = 0
+    total_wait: float = 0.0
+    total_runtime: float = 0.0
+    max_latency: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def record_submit(self, queue_depth: int):
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+    def record_done(self, wait: float, runtime: float, failed: bool, foreground: bool):
+        with self._lock:
+            self.completed += 1
+            self.failed += int(failed)
+            self.ran_in_foreground += int(foreground)
+            self.total_wait += wait
+            self.total_runtime += runtime
+            self.max_latency = max(self.max_latency, wait + runtime)
+
+    @property
+    def average_latency(self) -> float:
+        "Average time from a job was submitted until it was done"
+        if not self.completed:
+            return 0.0
+        return (self.total_wait + self.total_runtime) / self.completed
+
+    @property
+    def average_runtime(self) -> float:
+        if not self.completed:
+            return 0.0
+        return self.total_runtime / self.completed
+
+    def __str__(self):
+        return (
+            f"{self.submitted} submitted, {self.completed} completed, {self.failed} failed, "
+            f"{self.ran_in_foreground} in the foreground, max queue depth {self.max_queue_depth}, "
+            f"latency {self.average_latency:.3f}s average/{self.max_latency:.3f}s max, "
+            f"runtime {self.average_runtime:.3f}s average"
+        )
+
+
+class NotificationWorkerPool:
+    def __init__(self, workers: int = DEFAULT_WORKERS, queue_size: int = DEFAULT_QUEUE_SIZE, timeout=None):
+        self.num_workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.timeout = DEFAULT_QUEUE_TIMEOUT if timeout is None else timeout
+        self.stats = PoolStats()
+        self.stats_logged = time.monotonic()
+        self.pid = os.getpid()
+        self.threads = []
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} workers={self.num_workers} queue={self.queue_depth}/{self.queue.maxsize}>"
+
+    @property
+    def queue_depth(self) -> int:
+        return self.queue.qsize()
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._work, name=f"argus-notification-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        LOG.info("Notification: started %i background workers", self.num_workers)
+
+    def stop(self, timeout: float = None):
+        "Let the workers finish what is in the queue, then stop them"
+        for _ in self.threads:
+            self.queue.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        if self.threads:
+            LOG.warning("Notification: %i background workers did not finish in time", len(self.threads))
+        self.log_stats()
+
+    def log_stats(self):
+        self.stats_logged = time.monotonic()
+        LOG.info("Notification: background workers: %s", self.stats)
+
+    def submit(self, function: Callable, *args) -> bool:
+        """Run ``function(*args)`` in a worker thread
+
+        Returns False if the queue stayed full for longer than the timeout, in
+        which case ``function`` has been run in the calling thread instead.
+        """
+        job = (time.monotonic(), function, args)
+        try:
+            self.queue.put(job, timeout=self.timeout)
+        except queue.Full:
+            LOG.warning(
+                "Notification: background queue has been full (%i) for %ss, sending in the foreground",
+                self.queue.maxsize,
+                self.timeout,
+            )
+            self._run(job, foreground=True)
+            return False
+        self.stats.record_submit(self.queue_depth)
+        return True
+
+    def _run(self, job, foreground=False):
+        submitted, function, args = job
+        started = time.monotonic()
+        failed = False
+        try:
+            function(*args)
+        except Exception:
+            failed = True
+            LOG.exception("Notification: background job failed")
+        finished = time.monotonic()
+        self.stats.record_done(started - submitted, finished - started, failed, foreground)
+        LOG.debug(
+            "Notification: job waited %.3fs, ran for %.3fs, %i jobs queued",
+            started - submitted,
+            finished - started,
+            self.queue_depth,
+        )
+        if finished - self.stats_logged >= STATS_LOG_INTERVAL:
+            self.log_stats()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            finally:
+                # Workers are long-lived, do not hang on to stale connections
+                close_old_connections()
+                self.queue.task_done()
+
+
+def get_worker_pool() -> NotificationWorkerPool:
+    "Get the pool of this process, starting it if necessary"
+    global _pool
+    with _pool_lock:
+        # Threads do not survive a fork, a forked process needs its own pool
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = NotificationWorkerPool(
+                workers=getattr(settings, "NOTIFICATION_WORKERS", DEFAULT_WORKERS),
+                queue_size=getattr(settings, "NOTIFICATION_QUEUE_SIZE", DEFAULT_QUEUE_SIZE),
+                timeout=getattr(settings, "NOTIFICATION_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT),
+            )
+            _pool.start()
+            atexit.register(_pool.stop, timeout=_pool.timeout)
+        return _pool
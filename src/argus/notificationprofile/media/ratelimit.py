@@ -0,0 +1,277 @@
+"""Rate limiting and deduplication of notifications
+
+Every address gets a token bucket that holds up to a minute's worth of
+messages and is refilled at the configured rate, and so does the medium as a
+whole. A message takes a token from both buckets or from neither. A message
+that finds either bucket empty is not sent, it is counted instead and the
+count is added to the next message that gets through, or flushed by the
+medium with ``RateLimiter.pop_all_spilled``. A message about an event of the
+same type and incident as a message sent to the same address during the
+deduplication window is dropped.
+
+The state lives in a backend. ``LocalMemoryBackend`` is per process.
+``CacheBackend`` uses a Django cache and is shared between processes if the
+cache is, like the Redis and database caches are. Its updates are not atomic,
+so under heavy contention a few more messages than the limit may get through.
+"""
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+import logging
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.core.cache import caches
+
+from argus.util.utils import import_class_from_dotted_path
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+
+__all__ = [
+    "RateLimitBackend",
+    "LocalMemoryBackend",
+    "CacheBackend",
+    "RateLimiter",
+    "get_rate_limiter",
+]
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = "argus.notificationprofile.media.ratelimit.LocalMemoryBackend"
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+class RateLimitBackend(ABC):
+    @abstractmethod
+    def take_tokens(self, buckets: Sequence[tuple[str, float, float]]) -> bool:
+        """Take a token from each of ``buckets``, or from none if any is empty
+
+        A bucket is a key, a capacity and a rate in tokens per second.
+        """
+        pass
+
+    @abstractmethod
+    def add(self, key: str, timeout: float) -> bool:
+        "Store ``key`` for ``timeout`` seconds, returns False if it was already stored"
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def incr(self, key: str) -> int:
+        "Increase the counter ``key`` and return the new value"
+        pass
+
+    @abstractmethod
+    def pop(self, key: str) -> int:
+        "Reset the counter ``key`` and return the old value"
+        pass
+
+    @abstractmethod
+    def pop_all(self, prefix: str) -> dict[str, int]:
+        "Reset all counters with keys starting with ``prefix`` and return the old values by key"
+        pass
+
+
+class LocalMemoryBackend(RateLimitBackend):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.keys = {}
+        self.counters = {}
+
+    def take_tokens(self, buckets):
+        now = time.monotonic()
+        with self.lock:
+            levels = {}
+            for key, capacity, rate in buckets:
+                tokens, then = self.buckets.get(key, (capacity, now))
+                levels[key] = min(capacity, tokens + (now - then) * rate)
+            allowed = all(tokens >= 1 for tokens in levels.values())
+            for key, tokens in levels.items():
+                self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+            return allowed
+
+    def add(self, key, timeout):
+        now = time.monotonic()
+        with self.lock:
+            if self.keys.get(key, 0) > now:
+                return False
+            self.keys[key] = now + timeout
+            # Do not grow without bounds
+            if len(self.keys) > 10000:
+                self.keys = {key: expires for key, expires in self.keys.items() if expires > now}
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.keys.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def pop(self, key):
+        with self.lock:
+            return self.counters.pop(key, 0)
+
+    def pop_all(self, prefix):
+        with self.lock:
+            popped = {key: count for key, count in self.counters.items() if key.startswith(prefix)}
+            for key in popped:
+                del self.counters[key]
+            return popped
+
+
+class CacheBackend(RateLimitBackend):
+    """Store the state in the Django cache ``alias``
+
+    The keys of the counters are kept in a list under ``index_key``, so that
+    they can be found again by ``pop_all``.
+    """
+
+    alias = "default"
+    timeout = 24 * 60 * 60  # seconds, for counters and buckets
+    index_key = "ratelimit:counters"
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or self.alias]
+
+    def take_tokens(self, buckets):
+        now = time.time()
+        stored = self.cache.get_many([key for key, _, _ in buckets])
+        levels = {}
+        for key, capacity, rate in buckets:
+            tokens, then = stored.get(key, (capacity, now))
+            levels[key] = min(capacity, tokens + (now - then) * rate)
+        allowed = all(tokens >= 1 for tokens in levels.values())
+        self.cache.set_many(
+            {key: (tokens - 1 if allowed else tokens, now) for key, tokens in levels.items()}, self.timeout
+        )
+        return allowed
+
+    def add(self, key, timeout):
+        return self.cache.add(key, 1, timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def incr(self, key):
+        self.cache.add(key, 0, self.timeout)
+        try:
+            count = self.cache.incr(key)
+        except ValueError:  # expired since it was added
+            self.cache.set(key, 1, self.timeout)
+            count = 1
+        if count == 1:
+            index = self.cache.get(self.index_key, [])
+            if key not in index:
+                self.cache.set(self.index_key, index + [key], self.timeout)
+        return count
+
+    def pop(self, key):
+        count = self.cache.get(key, 0)
+        if count:
+            self.cache.delete(key)
+        return count
+
+    def pop_all(self, prefix):
+        index = self.cache.get(self.index_key, [])
+        keys = [key for key in index if key.startswith(prefix)]
+        if not keys:
+            return {}
+        popped = {key: count for key, count in self.cache.get_many(keys).items() if count}
+        self.cache.delete_many(keys)
+        self.cache.set(self.index_key, [key for key in index if key not in keys], self.timeout)
+        return popped
+
+
+def get_backend(dotted_path: str) -> RateLimitBackend:
+    "Get the backend of class ``dotted_path``, shared by all limiters in this process"
+    with _backends_lock:
+        if dotted_path not in _backends:
+            _backends[dotted_path] = import_class_from_dotted_path(dotted_path)()
+        return _backends[dotted_path]
+
+
+class RateLimiter:
+    """Decide which messages of a medium may be sent
+
+    ``address_rate`` and ``medium_rate`` are in messages per minute, and
+    ``dedup_window`` is in seconds. 0 turns each off.
+    """
+
+    def __init__(
+        self, backend: RateLimitBackend, prefix: str, address_rate: int = 0, medium_rate: int = 0, dedup_window: int = 0
+    ):
+        self.backend = backend
+        self.prefix = prefix
+        self.address_rate = address_rate
+        self.medium_rate = medium_rate
+        self.dedup_window = dedup_window
+
+    def _key(self, *parts) -> str:
+        return ":".join(str(part) for part in (self.prefix, *parts))
+
+    def is_duplicate(self, address: str, incident_id: int, event_type: str) -> bool:
+        "Returns True if this was sent to ``address`` recently, otherwise remembers that it is"
+        if not self.dedup_window:
+            return False
+        return not self.backend.add(self._key("dedup", address, incident_id, event_type), self.dedup_window)
+
+    def forget(self, address: str, incident_id: int, event_type: str):
+        "Undo ``is_duplicate``, for when the message could not be sent after all"
+        if self.dedup_window:
+            self.backend.delete(self._key("dedup", address, incident_id, event_type))
+
+    def acquire(self, address: str) -> bool:
+        "Returns True if a message may be sent to ``address`` now, otherwise counts it as spilled"
+        buckets = []
+        if self.address_rate:
+            buckets.append((self._key("bucket", address), self.address_rate, self.address_rate / 60))
+        if self.medium_rate:
+            buckets.append((self._key("bucket"), self.medium_rate, self.medium_rate / 60))
+        allowed = self.backend.take_tokens(buckets) if buckets else True
+        if not allowed:
+            spilled = self.backend.incr(self._key("spilled", address))
+            LOG.info("%s: rate limit reached for %s, %i messages held back", self.prefix, address, spilled)
+        return allowed
+
+    def pop_spilled(self, address: str) -> int:
+        "Returns how many messages to ``address`` were held back since the last one was sent"
+        if not (self.address_rate or self.medium_rate):
+            return 0
+        return self.backend.pop(self._key("spilled", address))
+
+    def restore_spilled(self, address: str, count: int):
+        "Undo ``pop_spilled``, for when the message could not be sent after all"
+        for _ in range(count):
+            self.backend.incr(self._key("spilled", address))
+
+    def pop_all_spilled(self) -> dict[str, int]:
+        "Returns how many messages were held back by address, for sending on its own"
+        prefix = self._key("spilled", "")
+        return {key[len(prefix) :]: count for key, count in self.backend.pop_all(prefix).items()}
+
+
+def get_rate_limiter(medium_slug: str) -> RateLimiter:
+    "Get a rate limiter for ``medium_slug`` as configured in the settings"
+    prefix = medium_slug.upper()
+    return RateLimiter(
+        backend=get_backend(getattr(settings, "NOTIFICATION_RATE_LIMIT_BACKEND", DEFAULT_BACKEND)),
+        prefix=prefix,
+        address_rate=getattr(settings, f"{prefix}_RATE_LIMIT_PER_DESTINATION", 0),
+        medium_rate=getattr(settings, f"{prefix}_RATE_LIMIT", 0),
+        dedup_window=getattr(settings, f"{prefix}_DEDUP_WINDOW", 0),
+    )
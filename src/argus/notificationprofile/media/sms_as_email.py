@@ -6,21 +6,25 @@ recipient's phone number. The email body must contain the message text.
 
 from __future__ import annotations
 
+import atexit
 import logging
+import threading
 from typing import TYPE_CHECKING
 
 from django import forms
 from django.conf import settings
 from django.core.mail import send_mail
+from django.template.loader import render_to_string
 from phonenumber_field.formfields import PhoneNumberField
 from rest_framework.exceptions import ValidationError
 
 from ...incident.models import Event
 from .base import NotificationMedium
 from .email import send_email_safely
+from .ratelimit import get_rate_limiter
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable
+    from collections.abc import Iterable, Sequence
 
     from django.contrib.auth import get_user_model
     from django.db.models.query import QuerySet
@@ -32,6 +36,13 @@ if TYPE_CHECKING:
 
 LOG = logging.getLogger(__name__)
 
+# Seconds to wait before sending the counts of held back messages, by then
+# the buckets have been refilled and a message with the count may have gone
+HELD_BACK_DELAY = 60
+
+_held_back_timer = None
+_held_back_lock = threading.Lock()
+
 
 class SMSNotification(NotificationMedium):
     MEDIA_SLUG = "sms"
@@ -97,34 +108,112 @@ class SMSNotification(NotificationMedium):
         return set(phone_numbers)
 
     @classmethod
-    def send(cls, event: Event, destinations: Iterable[DestinationConfig], **_) -> bool:
-        """
-        Sends an SMS about a given event to the given sms destinations
-
-        Returns False if no SMS destinations were given and True if SMS were sent
-        """
+    def _send_sms(cls, message: str, phone_numbers: Iterable[str], event: Event = None) -> bool:
         recipient = getattr(settings, "SMS_GATEWAY_ADDRESS", None)
         if not recipient:
             LOG.error("SMS_GATEWAY_ADDRESS is not set, cannot dispatch SMS notifications using this plugin")
             return
 
-        phone_numbers = cls.get_relevant_addresses(destinations=destinations)
-        if not phone_numbers:
-            return False
-
+        limiter = get_rate_limiter(cls.MEDIA_SLUG)
         # there is only one recipient, so failing to send a single message
         # means something is wrong on the email server
         sent = True
         for phone_number in phone_numbers:
+            if event and limiter.is_duplicate(phone_number, event.incident_id, event.type):
+                LOG.info('SMS: Already sent "%s" to %s recently, skipping', event, phone_number)
+                continue
+            if not limiter.acquire(phone_number):
+                cls._schedule_send_held_back()
+                continue
+            text = message
+            spilled = limiter.pop_spilled(phone_number)
+            if spilled:
+                text = f"{message}\n(+{spilled} more not sent, rate limited)"
             sent = send_email_safely(
                 send_mail,
                 subject=f"sms {phone_number}",
-                message=f"{event.description}",
+                message=text,
                 from_email=None,
                 recipient_list=[recipient],
             )
             if not sent:
+                if event:
+                    limiter.forget(phone_number, event.incident_id, event.type)
+                limiter.restore_spilled(phone_number, spilled)
                 LOG.error("SMS: Failed to send")
                 break
 
         return sent
+
+    @classmethod
+    def send_held_back(cls) -> int:
+        """Tell every phone number how many SMS to it were held back
+
+        Normally the next SMS that gets through says so, this is for when
+        there is no next SMS. Returns to how many phone numbers it was sent.
+        """
+        recipient = getattr(settings, "SMS_GATEWAY_ADDRESS", None)
+        if not recipient:
+            return 0
+        limiter = get_rate_limiter(cls.MEDIA_SLUG)
+        told = 0
+        for phone_number, spilled in limiter.pop_all_spilled().items():
+            sent = send_email_safely(
+                send_mail,
+                subject=f"sms {phone_number}",
+                message=f"{spilled} more not sent, rate limited",
+                from_email=None,
+                recipient_list=[recipient],
+            )
+            if not sent:
+                limiter.restore_spilled(phone_number, spilled)
+                LOG.error("SMS: Failed to send the count of held back SMS")
+                break
+            told += 1
+        return told
+
+    @classmethod
+    def _schedule_send_held_back(cls):
+        global _held_back_timer
+        with _held_back_lock:
+            if _held_back_timer is None:
+                # Counts left at the end would be lost with the process
+                atexit.register(cls.send_held_back)
+            elif _held_back_timer.is_alive():
+                return
+            _held_back_timer = threading.Timer(HELD_BACK_DELAY, cls.send_held_back)
+            _held_back_timer.daemon = True
+            _held_back_timer.start()
+
+    @classmethod
+    def send(cls, event: Event, destinations: Iterable[DestinationConfig], **_) -> bool:
+        """
+        Sends an SMS about a given event to the given sms destinations
+
+        Returns False if no SMS destinations were given and True if SMS were sent
+        """
+        phone_numbers = cls.get_relevant_addresses(destinations=destinations)
+        if not phone_numbers:
+            return False
+        return cls._send_sms(f"{event.description}", phone_numbers, event=event)
+
+    @classmethod
+    def send_digests(cls, digests: Iterable[tuple[Sequence[Event], Iterable[DestinationConfig]]]) -> Sequence[bool]:
+        """
+        Sends one SMS about all the events of each digest to its sms
+        destinations, listing the first few events
+
+        Returns, in order, whether each digest was sent
+        """
+        results = []
+        for events, destinations in digests:
+            if len(events) == 1:
+                results.append(cls.send(events[0], destinations))
+                continue
+            phone_numbers = cls.get_relevant_addresses(destinations=destinations)
+            if not phone_numbers:
+                results.append(False)
+                continue
+            message = render_to_string("notificationprofile/sms_digest.txt", {"events": events})
+            results.append(cls._send_sms(message.strip(), phone_numbers))
+        return results
@@ -0,0 +1,16 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('argus_notificationprofile', '0018_notificationjob'),
+    ]
+
+    operations = [
+        # Tells every process when notification profiles and filters have changed
+        migrations.RunSQL(
+            "CREATE SEQUENCE IF NOT EXISTS argus_notificationprofile_version_seq",
+            "DROP SEQUENCE IF EXISTS argus_notificationprofile_version_seq",
+        ),
+    ]
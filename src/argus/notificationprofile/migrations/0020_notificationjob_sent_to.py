@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-18 07:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('argus_notificationprofile', '0019_version_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationjob',
+            name='sent_to',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
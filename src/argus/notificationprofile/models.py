@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 import logging
 from typing import TYPE_CHECKING, Optional
 
@@ -8,8 +8,11 @@ from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
 from django.db import models
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.text import slugify
 
+from .weekbitmap import WeekBitmap
+
 if TYPE_CHECKING:
     from argus.incident.models import Event, Incident  # noqa: F401
 
@@ -30,11 +33,19 @@ class Timeslot(models.Model):
     def __str__(self):
         return self.name
 
+    @cached_property
+    def week_bitmap(self) -> WeekBitmap:
+        return WeekBitmap.from_time_recurrences(self.time_recurrences.all())
+
+    def forget_week_bitmap(self):
+        self.__dict__.pop("week_bitmap", None)
+
+    def save(self, *args, **kwargs):
+        self.forget_week_bitmap()
+        super().save(*args, **kwargs)
+
     def timestamp_is_within_time_recurrences(self, timestamp: datetime):
-        for time_recurrence in self.time_recurrences.all():
-            if time_recurrence.timestamp_is_within(timestamp):
-                return True
-        return False
+        return self.week_bitmap.timestamp_is_within(timestamp)
 
 
 class TimeRecurrence(models.Model):
@@ -83,7 +94,7 @@ class TimeRecurrence(models.Model):
         return [self.Day(day).label for day in self.days]
 
     def timestamp_is_within(self, timestamp: datetime):
-        # FIXME: Might affect performance negatively if calling this method frequently
+        # Use Timeslot.timestamp_is_within_time_recurrences when checking often
         timestamp = timestamp.astimezone(timezone.get_current_timezone())
         return timestamp.isoweekday() in self.isoweekdays and self.start <= timestamp.time() <= self.end
 
@@ -92,6 +103,16 @@ class TimeRecurrence(models.Model):
         if self.days:
             self.days = sorted(self.days)
         super().save(*args, **kwargs)
+        self._forget_timeslot_week_bitmap()
+
+    def delete(self, *args, **kwargs):
+        self._forget_timeslot_week_bitmap()
+        return super().delete(*args, **kwargs)
+
+    def _forget_timeslot_week_bitmap(self):
+        # Only if the timeslot has been loaded, there is nothing cached otherwise
+        if TimeRecurrence.timeslot.is_cached(self):
+            self.timeslot.forget_week_bitmap()
 
 
 class Filter(models.Model):
@@ -177,3 +198,56 @@ class NotificationProfile(models.Model):
         if self.name:
             return f"{self.name}"
         return f"{self.timeslot}: {', '.join(str(f) for f in self.filters.all())}"
+
+
+class NotificationJobQuerySet(models.QuerySet):
+    def pending(self, timestamp=None):
+        timestamp = timestamp if timestamp else timezone.now()
+        return self.filter(status=NotificationJob.Status.PENDING, next_attempt__lte=timestamp)
+
+    def stale(self, timeout: timedelta, timestamp=None):
+        "Jobs claimed by a worker that has not finished them within ``timeout``"
+        timestamp = timestamp if timestamp else timezone.now()
+        return self.filter(status=NotificationJob.Status.SENDING, claimed__lte=timestamp - timeout)
+
+    def done(self):
+        return self.filter(status=NotificationJob.Status.DONE)
+
+
+class NotificationJob(models.Model):
+    """A notification about an event that is yet to be sent
+
+    Written in the same transaction as the event and processed by the
+    ``notification_worker`` management command.
+    """
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Pending"
+        SENDING = "sending", "Sending"
+        DONE = "done", "Done"
+        FAILED = "failed", "Failed"
+
+    event = models.ForeignKey(to="argus_incident.Event", on_delete=models.CASCADE, related_name="notification_jobs")
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    claimed = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    # pks of the destinations already sent to, these are skipped on retries
+    sent_to = models.JSONField(default=list, blank=True)
+
+    objects = NotificationJobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["next_attempt"],
+                condition=models.Q(status="pending"),
+                name="notificationjob_pending_idx",
+            ),
+        ]
+        ordering = ["id"]
+
+    def __str__(self):
+        return f"Notification job #{self.pk} for event #{self.event_id} ({self.status})"
@@ -0,0 +1,216 @@
+"""Durable notification queue stored in the database
+
+When :setting:`NOTIFICATION_DELIVERY` is ``"database"``, saving an event
+writes a ``NotificationJob`` in the same transaction instead of sending
+notifications right away. Any number of ``notification_worker`` processes, on
+any number of hosts, then claim jobs in batches with ``SELECT ... FOR UPDATE
+SKIP LOCKED``, send them and record the outcome per destination. Failed jobs
+are retried with an increasing delay, to the destinations that failed only,
+and jobs claimed by a worker that died are picked up again after
+:setting:`NOTIFICATION_JOB_TIMEOUT` seconds.
+
+With :setting:`NOTIFICATION_DIGEST_WINDOW`, jobs are due at the end of the
+window they were created in, and the jobs of a batch are sent as digests.
+"""
+
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import timedelta
+from itertools import chain
+import logging
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .media import find_destinations_for_many_events, get_notification_media
+from .media.digest import end_of_window, get_digest_window
+from .models import NotificationJob
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from argus.incident.models import Event  # noqa: Break circular import
+
+
+__all__ = [
+    "enqueue_notifications",
+    "claim_jobs",
+    "process_jobs",
+]
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_JOB_TIMEOUT = 600  # seconds
+RETRY_DELAY = 30  # seconds, doubled for every attempt
+
+
+def enqueue_notifications(*events: Event) -> list[NotificationJob]:
+    "Queue notifications about ``events``, use inside the transaction that creates them"
+    if not getattr(settings, "SEND_NOTIFICATIONS", False):
+        LOG.info("Notification: turned off sitewide, not queueing any")
+        return []
+    window = get_digest_window()
+    if window:
+        # All jobs of a window are due together so that they are claimed together
+        due = end_of_window(timezone.now(), window)
+        jobs = [NotificationJob(event=event, next_attempt=due) for event in events]
+    else:
+        jobs = [NotificationJob(event=event) for event in events]
+    jobs = NotificationJob.objects.bulk_create(jobs)
+    LOG.debug("Notification: queued %i jobs", len(jobs))
+    return jobs
+
+
+def claim_jobs(batch_size: int = 100) -> list[NotificationJob]:
+    """Claim up to ``batch_size`` jobs that are due
+
+    Jobs locked by other workers are skipped, so several workers can claim
+    jobs at the same time without getting the same ones. Jobs whose worker
+    did not finish in time count that as an attempt, and fail when they run
+    out of attempts, so that a job that crashes its worker is not retried
+    forever.
+    """
+    now = timezone.now()
+    job_timeout = timedelta(seconds=getattr(settings, "NOTIFICATION_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT))
+    max_attempts = getattr(settings, "NOTIFICATION_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+    with transaction.atomic():
+        stale = list(NotificationJob.objects.stale(job_timeout, now).select_for_update(skip_locked=True))
+        stale_ids = []
+        for job in stale:
+            job.attempts += 1
+            job.last_error = "worker did not finish in time"
+            if job.attempts >= max_attempts:
+                job.status = NotificationJob.Status.FAILED
+                LOG.error(
+                    "Notification: giving up on %s after %i attempts, its worker did not finish in time",
+                    job,
+                    job.attempts,
+                )
+            else:
+                LOG.warning("Notification: reclaiming %s, its worker did not finish in time", job)
+                stale_ids.append(job.pk)
+        NotificationJob.objects.bulk_update(stale, ["status", "attempts", "last_error"])
+        due = NotificationJob.objects.pending(now).select_for_update(skip_locked=True)
+        ids = stale_ids + list(due.values_list("pk", flat=True)[: max(0, batch_size - len(stale_ids))])
+        NotificationJob.objects.filter(pk__in=ids).update(status=NotificationJob.Status.SENDING, claimed=now)
+    return list(NotificationJob.objects.filter(pk__in=ids).select_related("event__incident__source", "event__actor"))
+
+
+def _send(notifications: list[tuple[NotificationJob, set]]) -> tuple[dict[int, list[str]], dict[int, set[int]]]:
+    """Send the events of the jobs in ``notifications`` to their destinations
+
+    Each medium gets all its events at once, every destination on its own so
+    that a failure is known per destination. Returns the errors by job and
+    the pks of the destinations each job was sent to.
+    """
+    errors = defaultdict(list)
+    sent_to = defaultdict(set)
+    all_destinations = set(chain.from_iterable(destinations for _, destinations in notifications))
+    for medium in get_notification_media(all_destinations):
+        batch = [
+            (job, destination)
+            for job, destinations in notifications
+            for destination in destinations
+            if destination.media_id == medium.MEDIA_SLUG
+        ]
+        try:
+            results = medium.send_batch([(job.event, [destination]) for job, destination in batch])
+        except Exception as e:
+            LOG.exception('Notification: could not send %i events to "%s"', len(batch), medium.MEDIA_SLUG)
+            results = [False] * len(batch)
+            error = f"{medium.MEDIA_SLUG}: {e}"
+        else:
+            error = f"{medium.MEDIA_SLUG}: not sent"
+        for (job, destination), sent in zip(batch, results):
+            if sent:
+                sent_to[job.pk].add(destination.pk)
+            elif error not in errors[job.pk]:
+                errors[job.pk].append(error)
+    return errors, sent_to
+
+
+def _send_digests(
+    notifications: list[tuple[NotificationJob, set]],
+) -> tuple[dict[int, list[str]], dict[int, set[int]]]:
+    """Like ``_send``, but every destination gets one message about all its events
+
+    A failed digest counts as an error for all the jobs in it.
+    """
+    jobs_by_destination = defaultdict(list)
+    for job, destinations in notifications:
+        for destination in destinations:
+            jobs_by_destination[destination].append(job)
+    errors = defaultdict(list)
+    sent_to = defaultdict(set)
+    for medium in get_notification_media(jobs_by_destination.keys()):
+        batch = [
+            (destination, jobs)
+            for destination, jobs in jobs_by_destination.items()
+            if destination.media_id == medium.MEDIA_SLUG
+        ]
+        try:
+            results = medium.send_digests([([job.event for job in jobs], [destination]) for destination, jobs in batch])
+        except Exception as e:
+            LOG.exception('Notification: could not send %i digests to "%s"', len(batch), medium.MEDIA_SLUG)
+            results = [False] * len(batch)
+            error = f"{medium.MEDIA_SLUG}: {e}"
+        else:
+            error = f"{medium.MEDIA_SLUG}: not sent"
+        for (destination, jobs), sent in zip(batch, results):
+            for job in jobs:
+                if sent:
+                    sent_to[job.pk].add(destination.pk)
+                elif error not in errors[job.pk]:
+                    errors[job.pk].append(error)
+    return errors, sent_to
+
+
+def _mark_failed(job: NotificationJob, errors: Iterable[str], now):
+    max_attempts = getattr(settings, "NOTIFICATION_JOB_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+    job.attempts += 1
+    job.last_error = "\n".join(errors)
+    if job.attempts >= max_attempts:
+        job.status = NotificationJob.Status.FAILED
+        LOG.error("Notification: giving up on %s after %i attempts", job, job.attempts)
+    else:
+        job.status = NotificationJob.Status.PENDING
+        job.next_attempt = now + timedelta(seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+
+
+def process_jobs(jobs: Iterable[NotificationJob]) -> tuple[int, int]:
+    """Send the notifications of claimed ``jobs`` and record the outcome
+
+    Returns the number of jobs that were sent and that failed.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return 0, 0
+    all_destinations = find_destinations_for_many_events([job.event for job in jobs])
+    # A retried job is only sent to the destinations that failed the last time
+    notifications = []
+    for job in jobs:
+        destinations = {d for d in all_destinations.get(job.event, ()) if d.pk not in job.sent_to}
+        if destinations:
+            notifications.append((job, destinations))
+    send = _send_digests if get_digest_window() else _send
+    all_errors, all_sent_to = send(notifications) if notifications else ({}, {})
+    now = timezone.now()
+    sent = failed = 0
+    for job in jobs:
+        job.sent_to = sorted(set(job.sent_to) | all_sent_to.get(job.pk, set()))
+        errors = all_errors.get(job.pk)
+        if errors:
+            _mark_failed(job, errors, now)
+            failed += 1
+        else:
+            job.status = NotificationJob.Status.DONE
+            job.attempts += 1
+            job.last_error = ""
+            sent += 1
+    NotificationJob.objects.bulk_update(jobs, ["status", "attempts", "next_attempt", "last_error", "sent_to"])
+    return sent, failed
@@ -3,6 +3,7 @@ import logging
 from django.contrib.auth import get_user_model
 from django.db.utils import ProgrammingError
 
+from .matching import invalidate_profile_matcher
 from .models import DestinationConfig, TimeRecurrence, Timeslot
 
 LOG = logging.getLogger(__name__)
@@ -83,6 +84,8 @@ def sync_email_destination(sender, instance: User, created, raw, *args, **kwargs
     # There exists a destination with email_address == user.email
     if user_email_destination:
         if not user_email_destination == synced_email_destination:
+            # bulk_update() and bulk_create() do not send signals
+            invalidate_profile_matcher()
             if synced_email_destination:
                 synced_email_destination.settings["synced"] = False
                 DestinationConfig.objects.bulk_update(objs=[synced_email_destination], fields=["settings"])
@@ -91,6 +94,7 @@ def sync_email_destination(sender, instance: User, created, raw, *args, **kwargs
 
     # We need to create a destination with email_address=user.email
     else:
+        invalidate_profile_matcher()
         if synced_email_destination:
             synced_email_destination.settings["synced"] = False
             DestinationConfig.objects.bulk_update(objs=[synced_email_destination], fields=["settings"])
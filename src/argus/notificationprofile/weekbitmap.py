@@ -0,0 +1,81 @@
+"""Fast lookup of whether a point in time is within a set of time recurrences
+
+A week has 10080 minutes. A ``WeekBitmap`` has one bit per minute of the week
+telling whether any of the time recurrences covers all of that minute, so
+checking a timestamp is one lookup. Time recurrences may start or end in the
+middle of a minute, those minutes are marked in a second bitmap and checked
+against the time recurrences themselves.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, time
+from typing import TYPE_CHECKING
+
+from django.utils import timezone
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+
+__all__ = ["WeekBitmap"]
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+def _minute_of_day(time_: time) -> int:
+    return time_.hour * 60 + time_.minute
+
+
+def _set(bitmap: bytearray, index: int):
+    bitmap[index >> 3] |= 1 << (index & 7)
+
+
+def _is_set(bitmap: bytearray, index: int) -> bool:
+    return bool(bitmap[index >> 3] & (1 << (index & 7)))
+
+
+class WeekBitmap:
+    """The minutes of the week, in local time, covered by time recurrences
+
+    ``recurrences`` are triples of isoweekdays, start and end, where both start
+    and end are included like in ``TimeRecurrence.timestamp_is_within``.
+    """
+
+    __slots__ = ("full", "partial", "recurrences")
+
+    def __init__(self, recurrences: Iterable[tuple[Iterable[int], time, time]] = ()):
+        self.full = bytearray(MINUTES_PER_WEEK // 8)
+        self.partial = bytearray(MINUTES_PER_WEEK // 8)
+        self.recurrences = tuple((frozenset(days), start, end) for days, start, end in recurrences)
+        for days, start, end in self.recurrences:
+            if start > end:
+                continue
+            first, last = _minute_of_day(start), _minute_of_day(end)
+            starts_on_the_minute = start.second == 0 and start.microsecond == 0
+            ends_with_the_minute = end.second == 59 and end.microsecond == 999999
+            for day in days:
+                offset = (day - 1) * MINUTES_PER_DAY
+                for minute in range(first, last + 1):
+                    whole_minute = (minute > first or starts_on_the_minute) and (minute < last or ends_with_the_minute)
+                    _set(self.full if whole_minute else self.partial, offset + minute)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} recurrences={len(self.recurrences)}>"
+
+    @classmethod
+    def from_time_recurrences(cls, time_recurrences):
+        return cls((recurrence.isoweekdays, recurrence.start, recurrence.end) for recurrence in time_recurrences)
+
+    def timestamp_is_within(self, timestamp: datetime) -> bool:
+        timestamp = timestamp.astimezone(timezone.get_current_timezone())
+        weekday = timestamp.isoweekday()
+        index = (weekday - 1) * MINUTES_PER_DAY + timestamp.hour * 60 + timestamp.minute
+        if _is_set(self.full, index):
+            return True
+        if not _is_set(self.partial, index):
+            return False
+        time_ = timestamp.time()
+        return any(weekday in days and start <= time_ <= end for days, start, end in self.recurrences)
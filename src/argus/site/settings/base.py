@@ -239,6 +239,13 @@ CHANNEL_LAYERS = {
 }
 # fmt: on
 
+# Milliseconds to collect changed incidents in order to send them to the
+# websockets together. 0 sends them right after each commit
+WEBSOCKET_BATCH_WINDOW = get_int_env("ARGUS_WEBSOCKET_BATCH_WINDOW", 200)
+
+# Seconds between each look for changes when streaming incidents as server-sent events
+INCIDENT_STREAM_POLL_INTERVAL = get_int_env("ARGUS_INCIDENT_STREAM_POLL_INTERVAL", 1)
+
 # Project specific settings
 
 # Set this to be able to send notifications
@@ -250,6 +257,31 @@ NOTIFICATION_SUBJECT_PREFIX = "[Argus] "
 
 # Don't spam by accident
 SEND_NOTIFICATIONS = get_bool_env("ARGUS_SEND_NOTIFICATIONS", default=False)
+# Also notify about acks and events added through the bulk endpoints
+SEND_BULK_NOTIFICATIONS = get_bool_env("ARGUS_SEND_BULK_NOTIFICATIONS", default=False)
+
+# Background workers sending notifications, per process
+NOTIFICATION_WORKERS = get_int_env("ARGUS_NOTIFICATION_WORKERS", 4)
+NOTIFICATION_QUEUE_SIZE = get_int_env("ARGUS_NOTIFICATION_QUEUE_SIZE", 1000)
+NOTIFICATION_QUEUE_TIMEOUT = get_int_env("ARGUS_NOTIFICATION_QUEUE_TIMEOUT", 5)
+
+# Seconds to hold back events in order to send one message per destination
+# about all of them. 0 sends every event right away
+NOTIFICATION_DIGEST_WINDOW = get_int_env("ARGUS_NOTIFICATION_DIGEST_WINDOW", 0)
+
+# "background": send from the process that saved the event
+# "database": queue in the database for the notification_worker command
+NOTIFICATION_DELIVERY = get_str_env("ARGUS_NOTIFICATION_DELIVERY", "background")
+NOTIFICATION_JOB_MAX_ATTEMPTS = get_int_env("ARGUS_NOTIFICATION_JOB_MAX_ATTEMPTS", 5)
+NOTIFICATION_JOB_TIMEOUT = get_int_env("ARGUS_NOTIFICATION_JOB_TIMEOUT", 600)
+
+# Limits for SMS, rates are in messages per minute and 0 is unlimited
+SMS_RATE_LIMIT = get_int_env("ARGUS_SMS_RATE_LIMIT", 0)
+SMS_RATE_LIMIT_PER_DESTINATION = get_int_env("ARGUS_SMS_RATE_LIMIT_PER_DESTINATION", 0)
+SMS_DEDUP_WINDOW = get_int_env("ARGUS_SMS_DEDUP_WINDOW", 0)
+NOTIFICATION_RATE_LIMIT_BACKEND = get_str_env(
+    "ARGUS_NOTIFICATION_RATE_LIMIT_BACKEND", "argus.notificationprofile.media.ratelimit.LocalMemoryBackend"
+)
 
 # 3rd party settings
 
@@ -54,6 +54,8 @@ CHANNEL_LAYERS = {
     }
 }
 # fmt: on
+# Publish to the websockets when the transaction is committed
+WEBSOCKET_BATCH_WINDOW = 0
 
 try:
     postgres_version_str = subprocess.check_output(["pg_config", "--version"]).decode().strip()
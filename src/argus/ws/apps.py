@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.models.signals import m2m_changed, post_delete, post_save
 
 
 class WSConfig(AppConfig):
     name = "argus.ws"
     label = "argus_ws"
+
+    def ready(self):
+        # Keep the websocket subscriptions in sync with filters and profiles
+        from argus.notificationprofile.models import NotificationProfile
+        from .subscriptions import invalidate_subscription_matcher
+
+        for model in ("NotificationProfile", "Filter"):
+            sender = f"argus_notificationprofile.{model}"
+            post_save.connect(invalidate_subscription_matcher, sender, dispatch_uid=f"invalidate_ws_save_{model}")
+            post_delete.connect(invalidate_subscription_matcher, sender, dispatch_uid=f"invalidate_ws_delete_{model}")
+        m2m_changed.connect(
+            invalidate_subscription_matcher, NotificationProfile.filters.through, dispatch_uid="invalidate_ws_filters"
+        )
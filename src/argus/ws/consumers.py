@@ -1,9 +1,23 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
+from argus.filter import get_filter_backend
 from argus.incident.models import Incident
 from argus.incident.serializers import IncidentSerializer
+from argus.notificationprofile.models import Filter, NotificationProfile
 from .models import SUBSCRIBED_OPEN_INCIDENTS
+from .subscriptions import (
+    IncidentFromFacts,
+    get_filter_group,
+    get_filtered_incidents,
+    get_profile_group,
+)
+
+
+filter_backend = get_filter_backend()
+
+DEFAULT_CHUNK_SIZE = 25
+MAX_CHUNK_SIZE = 500
 
 
 class ClientError(Exception):
@@ -17,36 +31,182 @@ class ClientError(Exception):
         self.code = code
 
 
-class OpenIncidentConsumer(JsonWebsocketConsumer):
-    def connect(self):
+class OpenIncidentConsumer(AsyncJsonWebsocketConsumer):
+    """Send changes to incidents to a client
+
+    Every change has a number, ``seq``, higher than those of earlier changes.
+    A client that subscribes again with the ``seq`` of the last change it got
+    as ``since`` gets the incidents changed after that, instead of all the
+    open incidents. Either are sent in chunks of ``chunk_size`` incidents.
+    """
+
+    subscribed = False
+    group = None
+    filterwrapper = None
+
+    async def connect(self):
         user = self.scope["user"]
         if user and user.is_authenticated:
-            return self.accept()
+            await self.accept()
 
-    def disconnect(self, code):
-        async_to_sync(self.channel_layer.group_discard)(SUBSCRIBED_OPEN_INCIDENTS, self.channel_name)
+    async def disconnect(self, code):
+        await self.unsubscribe()
 
-    def receive_json(self, content, **kwargs):
+    async def receive_json(self, content, **kwargs):
         action = content.get("action", None)
         try:
             if action == "subscribe":
-                self.subscribe()
+                await self.subscribe(content)
             else:
-                self.send_json({"error": f"unknown action {action}"})
+                await self.send_json({"error": f"unknown action {action}"})
         except ClientError as e:
             # Catch any errors and send it back
-            self.send_json({"error": e.code})
+            await self.send_json({"error": e.code})
+
+    async def notify(self, event):
+        await self.send_json(event["content"])
+
+    async def notify_batch(self, event):
+        for content, fits in zip(event["contents"], self.get_fits(event)):
+            if fits is None:
+                await self.send_json(content)
+            elif fits:
+                await self.send_json({**content, "fits": True})
+            elif content["type"] != "created":
+                # The client may have the incident from when it did fit
+                pk = content["payload"]["pk"]
+                await self.send_json(
+                    {"type": content["type"], "payload": {"pk": pk}, "seq": content["seq"], "fits": False}
+                )
 
-    def notify(self, event):
-        self.send_json(event["content"])
+    def get_fits(self, event):
+        "Whether each incident in ``event`` fits the subscription, or None for each if there is no filter"
+        if self.filterwrapper is not None:
+            return [self.filterwrapper.incident_fits(IncidentFromFacts(facts)) for facts in event["facts"]]
+        if self.group is not None:
+            return [self.group in groups for groups in event["groups"]]
+        return [None] * len(event["contents"])
 
-    def subscribe(self, limit=25):
-        async_to_sync(self.channel_layer.group_add)(SUBSCRIBED_OPEN_INCIDENTS, self.channel_name)
+    async def subscribe(self, content=None):
+        """Subscribe to changes to incidents, replacing any earlier subscription
 
-        incidents = self.get_open_incidents()
-        serialized = IncidentSerializer(incidents, many=True)
+        ``content`` may have one of "filter", the pk of a filter,
+        "notificationprofile", the pk of a notification profile, or
+        "filterblob", a filter that is not saved. Without any of them, all
+        incidents are subscribed to.
+        """
+        content = content or {}
+        since = self.get_int(content, "since", minimum=0)
+        chunk_size = min(self.get_int(content, "chunk_size", minimum=1) or DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE)
+        group, filterblobs = await database_sync_to_async(self.get_subscription)(content)
+        if not self.subscribed:
+            # Changes published from now on are sent after what is sent here
+            await self.channel_layer.group_add(SUBSCRIBED_OPEN_INCIDENTS, self.channel_name)
+            self.subscribed = True
+        self.group = group
+        self.filterwrapper = None
+        if group is None and filterblobs:
+            self.filterwrapper = filter_backend.FilterWrapper(filterblobs[0])
 
-        self.send_json({"type": "subscribed", "channel_name": self.channel_name, "start_incidents": serialized.data})
+        seq, pks, fitting = await database_sync_to_async(self.get_incident_pks)(since, filterblobs)
+        chunks = [pks[i : i + chunk_size] for i in range(0, len(pks), chunk_size)]
+        start_incidents = []
+        if since is None and chunks:
+            start_incidents = await database_sync_to_async(self.serialize)(chunks.pop(0))
+        await self.send_json(
+            {
+                "type": "subscribed",
+                "channel_name": self.channel_name,
+                "start_incidents": start_incidents,
+                "seq": seq,
+                "more": bool(chunks),
+            }
+        )
+        message_type = "start_incidents" if since is None else "changes"
+        for i, chunk in enumerate(chunks, start=1):
+            incidents = await database_sync_to_async(self.serialize)(chunk, fitting)
+            await self.send_json({"type": message_type, "incidents": incidents, "more": i < len(chunks)})
 
-    def get_open_incidents(self, last=25):
-        return Incident.objects.open().order_by("-start_time")[:last]
+    async def unsubscribe(self):
+        if self.subscribed:
+            await self.channel_layer.group_discard(SUBSCRIBED_OPEN_INCIDENTS, self.channel_name)
+        self.subscribed = False
+        self.group = None
+        self.filterwrapper = None
+
+    @staticmethod
+    def get_int(content, key, minimum):
+        if content.get(key) is None:
+            return None
+        try:
+            value = int(content[key])
+        except (TypeError, ValueError):
+            raise ClientError(f"invalid {key}")
+        if value < minimum:
+            raise ClientError(f"invalid {key}")
+        return value
+
+    def get_subscription(self, content):
+        "Return the group of the filter or profile subscribed to, if any, and the filters its incidents fit"
+        user = self.scope["user"]
+        if "filter" in content:
+            filter_ = Filter.objects.filter(pk=self.get_int(content, "filter", minimum=1), user=user).first()
+            if filter_ is None:
+                raise ClientError("unknown filter")
+            return get_filter_group(filter_.pk), [filter_.filter]
+        if "notificationprofile" in content:
+            pk = self.get_int(content, "notificationprofile", minimum=1)
+            profile = NotificationProfile.objects.filter(pk=pk, user=user).first()
+            if profile is None:
+                raise ClientError("unknown notificationprofile")
+            filterblobs = [filter_.filter for filter_ in profile.filters.all()]
+            if not filterblobs:
+                raise ClientError("notificationprofile has no filters")
+            return get_profile_group(profile.pk), filterblobs
+        if "filterblob" in content:
+            serializer = filter_backend.FilterBlobSerializer(data=content["filterblob"])
+            if not serializer.is_valid():
+                raise ClientError(f"invalid filterblob: {serializer.errors}")
+            # Checked by the consumer, against the facts sent along with every change
+            return None, [serializer.validated_data]
+        return None, []
+
+    def get_incident_pks(self, since, filterblobs):
+        """Return the number of the latest change, the pks of the incidents to send, and which of them fit
+
+        Those are the open incidents that fit ``filterblobs``, newest first,
+        or if ``since`` is set all the incidents changed after that, in the
+        order they were changed. Which of those fit is only returned when
+        there are filters, as a set of pks.
+        """
+        seq = Incident.objects.last_change_seq()
+        if since is None:
+            incidents = get_filtered_incidents(Incident.objects.open(), filterblobs).order_by("-start_time")
+            return seq, list(incidents.values_list("pk", flat=True)), None
+        incidents = Incident.objects.changed_since(since).filter(change_seq__lte=seq).order_by("change_seq")
+        fitting = None
+        if filterblobs:
+            # The client may have incidents that do not fit anymore, and needs to hear about them too
+            fitting = set(get_filtered_incidents(incidents, filterblobs).values_list("pk", flat=True))
+        return seq, list(incidents.values_list("pk", flat=True)), fitting
+
+    def serialize(self, pks, fitting=None):
+        """Serialize the incidents with ``pks`` in that order, along with the number of their latest change
+
+        If ``fitting`` is set, the incidents in it are marked as fitting, and
+        only the pk of the others is sent.
+        """
+        incidents = Incident.objects.prefetch_default_related().in_bulk(pks)
+        serialized = []
+        for pk in pks:
+            if pk not in incidents:
+                continue
+            if fitting is None or pk in fitting:
+                data = IncidentSerializer(incidents[pk]).data
+            else:
+                data = {"pk": pk}
+            data["seq"] = incidents[pk].change_seq
+            if fitting is not None:
+                data["fits"] = pk in fitting
+            serialized.append(data)
+        return serialized
@@ -0,0 +1,154 @@
+"""Send changed incidents to websocket subscribers in batches
+
+Incidents are queued when the transaction that changed them is committed, and
+collected for :setting:`WEBSOCKET_BATCH_WINDOW` milliseconds. An incident that
+changes several times during the window is only fetched and serialized once,
+and all the incidents go to the channel layer in one message. The consumers
+pass them on to the clients one by one, as before. Which clients get which
+incidents is decided in ``argus.ws.subscriptions``.
+"""
+
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connections, transaction
+
+from argus.incident.models import Incident
+from argus.incident.serializers import IncidentSerializer
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterable, Mapping
+
+
+__all__ = [
+    "SUBSCRIBED_OPEN_INCIDENTS",
+    "IncidentPublisher",
+    "get_batch_window",
+    "get_publisher",
+    "publish_incidents",
+    "queue_incidents",
+]
+
+
+LOG = logging.getLogger(__name__)
+SUBSCRIBED_OPEN_INCIDENTS = "subscribed_open_incidents"
+DEFAULT_BATCH_WINDOW = 200  # milliseconds
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_batch_window() -> float:
+    "The batch window in seconds, 0 to publish right after each commit"
+    return max(0, getattr(settings, "WEBSOCKET_BATCH_WINDOW", DEFAULT_BATCH_WINDOW) or 0) / 1000
+
+
+def publish_incidents(pending: Mapping[int, bool]):
+    """Send the incidents with the primary keys in ``pending``, which tells whether they are new
+
+    All the incidents go to every client in one message. Along with each goes
+    what the consumers need to check the subscription of their client: the
+    groups of the filters and profiles it fits, and the facts that a filter
+    that is not saved is checked against. The incidents are numbered first,
+    and sent in that order, so that clients can catch up on what they missed
+    with the number of the last change they got.
+    """
+    # The filter backend needs the models to be loaded, and this module is imported by models.py
+    from .subscriptions import get_facts, get_subscription_matcher
+
+    Incident.objects.filter(pk__in=pending.keys()).bump_change_seq()
+    incidents = Incident.objects.prefetch_default_related().filter(pk__in=pending.keys()).order_by("change_seq")
+    matcher = get_subscription_matcher()
+    message = {"type": "notify_batch", "contents": [], "groups": [], "facts": []}
+    for incident in incidents:
+        content = {
+            "type": "created" if pending[incident.pk] else "modified",
+            "payload": IncidentSerializer(incident).data,
+            "seq": incident.change_seq,
+        }
+        message["contents"].append(content)
+        message["groups"].append(matcher.groups(incident))
+        message["facts"].append(get_facts(incident))
+    if not message["contents"]:
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(SUBSCRIBED_OPEN_INCIDENTS, message)
+    except ConnectionRefusedError as error:
+        LOG.error("Websockets: Could not push: %s", error)
+
+
+class IncidentPublisher:
+    """Collect changed incidents and publish them together
+
+    ``publish`` is called with a mapping from primary key to whether the
+    incident is new when the window is over.
+    """
+
+    def __init__(self, window: float, publish: Callable[[Mapping[int, bool]], None]):
+        self.window = window
+        self.publish = publish
+        self.pid = os.getpid()
+        self.pending = {}
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} window={self.window}s incidents={len(self.pending)}>"
+
+    def add(self, pks: Iterable[int], created: bool = False):
+        with self.lock:
+            for pk in pks:
+                # Still new if it was created earlier in the window
+                self.pending[pk] = self.pending.get(pk, False) or created
+            if self.window and self.timer is None:
+                self.timer = threading.Timer(self.window, self._timeout)
+                self.timer.daemon = True
+                self.timer.start()
+        if not self.window:
+            self.flush()
+
+    def _timeout(self):
+        try:
+            self.flush()
+        except Exception:
+            LOG.exception("Websockets: Could not publish incidents")
+        finally:
+            # The timer thread is gone after this, and so would its connection be
+            connections.close_all()
+
+    def flush(self):
+        "Publish everything that is pending right away"
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if pending:
+            LOG.debug("Websockets: publishing %i incidents", len(pending))
+            self.publish(pending)
+
+
+def get_publisher() -> IncidentPublisher:
+    "Get the publisher of this process, creating it if necessary"
+    global _publisher
+    with _publisher_lock:
+        if _publisher is None or _publisher.pid != os.getpid():
+            _publisher = IncidentPublisher(get_batch_window(), publish_incidents)
+            # Do not lose what is pending when the process exits
+            atexit.register(_publisher.flush)
+        return _publisher
+
+
+def queue_incidents(incidents: Iterable[Incident], created: bool = False):
+    "Publish ``incidents`` once the current transaction is committed"
+    pks = [incident.pk for incident in incidents]
+    if pks:
+        transaction.on_commit(lambda: get_publisher().add(pks, created))
@@ -0,0 +1,151 @@
+"""Send changed incidents only to the websocket clients that want them
+
+Clients may subscribe to the incidents of one of their filters or notification
+profiles. Each of those has its own group, and the publisher looks up which of
+them an incident fits with the filter backend. Clients may also subscribe with
+a filter that is not saved, which the consumer checks against the facts sent
+along with each change.
+
+Every change reaches every consumer, and the consumer only passes on the
+changes to incidents that fit the subscription of its client. Other changes
+are passed on with only the primary key of the incident, marked as not
+fitting, so that a client that has the incident can drop it.
+
+Which saved filters and profiles exist is kept in a ``SubscriptionMatcher``.
+It is rebuilt when a filter or profile changes, other processes notice the
+change through the same shared version as the profile matcher of the
+notifications.
+"""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+from argus.filter import get_filter_backend
+from argus.notificationprofile.matching import get_shared_version
+from argus.notificationprofile.models import Filter, NotificationProfile
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from argus.filter.filterwrapper import FilterBlobType, FilterWrapper
+    from argus.incident.models import Incident
+
+
+__all__ = [
+    "IncidentFromFacts",
+    "SubscriptionMatcher",
+    "get_facts",
+    "get_filter_group",
+    "get_filtered_incidents",
+    "get_profile_group",
+    "get_subscription_matcher",
+    "invalidate_subscription_matcher",
+]
+
+
+filter_backend = get_filter_backend()
+
+_matcher = None
+
+
+def get_filter_group(pk) -> str:
+    return f"subscribed_incidents.filter.{pk}"
+
+
+def get_profile_group(pk) -> str:
+    return f"subscribed_incidents.notificationprofile.{pk}"
+
+
+def get_filtered_incidents(queryset, filterblobs: Iterable[FilterBlobType]):
+    "The incidents in ``queryset`` that fit all of ``filterblobs``"
+    for filterblob in filterblobs:
+        queryset = filter_backend.QuerySetFilter.filtered_incidents(filterblob, queryset)
+    return queryset
+
+
+def get_facts(incident: Incident) -> dict:
+    "What a filter checks, in a form that can be passed through the channel layer"
+    return {
+        "level": incident.level,
+        "source": incident.source_id,
+        "tags": [tag.representation for tag in incident.deprecated_tags],
+        "open": incident.open,
+        "acked": incident.acked,
+        "stateful": incident.stateful,
+    }
+
+
+class IncidentFromFacts:
+    "Just enough of an incident to be checked by a filter wrapper, made from ``get_facts``"
+
+    def __init__(self, facts: dict):
+        self.level = facts["level"]
+        self.source = SimpleNamespace(id=facts["source"])
+        self.deprecated_tags = [SimpleNamespace(representation=tag) for tag in facts["tags"]]
+        self.open = facts["open"]
+        self.acked = facts["acked"]
+        self.stateful = facts["stateful"]
+
+
+class SubscriptionMatcher:
+    """Find the groups of the filters and notification profiles an incident fits
+
+    A notification profile fits when all of its filters do, like when
+    notifying, but the timeslot is not checked: it decides when to notify,
+    not which incidents belong to the profile.
+    """
+
+    def __init__(self, filterwrappers: dict[int, FilterWrapper], profiles: dict[int, frozenset], token=None):
+        self.filterwrappers = filterwrappers
+        # A profile without filters does not select anything
+        self.profiles = {pk: filter_pks for pk, filter_pks in profiles.items() if filter_pks}
+        self.token = token
+        filter_index_class = getattr(filter_backend, "FilterIndex", None)
+        self.filter_index = filter_index_class() if filter_index_class else None
+        if self.filter_index is not None:
+            for pk, filterwrapper in filterwrappers.items():
+                self.filter_index.add(pk, filterwrapper)
+
+    @classmethod
+    def build(cls, token=None):
+        filterwrappers = {
+            pk: filter_backend.FilterWrapper(filterblob)
+            for pk, filterblob in Filter.objects.values_list("pk", "filter")
+        }
+        profiles = {}
+        for profile_pk, filter_pk in NotificationProfile.filters.through.objects.values_list(
+            "notificationprofile_id", "filter_id"
+        ):
+            profiles[profile_pk] = profiles.get(profile_pk, frozenset()) | {filter_pk}
+        return cls(filterwrappers, profiles, token=token)
+
+    def fitting_filters(self, incident: Incident) -> set[int]:
+        if self.filter_index is not None:
+            return self.filter_index.matching(incident)
+        return {pk for pk, filterwrapper in self.filterwrappers.items() if filterwrapper.incident_fits(incident)}
+
+    def groups(self, incident: Incident) -> list[str]:
+        "The groups to send ``incident`` to"
+        fitting_filters = self.fitting_filters(incident)
+        groups = [get_filter_group(pk) for pk in sorted(fitting_filters)]
+        groups.extend(
+            get_profile_group(pk) for pk, filter_pks in self.profiles.items() if filter_pks <= fitting_filters
+        )
+        return groups
+
+
+def get_subscription_matcher() -> SubscriptionMatcher:
+    "Return an up to date matcher, rebuilding it if any filter or profile has changed"
+    global _matcher
+    token = get_shared_version()
+    if _matcher is None or _matcher.token != token:
+        _matcher = SubscriptionMatcher.build(token)
+    return _matcher
+
+
+def invalidate_subscription_matcher(*args, **kwargs):
+    "Mark the matcher as stale, can be used directly as a signal receiver"
+    global _matcher
+    _matcher = None
@@ -54,6 +54,7 @@ class BulkIncidentsTests(TestCase):
             stderr=None,
         )
 
+        self.incident.refresh_from_db()
         self.assertTrue(self.incident.acked)
 
     def test_bulk_incidents_will_bulk_ack_filtered_incidents_with_set_expiration(self):
@@ -68,6 +69,7 @@ class BulkIncidentsTests(TestCase):
             stderr=None,
         )
 
+        self.incident.refresh_from_db()
         self.assertTrue(self.incident.acked)
         self.assertEqual(str(self.incident.acks.first().expiration), expiration)
 
@@ -0,0 +1,22 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from argus.incident.models import Incident
+from argus.util.testing import connect_signals, disconnect_signals
+
+
+class ExplainIncidentQueriesTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_explain_incident_queries_prints_plans_and_keeps_nothing(self):
+        out = StringIO()
+        call_command("explain_incident_queries", incidents=50, sources=3, tags=10, stdout=out)
+        self.assertIn("Newest open incidents", out.getvalue())
+        self.assertIn("Start event of an incident", out.getvalue())
+        self.assertFalse(Incident.objects.exists())
@@ -6,6 +6,8 @@ from django.test import tag
 
 from argus.filter.filterwrapper import FilterKey
 from argus.filter.filterwrapper import FallbackFilterWrapper
+from argus.filter.filterwrapper import FilterWrapper
+from argus.filter.filterwrapper import get_filterwrapper
 from argus.incident.models import Event
 
 
@@ -223,3 +225,38 @@ class FallbackFilterWrapperEventFitsEventTypeTests(unittest.TestCase):
         event.type = event_type
         filter = FallbackFilterWrapper({FilterKey.EVENT_TYPES: [Event.Type.ACKNOWLEDGE]})
         self.assertFalse(filter.event_fits(event))
+
+
+@tag("unittest")
+class GetFilterwrapperTests(unittest.TestCase):
+    def make_filter(self, pk, filterblob):
+        filter_ = Mock()
+        filter_.pk = pk
+        filter_.filter = filterblob
+        return filter_
+
+    def test_unchanged_filter_gets_the_same_wrapper(self):
+        fw1 = get_filterwrapper(self.make_filter(1, {"maxlevel": 3, "tags": ["a=b"]}))
+        fw2 = get_filterwrapper(self.make_filter(1, {"tags": ["a=b"], "maxlevel": 3}))
+        self.assertIs(fw1, fw2)
+        self.assertIsInstance(fw1, FilterWrapper)
+
+    def test_changed_filter_gets_a_new_wrapper(self):
+        fw1 = get_filterwrapper(self.make_filter(2, {"maxlevel": 3}))
+        fw2 = get_filterwrapper(self.make_filter(2, {"maxlevel": 4}))
+        self.assertIsNot(fw1, fw2)
+        self.assertEqual(fw2._get_filter_value("maxlevel"), 4)
+
+    def test_changed_fallback_filter_gets_a_new_wrapper(self):
+        filter_ = self.make_filter(3, {})
+        with override_settings(ARGUS_FALLBACK_FILTER={"maxlevel": 2}):
+            fw1 = get_filterwrapper(filter_, FallbackFilterWrapper)
+        with override_settings(ARGUS_FALLBACK_FILTER={"maxlevel": 4}):
+            fw2 = get_filterwrapper(filter_, FallbackFilterWrapper)
+        self.assertIsNot(fw1, fw2)
+        self.assertEqual(fw2._get_filter_value_and_ignored_status(FilterKey.MAXLEVEL), (4, False))
+
+    def test_list_values_are_sets(self):
+        fw = FilterWrapper({FilterKey.SOURCE_SYSTEM_IDS: [1, 2], FilterKey.TAGS: ["a=b", "a=b"]})
+        self.assertEqual(fw._get_filter_value_and_ignored_status(FilterKey.SOURCE_SYSTEM_IDS), ({1, 2}, False))
+        self.assertEqual(fw._get_filter_value_and_ignored_status(FilterKey.TAGS), ({"a=b"}, False))
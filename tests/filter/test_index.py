@@ -0,0 +1,71 @@
+import unittest
+from unittest.mock import Mock
+
+from django.test import tag
+
+from argus.filter.filterwrapper import FilterKey, FilterWrapper
+from argus.filter.index import FilterIndex
+
+
+def make_incident(source_id=1, tags=(), level=3, open=True, acked=False, stateful=True):
+    return Mock(
+        source=Mock(id=source_id),
+        deprecated_tags=[Mock(representation=tag) for tag in tags],
+        level=level,
+        open=open,
+        acked=acked,
+        stateful=stateful,
+    )
+
+
+@tag("unittest")
+class FilterIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.filterblobs = {
+            "source": {FilterKey.SOURCE_SYSTEM_IDS: [1, 2]},
+            "other_source": {FilterKey.SOURCE_SYSTEM_IDS: [3]},
+            "source_and_maxlevel": {FilterKey.SOURCE_SYSTEM_IDS: [1], FilterKey.MAXLEVEL: 2},
+            "tags": {FilterKey.TAGS: ["a=b", "c=d"]},
+            "tag": {FilterKey.TAGS: ["c=d"]},
+            "acked": {FilterKey.ACKED: True},
+            "open_maxlevel": {FilterKey.OPEN: True, FilterKey.MAXLEVEL: 4},
+            "event_types_only": {FilterKey.EVENT_TYPES: ["STA"]},
+            "empty": {},
+        }
+        self.index = FilterIndex()
+        for key, blob in self.filterblobs.items():
+            self.index.add(key, FilterWrapper(blob))
+
+    def assertMatchesLinearScan(self, incident):
+        expected = {key for key, blob in self.filterblobs.items() if FilterWrapper(blob).incident_fits(incident)}
+        self.assertEqual(self.index.matching(incident), expected)
+        self.assertTrue(self.index.candidates(incident).issuperset(expected))
+        return expected
+
+    def test_empty_filters_are_not_indexed(self):
+        self.assertEqual(len(self.index), len(self.filterblobs) - 1)
+
+    def test_matching_by_source_system(self):
+        found = self.assertMatchesLinearScan(make_incident(source_id=2))
+        self.assertIn("source", found)
+        self.assertNotIn("other_source", found)
+
+    def test_matching_requires_all_tags(self):
+        found = self.assertMatchesLinearScan(make_incident(source_id=9, tags=["c=d"]))
+        self.assertIn("tag", found)
+        self.assertNotIn("tags", found)
+        found = self.assertMatchesLinearScan(make_incident(source_id=9, tags=["a=b", "c=d", "e=f"]))
+        self.assertIn("tags", found)
+
+    def test_matching_by_tristates_and_maxlevel(self):
+        found = self.assertMatchesLinearScan(make_incident(source_id=9, level=5, open=True, acked=True))
+        self.assertIn("acked", found)
+        self.assertNotIn("open_maxlevel", found)
+        found = self.assertMatchesLinearScan(make_incident(source_id=9, level=4, open=True, acked=False))
+        self.assertNotIn("acked", found)
+        self.assertIn("open_maxlevel", found)
+
+    def test_filter_with_only_event_types_fits_all_incidents(self):
+        found = self.assertMatchesLinearScan(make_incident(source_id=1, level=1))
+        self.assertIn("event_types_only", found)
+        self.assertIn("source_and_maxlevel", found)
@@ -0,0 +1,28 @@
+from django import test
+from django.test.client import RequestFactory
+
+from argus.incident.factories import SourceSystemFactory, SourceUserFactory, StatefulIncidentFactory
+from argus.incident.models import Incident
+from argus.util.testing import connect_signals, disconnect_signals
+
+
+class TestIncidentListFilter(test.TestCase):
+    def setUp(self):
+        # See TestGetFilterFunction for why this is not imported at the top
+        from argus.htmx.incidents.filter import incident_list_filter
+
+        self.incident_list_filter = incident_list_filter
+        disconnect_signals()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.incident1 = StatefulIncidentFactory(source=source, description="Link down", search_text=" link")
+        self.incident2 = StatefulIncidentFactory(source=source, description="Power failure", search_text=" link")
+        StatefulIncidentFactory(source=source, description="Disk full", search_text="")
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_search_finds_matching_incidents_best_match_first(self):
+        request = RequestFactory().get("/incidents/", {"search": "link", "maxlevel": 5})
+        form, qs = self.incident_list_filter(request, Incident.objects.all())
+        self.assertTrue(form.is_valid())
+        self.assertEqual(list(qs), [self.incident1, self.incident2])
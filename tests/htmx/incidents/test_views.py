@@ -0,0 +1,133 @@
+from datetime import timedelta
+import re
+
+from django import test
+from django.test.client import RequestFactory
+from django.utils import timezone
+from django_htmx.middleware import HtmxDetails
+from rest_framework.test import APIClient
+
+from argus.auth.factories import PersonUserFactory
+from argus.htmx.incidents.views import incident_list
+from argus.incident.factories import (
+    IncidentTagRelationFactory,
+    SourceSystemFactory,
+    SourceUserFactory,
+    StatefulIncidentFactory,
+    TagFactory,
+)
+from argus.incident.models import Incident
+from argus.util.testing import connect_signals, disconnect_signals
+
+
+@test.override_settings(ROOT_URLCONF="argus.htmx.root_urls")
+class TestIncidentListRefresh(test.TestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.user = PersonUserFactory()
+        self.source = SourceSystemFactory(user=SourceUserFactory())
+        now = timezone.now()
+        self.incident1 = StatefulIncidentFactory(source=self.source, start_time=now - timedelta(hours=2))
+        self.incident2 = StatefulIncidentFactory(source=self.source, start_time=now - timedelta(hours=1))
+        self.change(self.incident1, self.incident2)
+
+    def tearDown(self):
+        connect_signals()
+
+    def change(self, *incidents):
+        for incident in incidents:
+            Incident.objects.filter(pk=incident.pk).bump_change_seq()
+
+    def get(self, trigger="table", headers=None, **params):
+        headers = {"HX-Request": "true", "HX-Trigger": trigger, **(headers or {})}
+        # The filter box always sends the level
+        request = RequestFactory().get("/incidents/", {"maxlevel": 5, **params}, headers=headers)
+        request.user = self.user
+        request.htmx = HtmxDetails(request)
+        return incident_list(request)
+
+    def get_page_state(self, response):
+        return re.search(r'name="page_state" value="([^"]+)"', response.content.decode()).group(1)
+
+    def assertHasRow(self, response, incident, count=1):
+        self.assertContains(response, f'id="incident-{incident.pk}-row"', count=count)
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        response = self.get(headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_list_is_sent_again(self):
+        response = self.get()
+        self.change(self.incident1)
+        response = self.get(headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_only_sends_the_changed_rows(self):
+        page_state = self.get_page_state(self.get())
+        self.change(self.incident1)
+
+        response = self.get(page_state=page_state)
+        self.assertEqual(response["HX-Reswap"], "none")
+        self.assertHasRow(response, self.incident1)
+        self.assertHasRow(response, self.incident2, count=0)
+        self.assertContains(response, 'hx-swap-oob="true"', count=2)
+
+        new_page_state = self.get_page_state(response)
+        self.assertNotEqual(new_page_state, page_state)
+        response = self.get(page_state=new_page_state)
+        self.assertEqual(response["HX-Reswap"], "none")
+        self.assertHasRow(response, self.incident1, count=0)
+
+    def test_refresh_renders_the_whole_table_when_the_page_holds_other_incidents(self):
+        page_state = self.get_page_state(self.get())
+        incident3 = StatefulIncidentFactory(source=self.source, start_time=timezone.now())
+        self.change(incident3)
+
+        response = self.get(page_state=page_state)
+        self.assertFalse(response.has_header("HX-Reswap"))
+        for incident in (self.incident1, self.incident2, incident3):
+            self.assertHasRow(response, incident)
+
+    def test_only_the_refresh_of_the_table_sends_the_changed_rows(self):
+        page_state = self.get_page_state(self.get())
+        self.change(self.incident1)
+
+        response = self.get(trigger="table-refresh-info", page_state=page_state)
+        self.assertFalse(response.has_header("HX-Reswap"))
+        self.assertHasRow(response, self.incident2)
+
+    def test_ack_through_the_api_changes_the_list(self):
+        etag = self.get()["ETag"]
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        now = timezone.now()
+        data = {"timestamp": now.isoformat(), "description": "ack", "expiration": (now + timedelta(days=1)).isoformat()}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(f"/api/v2/incidents/{self.incident1.pk}/acks/", data=data, format="json")
+        self.assertEqual(response.status_code, 201)
+
+        response = self.get(headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_tag_change_changes_the_list(self):
+        etag = self.get()["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            IncidentTagRelationFactory(incident=self.incident2, tag=TagFactory(key="a", value="b"))
+
+        response = self.get(headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_sends_the_rows_of_acks_that_ran_out(self):
+        self.incident1.create_ack(self.user, expiration=timezone.now() + timedelta(hours=1))
+        response = self.get()
+        page_state, etag = self.get_page_state(response), response["ETag"]
+        # As if the hour had passed, without anything announcing it
+        Incident.objects.filter(pk=self.incident1.pk).update(acked_until=timezone.now())
+
+        response = self.get(page_state=page_state, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["HX-Reswap"], "none")
+        self.assertHasRow(response, self.incident1)
+        self.assertHasRow(response, self.incident2, count=0)
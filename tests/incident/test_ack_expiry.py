@@ -0,0 +1,48 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase
+from django.utils import timezone
+
+from argus.auth.factories import PersonUserFactory
+from argus.incident.ack_expiry import next_ack_expiration, sweep_expired_acks
+from argus.incident.factories import SourceSystemFactory, SourceUserFactory, StatefulIncidentFactory
+from argus.incident.models import Incident
+from argus.util.testing import connect_signals, disconnect_signals
+
+
+class AckExpiryTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.now = timezone.now()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.user = PersonUserFactory()
+        self.incident1 = StatefulIncidentFactory(source=source)
+        self.incident2 = StatefulIncidentFactory(source=source)
+        self.incident1.create_ack(self.user, expiration=self.now + timedelta(minutes=2))
+        self.incident2.create_ack(self.user, expiration=self.now + timedelta(minutes=1))
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_next_ack_expiration_finds_the_first_expiration_after_a_timestamp(self):
+        self.assertEqual(next_ack_expiration(self.now), self.now + timedelta(minutes=1))
+        self.assertEqual(next_ack_expiration(self.now + timedelta(minutes=1)), self.now + timedelta(minutes=2))
+        self.assertIsNone(next_ack_expiration(self.now + timedelta(minutes=2)))
+
+    @patch("argus.incident.ack_expiry.bulk_changed.send")
+    def test_sweep_expired_acks_announces_incidents_in_order_of_expiry(self, send):
+        expired = sweep_expired_acks(self.now, self.now + timedelta(minutes=5))
+        self.assertEqual(expired, [self.incident2, self.incident1])
+        send.assert_called_once_with(sender=Incident, instances=expired)
+
+    @patch("argus.incident.ack_expiry.bulk_changed.send")
+    def test_sweep_expired_acks_skips_incidents_that_are_still_acked(self, send):
+        self.incident2.create_ack(self.user)
+        expired = sweep_expired_acks(self.now, self.now + timedelta(minutes=5))
+        self.assertEqual(expired, [self.incident1])
+
+    @patch("argus.incident.ack_expiry.bulk_changed.send")
+    def test_sweep_expired_acks_does_nothing_before_anything_expires(self, send):
+        self.assertEqual(sweep_expired_acks(self.now, self.now + timedelta(seconds=30)), [])
+        send.assert_not_called()
@@ -0,0 +1,96 @@
+import json
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from argus.incident.event_stream import IncidentEventStream
+from argus.incident.factories import SourceSystemFactory, SourceUserFactory, StatefulIncidentFactory
+from argus.incident.models import Incident
+from argus.util.testing import connect_signals, disconnect_signals
+
+
+def get_events(chunks):
+    "The id and incident pk of each event in ``chunks``"
+    events = []
+    for chunk in chunks:
+        fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines() if not line.startswith(":"))
+        if "id" in fields:
+            pk = json.loads(fields["data"])["pk"] if "data" in fields else None
+            events.append((int(fields["id"]), pk))
+    return events
+
+
+class IncidentEventStreamTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.incident1 = StatefulIncidentFactory(source=source, level=1)
+        self.incident2 = StatefulIncidentFactory(source=source, level=5)
+        self.seq = Incident.objects.last_change_seq()
+
+    def tearDown(self):
+        connect_signals()
+
+    def bump(self, *incidents):
+        "Change ``incidents`` in order and return their change numbers"
+        for incident in incidents:
+            Incident.objects.filter(pk=incident.pk).bump_change_seq()
+            incident.refresh_from_db()
+        return [incident.change_seq for incident in incidents]
+
+    def test_poll_sends_the_changed_incidents_in_order_of_change(self):
+        stream = IncidentEventStream(self.seq, lambda qs: qs)
+        self.assertEqual(stream.poll(), [])
+        seq2, seq1 = self.bump(self.incident2, self.incident1)
+        self.assertEqual(get_events(stream.poll()), [(seq2, self.incident2.pk), (seq1, self.incident1.pk)])
+        self.assertEqual(stream.poll(), [])
+
+    def test_changes_that_are_filtered_out_only_move_the_id_along(self):
+        stream = IncidentEventStream(self.seq, lambda qs: qs.filter(level__lte=2))
+        seq1, seq2 = self.bump(self.incident1, self.incident2)
+        self.assertEqual(get_events(stream.poll()), [(seq1, self.incident1.pk), (seq2, None)])
+        self.assertEqual(stream.seq, seq2)
+
+    def test_stream_ends_after_max_age(self):
+        self.bump(self.incident1)
+        stream = IncidentEventStream(self.seq, lambda qs: qs, max_age=0)
+        self.assertEqual(list(stream), ["retry: 1000\n\n"])
+
+
+@override_settings(INCIDENT_STREAM_POLL_INTERVAL=0)
+class IncidentStreamViewTests(APITestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.user = SourceUserFactory()
+        source = SourceSystemFactory(user=self.user)
+        self.incident1 = StatefulIncidentFactory(source=source, level=1)
+        self.incident2 = StatefulIncidentFactory(source=source, level=5)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("v2:incident:incident-stream")
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_stream_sends_changes_since_last_event_id_that_fit_the_filter(self):
+        seq = Incident.objects.last_change_seq()
+        for incident in (self.incident1, self.incident2):
+            Incident.objects.filter(pk=incident.pk).bump_change_seq()
+            incident.refresh_from_db()
+        response = self.client.get(
+            self.url, {"level__lte": 2}, HTTP_ACCEPT="text/event-stream", HTTP_LAST_EVENT_ID=str(seq)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = response.streaming_content
+        chunks = [next(content).decode() for _ in range(3)]
+        response.close()
+        self.assertEqual(chunks[0], "retry: 1000\n\n")
+        self.assertEqual(
+            get_events(chunks), [(self.incident1.change_seq, self.incident1.pk), (self.incident2.change_seq, None)]
+        )
+
+    def test_invalid_since_is_an_error(self):
+        response = self.client.get(self.url, {"since": "yesterday"}, HTTP_ACCEPT="text/event-stream")
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(response.content.startswith(b"event: error\n"))
@@ -55,16 +55,17 @@ class IncidentAckedTests(TestCase):
         ack = AcknowledgementFactory(expiration=timezone.now() + timedelta(days=3))
         self.assertTrue(ack.event.incident.acked)
 
-    def test_acked_is_true_for_incident_with_ack_event_but_no_acknowledgement(self):
-        """
-        This is specifically for when acknowledgements are created.
-
-        Since we first create the event and then the acknowledgement the
-        notification sending is triggered already on the event creation,
-        which is why this test is necessary
-        """
-        event = EventFactory(type=Event.Type.ACKNOWLEDGE)
-        self.assertTrue(event.incident.acked)
+    def test_acked_is_false_for_incident_whose_acknowledgement_was_changed_to_expire(self):
+        ack = AcknowledgementFactory()
+        ack.expiration = timezone.now() - timedelta(minutes=1)
+        ack.save()
+        self.assertFalse(ack.event.incident.acked)
+
+    def test_acked_is_false_for_incident_whose_acknowledgement_was_deleted(self):
+        ack = AcknowledgementFactory()
+        incident = ack.event.incident
+        ack.delete()
+        self.assertFalse(incident.acked)
 
     def test_acked_is_false_for_incident_with_acknowledgement_with_past_expiration(self):
         timestamp = timezone.now() - timedelta(days=1)
@@ -1,15 +1,23 @@
+from datetime import timedelta
+import threading
+from unittest.mock import Mock
+
+from django.db import connection
 from django.test import TestCase, tag
 from django.utils import timezone
 
 from argus.auth.factories import PersonUserFactory
 from argus.util.testing import disconnect_signals, connect_signals
 from argus.incident.factories import (
+    IncidentTagRelationFactory,
     SourceSystemFactory,
     SourceUserFactory,
     StatefulIncidentFactory,
     StatelessIncidentFactory,
+    TagFactory,
 )
-from argus.incident.models import Incident, Event
+from argus.incident.models import CHANGE_SEQUENCE, Incident, Event
+from argus.util.signals import bulk_changed
 
 
 class IncidentQuerySetTestCase(TestCase):
@@ -124,3 +132,192 @@ class IncidentQuerySetUpdatingTestCase(TestCase):
         qs.reopen(self.user, description="Bar")
         result = set(e.incident for e in Event.objects.filter(type=Event.Type.REOPEN, description="Bar"))
         self.assertEqual(result, set(qs.all()))
+
+    @tag("bulk")
+    def test_create_incidents(self):
+        incidents_data = [
+            {
+                "start_time": self.timestamp,
+                "end_time": "infinity",
+                "description": "foo",
+                "tags": [{"key": "host", "value": "a"}, {"key": "host", "value": "b"}],
+            },
+            {
+                "start_time": self.timestamp,
+                "end_time": None,
+                "description": "bar",
+                "tags": [{"key": "host", "value": "a"}],
+            },
+        ]
+        incidents, events = Incident.objects.create_incidents(self.user, self.source, incidents_data)
+        stateful, stateless = incidents
+        self.assertTrue(stateful.open)
+        self.assertEqual(stateful.start_event, events[0])
+        self.assertEqual(stateless.stateless_event, events[1])
+        self.assertEqual({str(tag) for tag in stateful.deprecated_tags}, {"host=a", "host=b"})
+        self.assertEqual({str(tag) for tag in stateless.deprecated_tags}, {"host=a"})
+        self.assertFalse(any(event.search_indexed for event in events))
+
+    def test_upsert_creates_missing_incident(self):
+        data = {"start_time": self.timestamp, "source_incident_id": "new", "level": 2}
+        incident, created, changed = Incident.objects.upsert(self.source, data)
+        self.assertTrue(created)
+        self.assertEqual(changed, {})
+        self.assertEqual(incident.level, 2)
+
+    def test_upsert_updates_existing_incident_and_returns_old_values(self):
+        self.incident2.source_incident_id = "existing"
+        self.incident2.level = 1
+        self.incident2.metadata = {"a": 1}
+        self.incident2.save()
+        data = {"start_time": self.timestamp, "source_incident_id": "existing", "level": 5, "metadata": {"a": 2}}
+        incident, created, changed = Incident.objects.upsert(self.source, data)
+        self.assertFalse(created)
+        self.assertEqual(incident, self.incident2)
+        self.assertEqual(incident.metadata, {"a": 2})
+        self.assertEqual(changed, {"level": 1, "metadata": {"a": 1}})
+
+        incident, created, changed = Incident.objects.upsert(self.source, data)
+        self.assertFalse(created)
+        self.assertEqual(changed, {})
+
+    def test_create_acks_updates_acked_until(self):
+        expiration = self.timestamp + timedelta(days=1)
+        Incident.objects.filter(id=self.incident3.id).create_acks(self.user, expiration=expiration)
+        self.incident3.refresh_from_db()
+        self.assertEqual(self.incident3.acked_until, expiration)
+
+    def test_acks_announce_the_changed_incidents(self):
+        receiver = Mock()
+        bulk_changed.connect(receiver, sender=Incident)
+        self.addCleanup(bulk_changed.disconnect, receiver, sender=Incident)
+
+        self.incident3.create_ack(self.user)
+        self.assertEqual([i.pk for i in receiver.call_args.kwargs["instances"]], [self.incident3.pk])
+
+        receiver.reset_mock()
+        Incident.objects.filter(pk__in=[self.incident2.pk, self.incident3.pk]).create_acks(self.user)
+        self.assertEqual([i.pk for i in receiver.call_args.kwargs["instances"]], [self.incident2.pk])
+
+    def test_full_save_of_a_stale_instance_keeps_acked_until(self):
+        stale = Incident.objects.get(pk=self.incident3.pk)
+        self.incident3.create_ack(self.user)
+        stale.description = "changed"
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.description, "changed")
+        self.assertTrue(stale.acked)
+
+    def test_acked_until_out_of_date_finds_incidents_that_need_repair(self):
+        self.incident3.create_ack(self.user)
+        self.assertFalse(Incident.objects.acked_until_out_of_date().exists())
+        Incident.objects.update(acked_until=None)
+        self.assertEqual(set(Incident.objects.acked_until_out_of_date()), {self.incident3})
+
+
+class IncidentSearchTestCase(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.incident1 = StatefulIncidentFactory(
+            source=source, description="Link down on switch1.example.com", search_text=""
+        )
+        self.incident2 = StatefulIncidentFactory(
+            source=source, description="Power failure", search_text=" Link to switch2 lost"
+        )
+        self.incident3 = StatefulIncidentFactory(source=source, description="Disk full", search_text="")
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_search_finds_words_in_description_and_event_descriptions(self):
+        self.assertEqual(set(Incident.objects.search("link")), {self.incident1, self.incident2})
+
+    def test_search_finds_words_by_prefix(self):
+        self.assertEqual(set(Incident.objects.search("swit")), {self.incident1, self.incident2})
+
+    def test_search_requires_all_words(self):
+        self.assertEqual(set(Incident.objects.search("link, switch2")), {self.incident2})
+
+    def test_search_finds_host_names(self):
+        self.assertEqual(set(Incident.objects.search("switch1.example.com")), {self.incident1})
+
+    def test_search_ranks_matches_in_description_highest(self):
+        result = Incident.objects.search("link").order_by("-search_rank")
+        self.assertEqual(list(result), [self.incident1, self.incident2])
+
+    def test_search_handles_quotes_and_operators(self):
+        self.assertFalse(Incident.objects.search("'link' & !disk \\").exists())
+
+    def test_search_without_words_finds_nothing(self):
+        self.assertFalse(Incident.objects.search(" !, ").exists())
+
+
+class IncidentFromTagsTestCase(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.incident1 = StatefulIncidentFactory(source=source)
+        self.incident2 = StatefulIncidentFactory(source=source)
+        self.incident3 = StatefulIncidentFactory(source=source)
+        self.tag_host_a = TagFactory(key="host", value="a")
+        self.tag_host_b = TagFactory(key="host", value="b")
+        self.tag_problem = TagFactory(key="problem", value="onfire")
+        for incident, tag_ in (
+            (self.incident1, self.tag_host_a),
+            (self.incident1, self.tag_problem),
+            (self.incident2, self.tag_host_b),
+            (self.incident2, self.tag_problem),
+            (self.incident3, self.tag_host_a),
+            (self.incident3, self.tag_host_b),
+        ):
+            IncidentTagRelationFactory(incident=incident, tag=tag_)
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_from_tags_finds_incidents_with_the_tag(self):
+        self.assertEqual(set(Incident.objects.from_tags("host=a")), {self.incident1, self.incident3})
+
+    def test_from_tags_needs_one_of_the_tags_with_the_same_key(self):
+        result = Incident.objects.from_tags("host=a", "host=b")
+        self.assertEqual(list(result.order_by("pk")), [self.incident1, self.incident2, self.incident3])
+
+    def test_from_tags_needs_a_tag_of_every_key(self):
+        result = Incident.objects.from_tags("host=a", "host=b", "problem=onfire")
+        self.assertEqual(set(result), {self.incident1, self.incident2})
+
+    def test_from_tags_finds_nothing_if_a_key_has_no_known_tags(self):
+        self.assertFalse(Incident.objects.from_tags("host=a", "problem=flooding").exists())
+
+    def test_from_tags_is_a_single_lazy_query(self):
+        with self.assertNumQueries(0):
+            result = Incident.objects.from_tags("host=a", "host=b", "problem=onfire")
+        with self.assertNumQueries(1):
+            list(result)
+
+
+class IncidentChangeSeqTestCase(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.incident = StatefulIncidentFactory(source=source)
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_bump_change_seq_keeps_others_from_numbering_until_committed(self):
+        Incident.objects.filter(pk=self.incident.pk).bump_change_seq()
+        locked = []
+
+        def try_lock():
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_xact_lock(hashtext(%s))", [CHANGE_SEQUENCE])
+                locked.append(cursor.fetchone()[0])
+            connection.close()
+
+        # Another thread has a connection of its own, outside the transaction of the test
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        self.assertEqual(locked, [False])
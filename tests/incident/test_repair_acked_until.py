@@ -0,0 +1,32 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from argus.incident.factories import AcknowledgementFactory
+from argus.incident.models import Incident
+from argus.util.testing import connect_signals, disconnect_signals
+
+
+class RepairAckedUntilTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.incident = AcknowledgementFactory().event.incident
+        Incident.objects.update(acked_until=None)
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_repair_acked_until_fixes_incidents_that_are_out_of_date(self):
+        out = StringIO()
+        call_command("repair_acked_until", stdout=out)
+
+        self.assertIn("1 incidents were out of date", out.getvalue())
+        self.assertTrue(Incident.objects.acked().filter(pk=self.incident.pk).exists())
+
+    def test_repair_acked_until_dry_run_changes_nothing(self):
+        out = StringIO()
+        call_command("repair_acked_until", dry_run=True, stdout=out)
+
+        self.assertIn("1 incidents are out of date", out.getvalue())
+        self.assertFalse(Incident.objects.acked().exists())
@@ -0,0 +1,70 @@
+from django.core.management import call_command
+from django.test import TestCase
+
+from argus.incident.factories import EventFactory, SourceSystemFactory, SourceUserFactory, StatefulIncidentFactory
+from argus.incident.models import Event, Incident
+from argus.incident.search_index import index_events
+from argus.util.testing import connect_signals, disconnect_signals
+
+
+class IndexEventsTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.incident = StatefulIncidentFactory(source=source, description="incident", search_text="")
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_saving_an_event_does_not_change_the_search_text(self):
+        event = EventFactory(incident=self.incident, description="link down")
+        self.incident.refresh_from_db()
+        self.assertEqual(self.incident.search_text, "")
+        self.assertFalse(event.search_indexed)
+
+    def test_index_events_adds_new_descriptions_once(self):
+        EventFactory(incident=self.incident, description="link down")
+        EventFactory(incident=self.incident, description="link down")
+        EventFactory(incident=self.incident, description="")
+        EventFactory(incident=self.incident, description="link up")
+
+        self.assertEqual(index_events(), 4)
+        self.incident.refresh_from_db()
+        self.assertEqual(self.incident.search_text, " link down link up")
+        self.assertFalse(Event.objects.filter(search_indexed=False).exists())
+        self.assertEqual(index_events(), 0)
+
+    def test_description_indexed_earlier_is_not_added_again(self):
+        EventFactory(incident=self.incident, description="link down")
+        index_events()
+        EventFactory(incident=self.incident, description="link down")
+
+        self.assertEqual(index_events(), 1)
+        self.incident.refresh_from_db()
+        self.assertEqual(self.incident.search_text, " link down")
+
+    def test_full_save_of_a_stale_incident_keeps_the_search_text(self):
+        stale = Incident.objects.get(pk=self.incident.pk)
+        EventFactory(incident=self.incident, description="link down")
+        index_events()
+        stale.save()
+        stale.refresh_from_db()
+        self.assertEqual(stale.search_text, " link down")
+
+    def test_index_events_works_in_batches(self):
+        EventFactory(incident=self.incident, description="link down")
+        EventFactory(incident=self.incident, description="link up")
+
+        self.assertEqual(index_events(batch_size=1), 1)
+        self.incident.refresh_from_db()
+        self.assertEqual(self.incident.search_text, " link down")
+        self.assertEqual(index_events(batch_size=1), 1)
+        self.incident.refresh_from_db()
+        self.assertEqual(self.incident.search_text, " link down link up")
+
+    def test_command_with_once_indexes_everything(self):
+        for i in range(3):
+            EventFactory(incident=self.incident, description=f"event{i}")
+        call_command("index_incident_search", once=True, batch_size=2)
+        self.incident.refresh_from_db()
+        self.assertEqual(self.incident.search_text, " event0 event1 event2")
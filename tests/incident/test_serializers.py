@@ -13,6 +13,7 @@ from argus.incident.factories import (
     SourceUserFactory,
     StatefulIncidentFactory,
 )
+from argus.incident.models import Incident
 from argus.incident.serializers import (
     EventSerializer,
     IncidentPureDeserializer,
@@ -215,6 +216,21 @@ class IncidentSerializerTests(TestCase):
         self.assertFalse(serializer.is_valid())
         self.assertIn("ticket_url", serializer.errors)
 
+    def test_serializing_incidents_does_not_query_per_incident(self):
+        source = SourceSystemFactory(base_url="https://example.com/")
+        user = PersonUserFactory()
+        for _ in range(5):
+            incident = StatefulIncidentFactory(source=source, details_url="incident")
+            IncidentTagRelationFactory(incident=incident)
+            incident.create_ack(user)
+
+        with self.assertNumQueries(2):
+            data = IncidentSerializer(Incident.objects.prefetch_default_related(), many=True).data
+        self.assertEqual(len(data), 5)
+        self.assertTrue(all(incident["acked"] for incident in data))
+        self.assertTrue(all(incident["open"] and incident["stateful"] for incident in data))
+        self.assertEqual({incident["details_url"] for incident in data}, {"https://example.com/incident"})
+
     def test_incident_serializer_is_invalid_with_incorrect_tags(self):
         data = {
             "start_time": "2021-08-04T09:13:55.908Z",
@@ -1,5 +1,9 @@
 import datetime
+import json
+from unittest.mock import ANY, patch
 
+from django.db import IntegrityError, connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils.timezone import now
 from django.test import TestCase, RequestFactory, override_settings, tag
@@ -33,7 +37,8 @@ from argus.incident.models import (
     SourceSystemType,
     Tag,
 )
-from argus.incident.views import EventViewSet
+from argus.incident.search_index import index_events
+from argus.incident.views import EventViewSet, IncidentIngestViewSet
 from argus.notificationprofile.models import Filter
 from argus.util.testing import disconnect_signals, connect_signals
 
@@ -135,6 +140,48 @@ class IncidentViewSetV1TestCase(IncidentAPITestCase):
         # Check that incident and tag are linked
         self.assertTrue(IncidentTagRelation.objects.filter(incident=incident).filter(tag=tag).exists())
 
+    def test_can_upsert_new_incident(self):
+        data = {
+            "start_time": "2021-08-04T09:13:55.908Z",
+            "end_time": "infinity",
+            "source_incident_id": "1",
+            "description": "incident",
+            "tags": [{"tag": "a=b"}],
+        }
+
+        response = self.client.post(path="/api/v2/incidents/?upsert=true", data=data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        incident = Incident.objects.get(id=response.data["pk"])
+        self.assertEqual(incident.source, self.source)
+        self.assertTrue(incident.start_event)
+        self.assertEqual(response.data["tags"], [{"tag": "a=b", "added_by": self.user.pk, "added_time": ANY}])
+
+    def test_upserting_incident_again_returns_existing_incident_with_changes(self):
+        incident = StatefulIncidentFactory(source=self.source, source_incident_id="1", level=1, description="old")
+        data = {
+            "start_time": "2021-08-04T09:13:55.908Z",
+            "source_incident_id": "1",
+            "description": "new",
+            "level": 1,
+            "tags": [{"tag": "a=b"}],
+        }
+
+        response = self.client.post(path="/api/v2/incidents/?upsert=true", data=data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["pk"], incident.pk)
+        incident.refresh_from_db()
+        self.assertEqual(incident.description, "new")
+        changes = incident.events.filter(type=Event.Type.INCIDENT_CHANGE).values_list("description", flat=True)
+        self.assertEqual(set(changes), {'Change: "description": old → new', "Change: \"tags\": [] → ['a=b']"})
+
+        response = self.client.post(path="/api/v2/incidents/?upsert=true", data=data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Incident.objects.count(), 1)
+        self.assertEqual(incident.events.filter(type=Event.Type.INCIDENT_CHANGE).count(), 2)
+
     def test_can_update_incident_level(self):
         incident_pk = self.add_open_incident_with_start_event_and_tag().pk
         incident_path = reverse("v1:incident:incident-detail", args=[incident_pk])
@@ -537,7 +584,10 @@ class IncidentViewSetTestCase(APITestCase):
         return incident
 
     def add_event(self, incident_pk, description="event", type=Event.Type.OTHER):
-        return EventFactory(incident_id=incident_pk, description=description, type=type)
+        event = EventFactory(incident_id=incident_pk, description=description, type=type)
+        # Make the event searchable
+        index_events()
+        return event
 
     def add_acknowledgement_with_incident_and_event(self):
         return AcknowledgementFactory()
@@ -553,6 +603,35 @@ class IncidentViewSetTestCase(APITestCase):
         response_pks = [incident["pk"] for incident in response.data["results"]]
         self.assertEqual(response_pks, incident_pks)
 
+    def test_number_of_queries_for_incident_list_does_not_depend_on_number_of_incidents(self):
+        def list_incidents():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path="/api/v2/incidents/")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        incident = self.add_open_incident_with_start_event_and_tag()
+        incident.create_ack(self.admin)
+        baseline = list_incidents()
+        for _ in range(5):
+            incident = self.add_open_incident_with_start_event_and_tag()
+            incident.create_ack(self.admin)
+        self.assertEqual(list_incidents(), baseline)
+        self.assertLessEqual(baseline, 4)
+
+    def test_search_returns_best_matches_first_across_pages(self):
+        incident_pk1 = self.add_open_incident_with_start_event_and_tag(description="other").pk
+        self.add_event(incident_pk=incident_pk1, description="target")
+        incident_pk2 = self.add_open_incident_with_start_event_and_tag(description="target").pk
+        self.add_open_incident_with_start_event_and_tag(description="incident")
+
+        response = self.client.get(path="/api/v2/incidents/?search=target&page_size=1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([incident["pk"] for incident in response.data["results"]], [incident_pk2])
+        response = self.client.get(response.data["next"])
+        self.assertEqual([incident["pk"] for incident in response.data["results"]], [incident_pk1])
+        self.assertIsNone(response.data["next"])
+
     def test_can_get_incident_by_incident_description(self):
         pk = self.add_open_incident_with_start_event_and_tag(description="incident1").pk
         response = self.client.get(path="/api/v2/incidents/?search=incident1")
@@ -987,6 +1066,21 @@ class BulkAcknowledgementViewSetTestCase(APITestCase):
         self.assertTrue(incident_1.events.filter(type="ACK").exists())
         self.assertTrue(incident_2.events.filter(type="ACK").exists())
 
+    def test_bulk_created_acknowledgements_are_not_notified_about_by_default(self):
+        incident = StatefulIncidentFactory(source=self.source)
+        data = {"ids": [incident.pk], "ack": self.ack_data}
+        with patch("argus.incident.views.send_notifications_for_events") as send:
+            self.client.post(path="/api/v2/incidents/acks/bulk/", data=data, format="json")
+        send.assert_not_called()
+
+    @override_settings(SEND_BULK_NOTIFICATIONS=True)
+    def test_bulk_created_acknowledgements_are_notified_about_if_enabled(self):
+        incident = StatefulIncidentFactory(source=self.source)
+        data = {"ids": [incident.pk], "ack": self.ack_data}
+        with patch("argus.incident.views.send_notifications_for_events") as send:
+            self.client.post(path="/api/v2/incidents/acks/bulk/", data=data, format="json")
+        send.assert_called_once_with(incident.events.get(type="ACK"))
+
     def test_can_bulk_create_acknowledgements_without_description_and_expiration_for_incidents_with_valid_ids(self):
         incident_1 = StatefulIncidentFactory(source=self.source)
         incident_2 = StatefulIncidentFactory(source=self.source)
@@ -1415,3 +1509,202 @@ class BulkTicketUrlViewSetTestCase(APITestCase):
 
         incident_1.refresh_from_db()
         self.assertEqual(incident_1.ticket_url, data["ticket_url"])
+
+
+class BulkIncidentViewSetTestCase(APITestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.source_user = SourceUserFactory()
+        self.source = SourceSystemFactory(user=self.source_user)
+        self.client.force_authenticate(user=self.source_user)
+        self.incident_data = {
+            "start_time": "2022-08-02T13:04:03.529Z",
+            "end_time": "infinity",
+            "description": "incident",
+            "tags": [{"tag": "host=example.com"}],
+        }
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_can_bulk_create_incidents(self):
+        data = {
+            "incidents": [
+                self.incident_data,
+                {**self.incident_data, "end_time": None, "tags": [{"tag": "host=example.com"}, {"tag": "a=b"}]},
+            ]
+        }
+
+        response = self.client.post(path="/api/v2/incidents/bulk/", data=data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        incident_1_changes = response.data["changes"]["0"]
+        self.assertEqual(incident_1_changes["status"], status.HTTP_201_CREATED)
+        self.assertEqual(incident_1_changes["incident"]["tags"][0]["tag"], "host=example.com")
+        self.assertEqual(incident_1_changes["errors"], None)
+        incident_1 = Incident.objects.get(pk=incident_1_changes["incident"]["pk"])
+        self.assertEqual(incident_1.source, self.source)
+        self.assertTrue(incident_1.events.filter(type=Event.Type.INCIDENT_START).exists())
+
+        incident_2_changes = response.data["changes"]["1"]
+        self.assertEqual(incident_2_changes["status"], status.HTTP_201_CREATED)
+        incident_2 = Incident.objects.get(pk=incident_2_changes["incident"]["pk"])
+        self.assertTrue(incident_2.events.filter(type=Event.Type.STATELESS).exists())
+        self.assertEqual(Tag.objects.filter(key="host", value="example.com").count(), 1)
+        self.assertEqual(IncidentTagRelation.objects.filter(incident=incident_2).count(), 2)
+
+    def test_can_partially_bulk_create_incidents_with_some_invalid_incidents(self):
+        data = {"incidents": [self.incident_data, {**self.incident_data, "tags": [{"tag": "no delimiter"}]}]}
+
+        response = self.client.post(path="/api/v2/incidents/bulk/", data=data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["changes"]["0"]["status"], status.HTTP_201_CREATED)
+        invalid_changes = response.data["changes"]["1"]
+        self.assertEqual(invalid_changes["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(invalid_changes["incident"], None)
+        self.assertTrue(invalid_changes["errors"])
+        self.assertEqual(Incident.objects.count(), 1)
+
+    def test_cannot_bulk_create_incidents_with_taken_source_incident_ids(self):
+        StatefulIncidentFactory(source=self.source, source_incident_id="taken")
+        data = {
+            "incidents": [
+                {**self.incident_data, "source_incident_id": "taken"},
+                {**self.incident_data, "source_incident_id": "new"},
+                {**self.incident_data, "source_incident_id": "new"},
+            ]
+        }
+
+        response = self.client.post(path="/api/v2/incidents/bulk/", data=data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        changes = response.data["changes"]
+        self.assertEqual(changes["0"]["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertIn("source_incident_id", changes["0"]["errors"])
+        self.assertEqual(changes["1"]["status"], status.HTTP_201_CREATED)
+        self.assertEqual(changes["2"]["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Incident.objects.filter(source_incident_id="new").count(), 1)
+
+    def test_bulk_create_only_rejects_incidents_whose_source_incident_id_was_taken_at_the_same_time(self):
+        data = {
+            "incidents": [
+                {**self.incident_data, "source_incident_id": "new"},
+                {**self.incident_data, "source_incident_id": "taken"},
+            ]
+        }
+        StatefulIncidentFactory(source=self.source, source_incident_id="taken")
+
+        # As if the other request created its incident after the duplicates were looked for
+        with patch("argus.incident.views.BulkIncidentHelper._find_duplicates", return_value=[]):
+            response = self.client.post(path="/api/v2/incidents/bulk/", data=data, format="json")
+
+        changes = response.data["changes"]
+        self.assertEqual(changes["0"]["status"], status.HTTP_201_CREATED)
+        self.assertEqual(changes["1"]["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertIn("source_incident_id", changes["1"]["errors"])
+        self.assertEqual(Incident.objects.filter(source_incident_id="new").count(), 1)
+
+    def test_bulk_create_does_not_report_other_integrity_errors_as_taken_source_incident_ids(self):
+        data = {"incidents": [self.incident_data, self.incident_data]}
+        create_incidents = Incident.objects.create_incidents
+        calls = []
+
+        def fail_for_the_second(user, source, incidents_data):
+            calls.append(len(incidents_data))
+            if len(calls) in (1, 3):
+                raise IntegrityError("something else")
+            return create_incidents(user, source, incidents_data)
+
+        with patch.object(Incident.objects, "create_incidents", side_effect=fail_for_the_second):
+            with self.assertLogs("argus.incident.views", level="WARNING"):
+                response = self.client.post(path="/api/v2/incidents/bulk/", data=data, format="json")
+
+        self.assertEqual(calls, [2, 1, 1])
+        changes = response.data["changes"]
+        self.assertEqual(changes["0"]["status"], status.HTTP_201_CREATED)
+        self.assertEqual(changes["1"]["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn("source_incident_id", changes["1"]["errors"])
+        self.assertEqual(Incident.objects.count(), 1)
+
+    def test_cannot_bulk_create_incidents_with_all_invalid_incidents(self):
+        data = {"incidents": [{"description": "no start time", "tags": []}]}
+
+        response = self.client.post(path="/api/v2/incidents/bulk/", data=data, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["changes"]["0"]["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Incident.objects.exists())
+
+    def test_cannot_bulk_create_incidents_without_source_system(self):
+        self.client.force_authenticate(user=BaseUserFactory(username="user1"))
+        response = self.client.post(
+            path="/api/v2/incidents/bulk/", data={"incidents": [self.incident_data]}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Incident.objects.exists())
+
+
+class IncidentIngestViewSetTestCase(APITestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.source_user = SourceUserFactory()
+        self.source = SourceSystemFactory(user=self.source_user)
+        self.client.force_authenticate(user=self.source_user)
+        self.incident_data = {
+            "start_time": "2022-08-02T13:04:03.529Z",
+            "end_time": "infinity",
+            "source_incident_id": "1",
+            "description": "incident",
+            "tags": [{"tag": "host=example.com"}],
+        }
+
+    def tearDown(self):
+        connect_signals()
+
+    def ingest(self, *items):
+        body = "\n".join(item if isinstance(item, str) else json.dumps(item) for item in items)
+        response = self.client.post(path="/api/v2/incidents/ingest/", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_can_ingest_incidents_and_events_about_them(self):
+        end_event = {"type": "END", "timestamp": "2022-08-02T14:04:03.529Z"}
+        results = self.ingest({"incident": self.incident_data}, {"event": end_event, "source_incident_id": "1"})
+
+        self.assertEqual([result["line"] for result in results], [1, 2])
+        self.assertEqual([result["status"] for result in results], [201, 201])
+        incident = Incident.objects.get(pk=results[0]["incident"]["pk"])
+        self.assertEqual(results[1]["event"]["incident"], incident.pk)
+        self.assertFalse(incident.open)
+
+    def test_reports_errors_per_line(self):
+        results = self.ingest(
+            "not json",
+            {"something": "else"},
+            {"incident": {**self.incident_data, "start_time": None}},
+            {"event": {"type": "OTH"}, "source_incident_id": "unknown"},
+            {"incident": self.incident_data},
+        )
+
+        self.assertEqual([result["status"] for result in results], [400, 400, 400, 400, 201])
+        self.assertEqual(Incident.objects.count(), 1)
+
+    def test_can_ingest_more_lines_than_fit_in_a_batch(self):
+        items = [{"incident": {**self.incident_data, "source_incident_id": str(i)}} for i in range(5)]
+        with patch.object(IncidentIngestViewSet, "batch_size", 2):
+            results = self.ingest(*items)
+
+        self.assertEqual([result["line"] for result in results], [1, 2, 3, 4, 5])
+        self.assertEqual(Incident.objects.filter(source=self.source).count(), 5)
+
+    def test_non_integer_source_is_a_bad_request(self):
+        self.client.force_authenticate(user=AdminUserFactory())
+        response = self.client.post(
+            path="/api/v2/incidents/ingest/?source=abc",
+            data=json.dumps({"incident": self.incident_data}),
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Incident.objects.exists())
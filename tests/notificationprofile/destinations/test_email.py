@@ -1,8 +1,14 @@
+import smtplib
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
 from django.test import TestCase, tag
 from rest_framework import status
 from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 
 from argus.auth.factories import PersonUserFactory
+from argus.incident.factories import EventFactory
 from argus.notificationprofile.factories import DestinationConfigFactory, NotificationProfileFactory, TimeslotFactory
 from argus.notificationprofile.media.email import EmailNotification
 from argus.notificationprofile.models import DestinationConfig, Media
@@ -10,6 +16,21 @@ from argus.notificationprofile.serializers import RequestDestinationConfigSerial
 from argus.util.testing import connect_signals, disconnect_signals
 
 
+class RefusingEmailBackend(EmailBackend):
+    "Refuses to send to addresses starting with 'refused'"
+
+    opened = 0
+
+    def open(self):
+        RefusingEmailBackend.opened += 1
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith("refused"):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b"No such user")})
+        return super().send_messages(messages)
+
+
 @tag("integration")
 class EmailDestinationConfigSerializerTests(TestCase):
     def setUp(self):
@@ -405,3 +426,60 @@ class EmailDestinationSendTests(TestCase):
 
         self.assertIn(email_address, email_addresses)
         self.assertNotIn(phone_number, email_addresses)
+
+    def make_email_destination(self, email_address):
+        return DestinationConfigFactory(
+            user=self.user1,
+            media=Media.objects.get(slug="email"),
+            settings={"email_address": email_address, "synced": False},
+        )
+
+    def test_send_sends_one_email_per_address_over_one_connection(self):
+        destinations = [self.make_email_destination(f"test{i}@example.com") for i in range(3)]
+        RefusingEmailBackend.opened = 0
+        with patch("argus.notificationprofile.media.email.get_connection", RefusingEmailBackend):
+            self.assertTrue(EmailNotification.send(EventFactory(), destinations))
+        self.assertEqual(RefusingEmailBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [f"test{i}@example.com" for i in range(3)])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], "text/html")
+
+    def test_send_batch_sends_all_events_over_one_connection(self):
+        destination1 = self.make_email_destination("test1@example.com")
+        destination2 = self.make_email_destination("test2@example.com")
+        RefusingEmailBackend.opened = 0
+        with patch("argus.notificationprofile.media.email.get_connection", RefusingEmailBackend):
+            results = EmailNotification.send_batch(
+                [(EventFactory(), [destination1]), (EventFactory(), [destination1, destination2])]
+            )
+        self.assertEqual(results, [True, True])
+        self.assertEqual(RefusingEmailBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_send_reports_addresses_that_failed(self):
+        destinations = [
+            self.make_email_destination("refused@example.com"),
+            self.make_email_destination("ok@example.com"),
+        ]
+        with patch("argus.notificationprofile.media.email.get_connection", RefusingEmailBackend):
+            with self.assertLogs("argus.notificationprofile.media.email", level="DEBUG") as logs:
+                self.assertTrue(EmailNotification.send(EventFactory(), destinations))
+        self.assertEqual([message.to for message in mail.outbox], [["ok@example.com"]])
+        self.assertTrue(any("refused@example.com" in line for line in logs.output))
+
+    def test_send_returns_false_if_no_address_could_be_sent_to(self):
+        destinations = [self.make_email_destination("refused@example.com")]
+        with patch("argus.notificationprofile.media.email.get_connection", RefusingEmailBackend):
+            with self.assertLogs("argus.notificationprofile.media.email", level="ERROR"):
+                self.assertFalse(EmailNotification.send(EventFactory(), destinations))
+        self.assertEqual(mail.outbox, [])
+
+    def test_send_digests_sends_one_email_about_all_events(self):
+        destination = self.make_email_destination("test1@example.com")
+        events = [EventFactory(), EventFactory(), EventFactory()]
+        results = EmailNotification.send_digests([(events, [destination])])
+        self.assertEqual(results, [True])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("3 events", mail.outbox[0].subject)
+        for event in events:
+            self.assertIn(event.incident.description, mail.outbox[0].body)
@@ -1,8 +1,12 @@
-from django.test import TestCase, tag
+from unittest.mock import patch
+
+from django.core import mail
+from django.test import TestCase, override_settings, tag
 from rest_framework import status
 from rest_framework.test import APIClient, APIRequestFactory, APITestCase
 
 from argus.auth.factories import PersonUserFactory
+from argus.incident.factories import EventFactory
 from argus.notificationprofile.factories import DestinationConfigFactory, NotificationProfileFactory
 from argus.notificationprofile.media.sms_as_email import SMSNotification
 from argus.notificationprofile.models import DestinationConfig, Media
@@ -354,3 +358,60 @@ class SMSDestinationSendTests(TestCase):
 
         self.assertIn(phone_number, phone_numbers)
         self.assertNotIn(email_address, phone_numbers)
+
+    def make_sms_destination(self, phone_number):
+        return DestinationConfigFactory(
+            user=self.user1,
+            media=Media.objects.get_or_create(slug="sms")[0],
+            settings={"phone_number": phone_number},
+        )
+
+    @override_settings(SMS_GATEWAY_ADDRESS="sms@example.com", SMS_DEDUP_WINDOW=60)
+    @patch.dict("argus.notificationprofile.media.ratelimit._backends", clear=True)
+    def test_send_drops_repeated_sms_about_the_same_incident_and_event_type(self):
+        destination = self.make_sms_destination("+4747474747")
+        event = EventFactory()
+        self.assertTrue(SMSNotification.send(event, [destination]))
+        self.assertTrue(SMSNotification.send(event, [destination]))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(SMS_GATEWAY_ADDRESS="sms@example.com", SMS_RATE_LIMIT_PER_DESTINATION=1)
+    @patch.dict("argus.notificationprofile.media.ratelimit._backends", clear=True)
+    def test_send_holds_back_sms_over_the_rate_limit_and_says_so_in_the_next_one(self):
+        destination = self.make_sms_destination("+4747474747")
+        for _ in range(3):
+            SMSNotification.send(EventFactory(), [destination])
+        self.assertEqual(len(mail.outbox), 1)
+
+        with patch("time.monotonic", return_value=10**9):  # the bucket is full again
+            SMSNotification.send(EventFactory(), [destination])
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn("+2 more not sent", mail.outbox[1].body)
+
+    @override_settings(SMS_GATEWAY_ADDRESS="sms@example.com", SMS_RATE_LIMIT_PER_DESTINATION=1)
+    @patch.dict("argus.notificationprofile.media.ratelimit._backends", clear=True)
+    @patch.object(SMSNotification, "_schedule_send_held_back")
+    def test_send_held_back_says_how_many_sms_were_held_back_when_no_more_come(self, schedule):
+        destination = self.make_sms_destination("+4747474747")
+        for _ in range(3):
+            SMSNotification.send(EventFactory(), [destination])
+        schedule.assert_called()
+
+        self.assertEqual(SMSNotification.send_held_back(), 1)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[1].subject, "sms +4747474747")
+        self.assertIn("2 more not sent", mail.outbox[1].body)
+        self.assertEqual(SMSNotification.send_held_back(), 0)
+
+    @override_settings(SMS_GATEWAY_ADDRESS="sms@example.com", SMS_RATE_LIMIT_PER_DESTINATION=5, SMS_RATE_LIMIT=1)
+    @patch.dict("argus.notificationprofile.media.ratelimit._backends", clear=True)
+    @patch.object(SMSNotification, "_schedule_send_held_back")
+    def test_sms_held_back_by_the_medium_limit_do_not_use_up_the_limit_of_the_phone_number(self, schedule):
+        destination = self.make_sms_destination("+4747474747")
+        for _ in range(6):
+            SMSNotification.send(EventFactory(), [destination])
+        self.assertEqual(len(mail.outbox), 1)
+
+        with patch("time.monotonic", return_value=10**9):  # the medium bucket is full again
+            SMSNotification.send(EventFactory(), [destination])
+        self.assertEqual(len(mail.outbox), 2)
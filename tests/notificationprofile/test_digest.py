@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+import unittest
+
+from django.test import tag
+
+from argus.notificationprofile.media.digest import DigestBuffer, end_of_window
+
+
+@tag("unittest")
+class DigestBufferTests(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+
+    def test_events_are_grouped_by_destination(self):
+        buffer = DigestBuffer(window=60, send=self.sent.append)
+        buffer.add(["destination1", "destination2"], "event1")
+        buffer.add(["destination1"], "event2", "event3")
+        buffer.flush()
+        self.assertEqual(
+            self.sent,
+            [{"destination1": ["event1", "event2", "event3"], "destination2": ["event1"]}],
+        )
+
+    def test_flush_empties_the_buffer_and_stops_the_timer(self):
+        buffer = DigestBuffer(window=60, send=self.sent.append)
+        buffer.add(["destination1"], "event1")
+        timer = buffer.timer
+        buffer.flush()
+        buffer.flush()
+        self.assertEqual(len(self.sent), 1)
+        self.assertIsNone(buffer.timer)
+        timer.join(timeout=5)
+        self.assertFalse(timer.is_alive())
+
+    def test_end_of_window_is_the_same_for_all_timestamps_in_a_window(self):
+        start = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+        end = datetime(2024, 1, 1, 12, 1, 0, tzinfo=timezone.utc)
+        self.assertEqual(end_of_window(start, 60), end)
+        self.assertEqual(end_of_window(start.replace(second=59), 60), end)
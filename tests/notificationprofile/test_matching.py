@@ -0,0 +1,118 @@
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from argus.auth.factories import PersonUserFactory
+from argus.filter.factories import FilterFactory
+from argus.incident.models import create_fake_incident, get_or_create_default_instances, Event
+from argus.notificationprofile import factories
+from argus.notificationprofile.matching import (
+    VERSION_SEQUENCE,
+    IncidentFacts,
+    get_profile_matcher,
+    invalidate_profile_matcher,
+)
+from argus.util.testing import disconnect_signals, connect_signals
+
+
+class ProfileMatcherTest(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        (_, _, self.source) = get_or_create_default_instances()
+
+        self.timeslot = factories.TimeslotFactory()
+        factories.MaximalTimeRecurrenceFactory(timeslot=self.timeslot)
+
+        self.profiles = []
+        for _ in range(5):
+            user = PersonUserFactory()
+            profile = factories.NotificationProfileFactory(user=user, timeslot=self.timeslot, active=True)
+            profile.filters.add(FilterFactory(user=user, filter={"sourceSystemIds": [self.source.id]}))
+            profile.destinations.add(user.destinations.get())
+            self.profiles.append(profile)
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_matcher_only_contains_active_profiles(self):
+        self.profiles[0].active = False
+        self.profiles[0].save()
+        matcher = get_profile_matcher()
+        self.assertEqual(len(matcher), 4)
+        self.assertNotIn(self.profiles[0].pk, {profile.pk for profile in matcher.profiles})
+
+    def test_matcher_is_reused_until_invalidated(self):
+        matcher = get_profile_matcher()
+        self.assertIs(matcher, get_profile_matcher())
+        invalidate_profile_matcher()
+        self.assertIsNot(matcher, get_profile_matcher())
+
+    def test_matcher_is_rebuilt_when_another_process_has_changed_profiles(self):
+        matcher = get_profile_matcher()
+        # What committing a change does in the other process
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", [VERSION_SEQUENCE])
+        self.assertIsNot(matcher, get_profile_matcher())
+
+    def test_matcher_is_rebuilt_when_a_filter_is_changed(self):
+        matcher = get_profile_matcher()
+        filter_ = self.profiles[0].filters.get()
+        filter_.filter = {"sourceSystemIds": [self.source.id + 1]}
+        filter_.save()
+        self.assertIsNot(matcher, get_profile_matcher())
+
+    def test_matcher_is_rebuilt_when_destinations_are_changed(self):
+        matcher = get_profile_matcher()
+        self.profiles[0].destinations.clear()
+        self.assertIsNot(matcher, get_profile_matcher())
+
+    def test_matcher_is_kept_when_a_user_is_saved_with_the_same_email(self):
+        matcher = get_profile_matcher()
+        user = self.profiles[0].user
+        user.last_login = timezone.now()
+        user.save()
+        self.assertIs(matcher, get_profile_matcher())
+
+    def test_matcher_is_rebuilt_when_the_email_of_a_user_is_changed(self):
+        matcher = get_profile_matcher()
+        user = self.profiles[0].user
+        user.email = "changed@example.com"
+        user.save()
+        self.assertIsNot(matcher, get_profile_matcher())
+
+    def test_find_destinations_does_not_query_per_profile(self):
+        incident = create_fake_incident()
+        event = incident.events.get(type=Event.Type.INCIDENT_START)
+        matcher = get_profile_matcher()
+        facts = IncidentFacts(incident)
+        with CaptureQueriesContext(connection) as queries:
+            destinations = matcher.find_destinations(event, facts)
+        self.assertEqual(len(destinations), 5)
+        # all incident properties have been looked up, the rest is in memory
+        with self.assertNumQueries(0):
+            matcher.find_destinations(event, facts)
+        # Looking up the tags of the incident, once
+        self.assertLessEqual(len(queries), 2)
+
+    def test_incident_counts_as_acked_while_its_ack_event_is_matched(self):
+        """
+        The event of an acknowledgement is saved before the acknowledgement,
+        and notifications about it are found when the event is saved
+        """
+        incident = create_fake_incident()
+        event = Event.objects.create(
+            incident=incident, actor=self.profiles[0].user, timestamp=incident.start_time, type=Event.Type.ACKNOWLEDGE
+        )
+        self.assertFalse(incident.acked)
+        self.assertTrue(IncidentFacts.for_events([event])[event.pk].acked)
+
+    def test_only_the_ack_event_counts_the_incident_as_acked(self):
+        incident = create_fake_incident()
+        start = incident.events.get(type=Event.Type.INCIDENT_START)
+        ack = Event.objects.create(
+            incident=incident, actor=self.profiles[0].user, timestamp=incident.start_time, type=Event.Type.ACKNOWLEDGE
+        )
+        facts = IncidentFacts.for_events([start, ack])
+        self.assertFalse(facts[start.pk].acked)
+        self.assertTrue(facts[ack.pk].acked)
@@ -1,4 +1,8 @@
+from unittest.mock import Mock, patch
+
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from argus.auth.factories import PersonUserFactory
 from argus.filter.factories import FilterFactory
@@ -8,6 +12,7 @@ from argus.notificationprofile import factories
 from argus.notificationprofile.media import find_destinations_for_event
 from argus.notificationprofile.media import find_destinations_for_many_events
 from argus.notificationprofile.media import get_notification_media
+from argus.notificationprofile.media import send_notifications_to_users
 from argus.notificationprofile.media.email import modelinstance_to_dict
 from argus.notificationprofile.models import Media
 from argus.util.testing import disconnect_signals, connect_signals
@@ -166,6 +171,36 @@ class FindDestinationsTest(TestCase):
         self.assertNotIn(self.extra_destination1, destinations[event3])
         self.assertIn(self.extra_destination2, destinations[event3])
 
+    def test_find_destinations_for_many_events_uses_constant_number_of_queries(self):
+        incidents = [create_fake_incident(tags=["foo=bar"]) for _ in range(5)]
+        events = list(Event.objects.filter(incident__in=incidents, type=Event.Type.INCIDENT_START))
+        find_destinations_for_many_events(events[:1])  # load profiles
+
+        with CaptureQueriesContext(connection) as one_event:
+            find_destinations_for_many_events(events[:1])
+        with CaptureQueriesContext(connection) as many_events:
+            destinations = find_destinations_for_many_events(events)
+        self.assertEqual(len(one_event), len(many_events))
+        self.assertEqual(len(destinations), 5)
+        for event in events:
+            self.assertIn(self.user2_destination, destinations[event])
+
+    @override_settings(SEND_NOTIFICATIONS=True, NOTIFICATION_DIGEST_WINDOW=60)
+    def test_send_notifications_to_users_holds_back_events_for_digests(self):
+        event = create_fake_incident().events.get(type=Event.Type.INCIDENT_START)
+        with patch("argus.notificationprofile.media.digest_send_notification") as digest_send:
+            send_notifications_to_users(event)
+        digest_send.assert_called_once()
+
+    @override_settings(SEND_NOTIFICATIONS=True, NOTIFICATION_DIGEST_WINDOW=60)
+    def test_send_notifications_to_users_uses_the_send_it_is_given_even_with_digests(self):
+        event = create_fake_incident().events.get(type=Event.Type.INCIDENT_START)
+        send = Mock()
+        with patch("argus.notificationprofile.media.digest_send_notification") as digest_send:
+            send_notifications_to_users(event, send=send)
+        send.assert_called_once()
+        digest_send.assert_not_called()
+
 
 class GetNotificationMediaTests(TestCase):
     def setUp(self):
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from django.test import TestCase, tag
 from django.utils.dateparse import parse_datetime, parse_time
@@ -106,3 +106,14 @@ class TimeslotTests(TestCase, IncidentAPITestCaseHelper):
         self.assertFalse(
             self.timeslot1.timestamp_is_within_time_recurrences(set_time(self.monday_datetime, "00:30:02"))
         )
+
+    def test_timestamp_is_within_recurrences_sees_new_recurrences(self):
+        sunday = set_time(self.monday_datetime, "12:00") - timedelta(days=1)
+        self.assertFalse(self.timeslot1.timestamp_is_within_time_recurrences(sunday))
+        TimeRecurrenceFactory(
+            timeslot=self.timeslot1,
+            days={TimeRecurrence.Day.SUNDAY},
+            start=TimeRecurrence.DAY_START,
+            end=TimeRecurrence.DAY_END,
+        )
+        self.assertTrue(self.timeslot1.timestamp_is_within_time_recurrences(sunday))
@@ -0,0 +1,156 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core import mail
+from django.test import TestCase, override_settings, tag
+from django.utils import timezone
+
+from argus.auth.factories import PersonUserFactory
+from argus.incident.factories import EventFactory
+from argus.notificationprofile.media.digest import end_of_window
+from argus.notificationprofile.media.email import EmailNotification
+from argus.notificationprofile.models import NotificationJob
+from argus.notificationprofile.outbox import claim_jobs, enqueue_notifications, process_jobs
+from argus.util.testing import disconnect_signals, connect_signals
+
+
+@tag("database")
+class NotificationOutboxTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.event1 = EventFactory()
+        self.event2 = EventFactory()
+
+    def tearDown(self):
+        connect_signals()
+
+    @override_settings(SEND_NOTIFICATIONS=True)
+    def test_enqueue_notifications_creates_one_pending_job_per_event(self):
+        enqueue_notifications(self.event1, self.event2)
+        jobs = NotificationJob.objects.pending()
+        self.assertEqual({job.event for job in jobs}, {self.event1, self.event2})
+
+    @override_settings(SEND_NOTIFICATIONS=False)
+    def test_enqueue_notifications_does_nothing_if_notifications_are_turned_off(self):
+        self.assertEqual(enqueue_notifications(self.event1), [])
+        self.assertFalse(NotificationJob.objects.exists())
+
+    def test_claim_jobs_does_not_claim_the_same_job_twice(self):
+        NotificationJob.objects.create(event=self.event1)
+        NotificationJob.objects.create(event=self.event2)
+        first = claim_jobs(batch_size=1)
+        second = claim_jobs(batch_size=1)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0].pk, second[0].pk)
+        self.assertEqual(claim_jobs(), [])
+        self.assertEqual(NotificationJob.objects.filter(status=NotificationJob.Status.SENDING).count(), 2)
+
+    def test_claim_jobs_skips_jobs_that_are_not_due(self):
+        NotificationJob.objects.create(event=self.event1, next_attempt=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(claim_jobs(), [])
+
+    @override_settings(NOTIFICATION_JOB_TIMEOUT=60)
+    def test_claim_jobs_reclaims_jobs_of_dead_workers(self):
+        job = NotificationJob.objects.create(
+            event=self.event1,
+            status=NotificationJob.Status.SENDING,
+            claimed=timezone.now() - timedelta(minutes=5),
+        )
+        with self.assertLogs("argus.notificationprofile.outbox", level="WARNING"):
+            claimed = claim_jobs()
+        self.assertEqual([j.pk for j in claimed], [job.pk])
+        self.assertEqual(claimed[0].attempts, 1)
+
+    @override_settings(NOTIFICATION_JOB_TIMEOUT=60, NOTIFICATION_JOB_MAX_ATTEMPTS=3)
+    def test_claim_jobs_gives_up_on_jobs_that_keep_killing_their_workers(self):
+        job = NotificationJob.objects.create(
+            event=self.event1,
+            status=NotificationJob.Status.SENDING,
+            claimed=timezone.now() - timedelta(minutes=5),
+            attempts=2,
+        )
+        with self.assertLogs("argus.notificationprofile.outbox", level="ERROR"):
+            claimed = claim_jobs()
+        self.assertEqual(claimed, [])
+        job.refresh_from_db()
+        self.assertEqual(job.status, NotificationJob.Status.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    @patch("argus.notificationprofile.outbox._send", return_value=({}, {}))
+    @patch("argus.notificationprofile.outbox.find_destinations_for_many_events")
+    def test_process_jobs_marks_sent_jobs_as_done(self, find_destinations, send):
+        NotificationJob.objects.create(event=self.event1)
+        find_destinations.return_value = {self.event1: {PersonUserFactory().destinations.get()}}
+        sent, failed = process_jobs(claim_jobs())
+        self.assertEqual((sent, failed), (1, 0))
+        job = NotificationJob.objects.get()
+        self.assertEqual(job.status, NotificationJob.Status.DONE)
+        self.assertEqual(job.attempts, 1)
+
+    @override_settings(NOTIFICATION_JOB_MAX_ATTEMPTS=2)
+    @patch(
+        "argus.notificationprofile.outbox._send",
+        side_effect=lambda notifications: ({job.pk: ["email: not sent"] for job, _ in notifications}, {}),
+    )
+    @patch("argus.notificationprofile.outbox.find_destinations_for_many_events")
+    def test_process_jobs_retries_failed_jobs_until_max_attempts(self, find_destinations, send):
+        NotificationJob.objects.create(event=self.event1)
+        find_destinations.return_value = {self.event1: {PersonUserFactory().destinations.get()}}
+
+        self.assertEqual(process_jobs(claim_jobs()), (0, 1))
+        job = NotificationJob.objects.get()
+        self.assertEqual(job.status, NotificationJob.Status.PENDING)
+        self.assertEqual(job.last_error, "email: not sent")
+        self.assertGreater(job.next_attempt, timezone.now())
+
+        NotificationJob.objects.update(next_attempt=timezone.now())
+        with self.assertLogs("argus.notificationprofile.outbox", level="ERROR"):
+            process_jobs(claim_jobs())
+        job.refresh_from_db()
+        self.assertEqual(job.status, NotificationJob.Status.FAILED)
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(SEND_NOTIFICATIONS=True, NOTIFICATION_DIGEST_WINDOW=60)
+    def test_enqueue_notifications_makes_jobs_due_at_the_end_of_the_digest_window(self):
+        enqueue_notifications(self.event1, self.event2)
+        due = {job.next_attempt for job in NotificationJob.objects.all()}
+        self.assertEqual(len(due), 1)
+        self.assertEqual(due.pop(), end_of_window(timezone.now(), 60))
+
+    @override_settings(NOTIFICATION_DIGEST_WINDOW=60)
+    @patch("argus.notificationprofile.outbox.find_destinations_for_many_events")
+    def test_process_jobs_sends_one_digest_per_destination(self, find_destinations):
+        destination = PersonUserFactory(email="digest@example.com").destinations.get()
+        NotificationJob.objects.create(event=self.event1)
+        NotificationJob.objects.create(event=self.event2)
+        find_destinations.return_value = {self.event1: {destination}, self.event2: {destination}}
+        self.assertEqual(process_jobs(claim_jobs()), (2, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn("2 events", mail.outbox[0].subject)
+
+    @patch("argus.notificationprofile.outbox.find_destinations_for_many_events")
+    def test_process_jobs_retries_only_the_destinations_that_failed(self, find_destinations):
+        ok = PersonUserFactory(email="ok@example.com").destinations.get()
+        failing = PersonUserFactory(email="failing@example.com").destinations.get()
+        NotificationJob.objects.create(event=self.event1)
+        find_destinations.return_value = {self.event1: {ok, failing}}
+        sent_to = []
+
+        def send_batch(notifications):
+            results = []
+            for _, destinations in notifications:
+                (destination,) = destinations
+                sent_to.append(destination)
+                results.append(destination == ok or len(sent_to) > 2)
+            return results
+
+        with patch.object(EmailNotification, "send_batch", side_effect=send_batch):
+            self.assertEqual(process_jobs(claim_jobs()), (0, 1))
+            job = NotificationJob.objects.get()
+            self.assertEqual(job.sent_to, [ok.pk])
+
+            NotificationJob.objects.update(next_attempt=timezone.now())
+            self.assertEqual(process_jobs(claim_jobs()), (1, 0))
+        self.assertEqual(sorted(d.pk for d in sent_to), sorted([ok.pk, failing.pk, failing.pk]))
+        self.assertEqual(sent_to[-1], failing)
@@ -0,0 +1,79 @@
+import threading
+import unittest
+
+from django.test import tag
+
+from argus.notificationprofile.media.pool import NotificationWorkerPool
+
+
+@tag("unittest")
+class NotificationWorkerPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.done = []
+        self.lock = threading.Lock()
+
+    def job(self, value):
+        with self.lock:
+            self.done.append((threading.current_thread().name, value))
+
+    def test_jobs_are_run_by_a_fixed_number_of_workers(self):
+        pool = NotificationWorkerPool(workers=3, queue_size=100)
+        pool.start()
+        for i in range(50):
+            self.assertTrue(pool.submit(self.job, i))
+        pool.stop(timeout=5)
+
+        self.assertEqual(sorted(value for _, value in self.done), list(range(50)))
+        self.assertLessEqual(len({name for name, _ in self.done}), 3)
+        self.assertEqual(pool.stats.submitted, 50)
+        self.assertEqual(pool.stats.completed, 50)
+        self.assertEqual(pool.stats.ran_in_foreground, 0)
+
+    def test_full_queue_runs_job_in_the_calling_thread(self):
+        pool = NotificationWorkerPool(workers=1, queue_size=1, timeout=0.01)
+        started = threading.Event()
+        blocker = threading.Event()
+
+        def block():
+            started.set()
+            blocker.wait()
+
+        pool.start()
+        pool.submit(block)  # keeps the only worker busy
+        started.wait(timeout=5)
+        pool.submit(self.job, "queued")
+        # the queue is full now
+        self.assertFalse(pool.submit(self.job, "foreground"))
+        self.assertEqual(self.done, [(threading.current_thread().name, "foreground")])
+        blocker.set()
+        pool.stop(timeout=5)
+        self.assertEqual(pool.stats.ran_in_foreground, 1)
+        self.assertEqual(len(self.done), 2)
+
+    def test_failing_job_is_counted_and_does_not_kill_the_worker(self):
+        pool = NotificationWorkerPool(workers=1, queue_size=10)
+        pool.start()
+        with self.assertLogs("argus.notificationprofile.media.pool", level="ERROR"):
+            pool.submit(lambda: 1 / 0)
+            pool.submit(self.job, "after")
+            pool.stop(timeout=5)
+        self.assertEqual(pool.stats.failed, 1)
+        self.assertEqual(self.done[0][1], "after")
+
+    def test_stats_are_logged_when_the_pool_stops(self):
+        pool = NotificationWorkerPool(workers=1, queue_size=10)
+        pool.start()
+        pool.submit(self.job, "only")
+        with self.assertLogs("argus.notificationprofile.media.pool", level="INFO") as logs:
+            pool.stop(timeout=5)
+        self.assertIn("1 submitted, 1 completed, 0 failed", logs.output[-1])
+
+    def test_stats_are_logged_periodically(self):
+        pool = NotificationWorkerPool(workers=1, queue_size=10)
+        pool.stats_logged -= 3600
+        pool.start()
+        with self.assertLogs("argus.notificationprofile.media.pool", level="INFO") as logs:
+            pool.submit(self.job, "only")
+            pool.queue.join()
+        self.assertIn("1 completed", logs.output[-1])
+        pool.stop(timeout=5)
@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, tag
+
+from argus.notificationprofile.media.ratelimit import CacheBackend, LocalMemoryBackend, RateLimiter
+
+
+class RateLimiterTestMixin:
+    def make_limiter(self, **kwargs):
+        return RateLimiter(self.backend, "TEST", **kwargs)
+
+    def test_acquire_allows_a_burst_of_a_minutes_worth_of_messages(self):
+        limiter = self.make_limiter(address_rate=3)
+        self.assertEqual([limiter.acquire("a") for _ in range(4)], [True, True, True, False])
+        self.assertTrue(limiter.acquire("b"))
+
+    def test_acquire_refills_the_bucket_over_time(self):
+        limiter = self.make_limiter(address_rate=60)
+        with patch("time.monotonic", return_value=1000.0), patch("time.time", return_value=1000.0):
+            for _ in range(60):
+                limiter.acquire("a")
+            self.assertFalse(limiter.acquire("a"))
+        with patch("time.monotonic", return_value=1001.0), patch("time.time", return_value=1001.0):
+            self.assertTrue(limiter.acquire("a"))
+
+    def test_medium_rate_limits_all_addresses_together(self):
+        limiter = self.make_limiter(medium_rate=2)
+        self.assertEqual([limiter.acquire(address) for address in "abc"], [True, True, False])
+
+    def test_messages_that_are_not_allowed_are_counted_until_popped(self):
+        limiter = self.make_limiter(address_rate=1)
+        for _ in range(3):
+            limiter.acquire("a")
+        self.assertEqual(limiter.pop_spilled("a"), 2)
+        self.assertEqual(limiter.pop_spilled("a"), 0)
+
+    def test_acquire_takes_no_token_for_the_address_when_the_medium_is_limited(self):
+        limiter = self.make_limiter(address_rate=2, medium_rate=1)
+        self.assertTrue(limiter.acquire("a"))
+        self.assertFalse(limiter.acquire("b"))
+        # b's own bucket is still full
+        limiter.medium_rate = 0
+        self.assertEqual([limiter.acquire("b") for _ in range(3)], [True, True, False])
+
+    def test_pop_all_spilled_returns_and_resets_the_counts_of_all_addresses(self):
+        limiter = self.make_limiter(address_rate=1)
+        for address in "aab":
+            limiter.acquire(address)
+            limiter.acquire(address)
+        self.assertEqual(limiter.pop_all_spilled(), {"a": 3, "b": 1})
+        self.assertEqual(limiter.pop_all_spilled(), {})
+        self.assertEqual(limiter.pop_spilled("a"), 0)
+
+    def test_is_duplicate_only_within_the_window(self):
+        limiter = self.make_limiter(dedup_window=60)
+        self.assertFalse(limiter.is_duplicate("a", 1, "STA"))
+        self.assertTrue(limiter.is_duplicate("a", 1, "STA"))
+        self.assertFalse(limiter.is_duplicate("a", 1, "END"))
+        self.assertFalse(limiter.is_duplicate("b", 1, "STA"))
+        limiter.forget("a", 1, "STA")
+        self.assertFalse(limiter.is_duplicate("a", 1, "STA"))
+
+    def test_nothing_is_limited_by_default(self):
+        limiter = self.make_limiter()
+        self.assertTrue(all(limiter.acquire("a") for _ in range(100)))
+        self.assertFalse(limiter.is_duplicate("a", 1, "STA"))
+        self.assertFalse(limiter.is_duplicate("a", 1, "STA"))
+
+
+@tag("unittest")
+class LocalMemoryRateLimiterTests(RateLimiterTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.backend = LocalMemoryBackend()
+
+
+@tag("unittest")
+class CacheRateLimiterTests(RateLimiterTestMixin, SimpleTestCase):
+    def setUp(self):
+        self.backend = CacheBackend()
+        self.backend.cache.clear()
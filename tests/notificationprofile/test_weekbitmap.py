@@ -0,0 +1,54 @@
+from datetime import datetime, time, timedelta
+import random
+
+from django.test import SimpleTestCase, tag
+from django.utils.timezone import make_aware
+
+from argus.notificationprofile.weekbitmap import WeekBitmap
+
+
+MONDAY = make_aware(datetime(2019, 11, 25))
+
+
+def is_within(recurrences, timestamp):
+    "What the bitmap must agree with, the logic of TimeRecurrence.timestamp_is_within"
+    return any(timestamp.isoweekday() in days and start <= timestamp.time() <= end for days, start, end in recurrences)
+
+
+@tag("unittest")
+class WeekBitmapTests(SimpleTestCase):
+    def test_whole_minutes_are_within(self):
+        bitmap = WeekBitmap([({1, 3}, time(8, 0), time(16, 0, 59, 999999))])
+        self.assertTrue(bitmap.timestamp_is_within(MONDAY.replace(hour=8)))
+        self.assertTrue(bitmap.timestamp_is_within(MONDAY.replace(hour=16, minute=0, second=59)))
+        self.assertFalse(bitmap.timestamp_is_within(MONDAY.replace(hour=16, minute=1)))
+        self.assertFalse(bitmap.timestamp_is_within(MONDAY.replace(hour=7, minute=59, second=59)))
+        self.assertFalse(bitmap.timestamp_is_within(MONDAY.replace(hour=12) + timedelta(days=1)))
+        self.assertTrue(bitmap.timestamp_is_within(MONDAY.replace(hour=12) + timedelta(days=2)))
+
+    def test_partial_minutes_are_checked_to_the_second(self):
+        bitmap = WeekBitmap([({1}, time(0, 30, 0), time(0, 30, 1)), ({1}, time(0, 30, 3), time(0, 31))])
+        within = [
+            second for second in range(60) if bitmap.timestamp_is_within(MONDAY.replace(minute=30, second=second))
+        ]
+        self.assertEqual(within, [0, 1] + list(range(3, 60)))
+        self.assertTrue(bitmap.timestamp_is_within(MONDAY.replace(minute=31)))
+        self.assertFalse(bitmap.timestamp_is_within(MONDAY.replace(minute=31, second=1)))
+
+    def test_recurrence_that_ends_before_it_starts_is_never_within(self):
+        bitmap = WeekBitmap([({1}, time(22, 0), time(6, 0))])
+        self.assertFalse(bitmap.timestamp_is_within(MONDAY.replace(hour=23)))
+        self.assertFalse(bitmap.timestamp_is_within(MONDAY.replace(hour=5)))
+
+    def test_agrees_with_checking_the_recurrences(self):
+        rng = random.Random(42)
+        for _ in range(20):
+            recurrences = []
+            for _ in range(rng.randint(0, 4)):
+                start = time(rng.randrange(24), rng.randrange(60), rng.choice([0, rng.randrange(60)]))
+                end = time(rng.randrange(24), rng.randrange(60), rng.choice([0, 59, rng.randrange(60)]))
+                recurrences.append((set(rng.sample(range(1, 8), rng.randint(1, 7))), start, end))
+            bitmap = WeekBitmap(recurrences)
+            for _ in range(500):
+                timestamp = MONDAY + timedelta(seconds=rng.randrange(7 * 24 * 60 * 60))
+                self.assertEqual(bitmap.timestamp_is_within(timestamp), is_within(recurrences, timestamp))
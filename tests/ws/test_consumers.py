@@ -0,0 +1,163 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase
+from django.utils import timezone
+
+from argus.auth.factories import PersonUserFactory
+from argus.filter.factories import FilterFactory
+from argus.incident.factories import SourceSystemFactory, SourceUserFactory, StatefulIncidentFactory
+from argus.incident.models import Incident
+from argus.notificationprofile.factories import NotificationProfileFactory, TimeslotFactory
+from argus.util.datetime_utils import INFINITY_REPR
+from argus.util.testing import connect_signals, disconnect_signals
+from argus.ws.consumers import OpenIncidentConsumer
+from argus.ws.publish import SUBSCRIBED_OPEN_INCIDENTS
+from argus.ws.subscriptions import get_facts, get_filter_group
+
+
+# The consumer closes old database connections, which would end the transaction of the test
+@patch("channels.db.close_old_connections")
+class OpenIncidentConsumerTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.user = PersonUserFactory()
+        self.source1 = SourceSystemFactory(user=SourceUserFactory())
+        self.source2 = SourceSystemFactory(user=SourceUserFactory())
+        now = timezone.now()
+        self.incident1 = StatefulIncidentFactory(
+            source=self.source1, level=1, start_time=now - timedelta(hours=2), end_time=INFINITY_REPR
+        )
+        self.incident2 = StatefulIncidentFactory(
+            source=self.source2, level=5, start_time=now - timedelta(hours=1), end_time=INFINITY_REPR
+        )
+        self.source_filter = FilterFactory(user=self.user, filter={"sourceSystemIds": [self.source1.pk]})
+        self.level_filter = FilterFactory(user=self.user, filter={"maxlevel": 2})
+        self.profile = NotificationProfileFactory(timeslot=TimeslotFactory(user=self.user))
+        self.profile.filters.add(self.source_filter, self.level_filter)
+
+    def tearDown(self):
+        connect_signals()
+
+    def subscribe(self, group_messages=(), **content):
+        """Subscribe with ``content`` and return what is sent back
+
+        ``group_messages`` are pairs of group and message to send to the
+        channel layer after subscribing.
+        """
+
+        async def run():
+            communicator = WebsocketCommunicator(OpenIncidentConsumer.as_asgi(), "/ws/open/")
+            communicator.scope["user"] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({"action": "subscribe", **content})
+            messages = [await communicator.receive_json_from()]
+            for group, message in group_messages:
+                await get_channel_layer().group_send(group, message)
+            while not await communicator.receive_nothing():
+                messages.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return messages
+
+        return async_to_sync(run)()
+
+    def test_subscribe_sends_the_open_incidents_newest_first(self, _):
+        messages = self.subscribe()
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]["type"], "subscribed")
+        self.assertEqual(
+            [incident["pk"] for incident in messages[0]["start_incidents"]], [self.incident2.pk, self.incident1.pk]
+        )
+        self.assertFalse(messages[0]["more"])
+
+    def test_open_incidents_are_sent_in_chunks(self, _):
+        messages = self.subscribe(chunk_size=1)
+        self.assertEqual([message["type"] for message in messages], ["subscribed", "start_incidents"])
+        self.assertEqual([incident["pk"] for incident in messages[0]["start_incidents"]], [self.incident2.pk])
+        self.assertTrue(messages[0]["more"])
+        self.assertEqual([incident["pk"] for incident in messages[1]["incidents"]], [self.incident1.pk])
+        self.assertFalse(messages[1]["more"])
+
+    def test_subscribe_since_sends_only_the_incidents_changed_after_in_order(self, _):
+        Incident.objects.filter(pk=self.incident1.pk).bump_change_seq()
+        seq = Incident.objects.last_change_seq()
+        Incident.objects.filter(pk=self.incident2.pk).bump_change_seq()
+        Incident.objects.filter(pk=self.incident1.pk).bump_change_seq()
+
+        messages = self.subscribe(since=seq, chunk_size=1)
+        self.assertEqual([message["type"] for message in messages], ["subscribed", "changes", "changes"])
+        self.assertEqual(messages[0]["start_incidents"], [])
+        self.assertEqual(messages[0]["seq"], seq + 2)
+        changes = [(incident["pk"], incident["seq"]) for message in messages[1:] for incident in message["incidents"]]
+        self.assertEqual(changes, [(self.incident2.pk, seq + 1), (self.incident1.pk, seq + 2)])
+        self.assertEqual([message["more"] for message in messages[1:]], [True, False])
+
+    def test_subscribe_since_the_latest_change_sends_no_incidents(self, _):
+        Incident.objects.all().bump_change_seq()
+        messages = self.subscribe(since=Incident.objects.last_change_seq())
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]["start_incidents"], [])
+        self.assertFalse(messages[0]["more"])
+
+    def test_subscribe_to_a_notification_profile_sends_the_open_incidents_that_fit(self, _):
+        messages = self.subscribe(notificationprofile=self.profile.pk)
+        self.assertEqual([incident["pk"] for incident in messages[0]["start_incidents"]], [self.incident1.pk])
+
+    def test_subscribers_of_a_filter_get_the_changes_that_fit_it(self, _):
+        group = get_filter_group(self.source_filter.pk)
+        contents = [
+            {"type": "modified", "payload": {"pk": self.incident1.pk, "level": 1}, "seq": 1},
+            {"type": "created", "payload": {"pk": self.incident2.pk, "level": 5}, "seq": 2},
+        ]
+        message = {"type": "notify_batch", "contents": contents, "groups": [[group], []], "facts": [{}, {}]}
+        messages = self.subscribe(filter=self.source_filter.pk, group_messages=[(SUBSCRIBED_OPEN_INCIDENTS, message)])
+        self.assertEqual(messages[1:], [{**contents[0], "fits": True}])
+
+    def test_subscribers_of_a_filter_hear_when_an_incident_does_not_fit_anymore(self, _):
+        content = {"type": "modified", "payload": {"pk": self.incident1.pk, "level": 1}, "seq": 1}
+        message = {"type": "notify_batch", "contents": [content], "groups": [[]], "facts": [{}]}
+        messages = self.subscribe(filter=self.source_filter.pk, group_messages=[(SUBSCRIBED_OPEN_INCIDENTS, message)])
+        self.assertEqual(
+            messages[1:], [{"type": "modified", "payload": {"pk": self.incident1.pk}, "seq": 1, "fits": False}]
+        )
+
+    def test_subscribe_since_with_a_filter_marks_the_changes_that_do_not_fit(self, _):
+        seq = Incident.objects.last_change_seq()
+        Incident.objects.filter(pk=self.incident2.pk).bump_change_seq()
+        Incident.objects.filter(pk=self.incident1.pk).bump_change_seq()
+        self.incident1.refresh_from_db()
+        self.incident2.refresh_from_db()
+
+        messages = self.subscribe(since=seq, filter=self.source_filter.pk)
+        incidents = messages[1]["incidents"]
+        self.assertEqual(incidents[0], {"pk": self.incident2.pk, "seq": self.incident2.change_seq, "fits": False})
+        self.assertEqual(
+            (incidents[1]["pk"], incidents[1]["seq"], incidents[1]["fits"]),
+            (self.incident1.pk, self.incident1.change_seq, True),
+        )
+
+    def test_cannot_subscribe_to_filter_of_another_user(self, _):
+        filter_ = FilterFactory(filter={"maxlevel": 5})
+        for pk in (filter_.pk, "not a pk"):
+            messages = self.subscribe(filter=pk)
+            self.assertEqual(len(messages), 1)
+            self.assertIn("error", messages[0])
+
+    def test_filterblob_subscription_only_passes_on_incidents_that_fit(self, _):
+        contents = [
+            {"type": "modified", "payload": {"pk": pk}, "seq": 1} for pk in (self.incident1.pk, self.incident2.pk)
+        ]
+        message = {
+            "type": "notify_batch",
+            "contents": contents,
+            "groups": [[], []],
+            "facts": [get_facts(self.incident1), get_facts(self.incident2)],
+        }
+        messages = self.subscribe(filterblob={"maxlevel": 2}, group_messages=[(SUBSCRIBED_OPEN_INCIDENTS, message)])
+        self.assertEqual([incident["pk"] for incident in messages[0]["start_incidents"]], [self.incident1.pk])
+        self.assertEqual(messages[1], {**contents[0], "fits": True})
+        self.assertEqual(messages[2]["fits"], False)
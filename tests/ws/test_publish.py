@@ -0,0 +1,142 @@
+import unittest
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase, tag
+
+from argus.incident.factories import (
+    IncidentTagRelationFactory,
+    SourceSystemFactory,
+    SourceUserFactory,
+    StatefulIncidentFactory,
+)
+from argus.incident.models import Incident
+from argus.util.signals import bulk_changed
+from argus.util.testing import connect_signals, disconnect_signals
+from argus.ws.publish import SUBSCRIBED_OPEN_INCIDENTS, IncidentPublisher, publish_incidents
+from argus.ws.subscriptions import get_facts, get_subscription_matcher
+
+
+@tag("unittest")
+class IncidentPublisherTests(unittest.TestCase):
+    def setUp(self):
+        self.published = []
+
+    def test_incidents_changed_in_the_window_are_published_once(self):
+        publisher = IncidentPublisher(window=60, publish=self.published.append)
+        publisher.add([1, 2])
+        publisher.add([2, 3], created=True)
+        publisher.add([1])
+        publisher.flush()
+        self.assertEqual(self.published, [{1: False, 2: True, 3: True}])
+
+    def test_flush_empties_the_publisher_and_stops_the_timer(self):
+        publisher = IncidentPublisher(window=60, publish=self.published.append)
+        publisher.add([1])
+        timer = publisher.timer
+        publisher.flush()
+        publisher.flush()
+        self.assertEqual(len(self.published), 1)
+        self.assertIsNone(publisher.timer)
+        timer.join(timeout=5)
+        self.assertFalse(timer.is_alive())
+
+    def test_without_a_window_incidents_are_published_right_away(self):
+        publisher = IncidentPublisher(window=0, publish=self.published.append)
+        publisher.add([1], created=True)
+        publisher.add([1])
+        self.assertEqual(self.published, [{1: True}, {1: False}])
+        self.assertIsNone(publisher.timer)
+
+
+class PublishIncidentsTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        source = SourceSystemFactory(user=SourceUserFactory())
+        self.incident1 = StatefulIncidentFactory(source=source)
+        self.incident2 = StatefulIncidentFactory(source=source)
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(SUBSCRIBED_OPEN_INCIDENTS, self.channel_name)
+
+    def tearDown(self):
+        async_to_sync(self.channel_layer.flush)()
+        connect_signals()
+
+    def test_incidents_are_sent_in_one_message(self):
+        publish_incidents({self.incident2.pk: True, self.incident1.pk: False})
+        message = async_to_sync(self.channel_layer.receive)(self.channel_name)
+        self.assertEqual(message["type"], "notify_batch")
+        self.assertEqual(
+            {content["payload"]["pk"]: content["type"] for content in message["contents"]},
+            {self.incident2.pk: "created", self.incident1.pk: "modified"},
+        )
+
+    def test_facts_for_filters_that_are_not_saved_are_sent_along(self):
+        publish_incidents({self.incident1.pk: False})
+        message = async_to_sync(self.channel_layer.receive)(self.channel_name)
+        self.incident1.refresh_from_db()
+        self.assertEqual(message["facts"], [get_facts(self.incident1)])
+
+    def test_incidents_are_numbered_and_sent_in_that_order(self):
+        publish_incidents({self.incident1.pk: False})
+        publish_incidents({self.incident2.pk: False, self.incident1.pk: False})
+        first = async_to_sync(self.channel_layer.receive)(self.channel_name)["contents"]
+        second = async_to_sync(self.channel_layer.receive)(self.channel_name)["contents"]
+        seqs = [content["seq"] for content in first + second]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(len(set(seqs)), 3)
+        self.assertEqual(Incident.objects.last_change_seq(), seqs[-1])
+
+    def test_incidents_are_serialized_with_a_constant_number_of_queries(self):
+        get_subscription_matcher()
+        # Numbering in a savepoint with a lock, the version of the subscriptions, the incidents and their tags
+        with self.assertNumQueries(7):
+            publish_incidents({self.incident1.pk: False, self.incident2.pk: False})
+
+    @patch("argus.ws.publish.get_channel_layer")
+    def test_deleted_incidents_are_not_sent(self, get_channel_layer):
+        publish_incidents({0: False})
+        get_channel_layer.assert_not_called()
+
+
+@patch("argus.ws.publish.get_publisher")
+class QueueIncidentsTests(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.source = SourceSystemFactory(user=SourceUserFactory())
+
+    def tearDown(self):
+        connect_signals()
+
+    def test_saved_incident_is_queued_when_committed(self, get_publisher):
+        with self.captureOnCommitCallbacks() as callbacks:
+            incident = StatefulIncidentFactory(source=self.source)
+            get_publisher.assert_not_called()
+        for callback in callbacks:
+            callback()
+        get_publisher.return_value.add.assert_called_with([incident.pk], True)
+
+    def test_bulk_changed_incidents_are_queued_together(self, get_publisher):
+        incidents = [StatefulIncidentFactory(source=self.source) for _ in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            bulk_changed.send(sender=Incident, instances=incidents)
+        get_publisher.return_value.add.assert_called_once_with([incident.pk for incident in incidents], False)
+
+    def test_incident_of_a_new_event_is_queued(self, get_publisher):
+        incident = StatefulIncidentFactory(source=self.source)
+        with self.captureOnCommitCallbacks(execute=True):
+            incident.create_ack(incident.source.user)
+        get_publisher.return_value.add.assert_called_with([incident.pk], False)
+
+    def test_incident_of_a_changed_tag_is_queued(self, get_publisher):
+        incident = StatefulIncidentFactory(source=self.source)
+        with self.captureOnCommitCallbacks(execute=True):
+            relation = IncidentTagRelationFactory(incident=incident)
+        get_publisher.return_value.add.assert_called_with([incident.pk], False)
+
+        get_publisher.reset_mock()
+        with self.captureOnCommitCallbacks(execute=True):
+            relation.delete()
+        get_publisher.return_value.add.assert_called_with([incident.pk], False)
@@ -0,0 +1,87 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.test import TestCase
+
+from argus.auth.factories import PersonUserFactory
+from argus.filter.factories import FilterFactory
+from argus.incident.factories import SourceSystemFactory, SourceUserFactory, StatefulIncidentFactory
+from argus.notificationprofile.factories import NotificationProfileFactory, TimeslotFactory
+from argus.util.testing import connect_signals, disconnect_signals
+from argus.ws import subscriptions
+from argus.ws.publish import SUBSCRIBED_OPEN_INCIDENTS, publish_incidents
+from argus.ws.subscriptions import (
+    SubscriptionMatcher,
+    get_facts,
+    get_filter_group,
+    get_profile_group,
+    get_subscription_matcher,
+)
+
+
+class SubscriptionTestCase(TestCase):
+    def setUp(self):
+        disconnect_signals()
+        self.user = PersonUserFactory()
+        self.source1 = SourceSystemFactory(user=SourceUserFactory())
+        self.source2 = SourceSystemFactory(user=SourceUserFactory())
+        self.incident1 = StatefulIncidentFactory(source=self.source1, level=1)
+        self.incident2 = StatefulIncidentFactory(source=self.source2, level=5)
+        self.source_filter = FilterFactory(user=self.user, filter={"sourceSystemIds": [self.source1.pk]})
+        self.level_filter = FilterFactory(user=self.user, filter={"maxlevel": 2})
+        self.profile = NotificationProfileFactory(timeslot=TimeslotFactory(user=self.user))
+        self.profile.filters.add(self.source_filter, self.level_filter)
+
+    def tearDown(self):
+        connect_signals()
+
+
+class SubscriptionMatcherTests(SubscriptionTestCase):
+    def test_incident_is_sent_to_the_groups_of_the_filters_and_profiles_it_fits(self):
+        matcher = SubscriptionMatcher.build()
+        self.assertEqual(
+            matcher.groups(self.incident1),
+            [
+                get_filter_group(self.source_filter.pk),
+                get_filter_group(self.level_filter.pk),
+                get_profile_group(self.profile.pk),
+            ],
+        )
+        self.assertEqual(matcher.groups(self.incident2), [])
+
+    def test_profile_without_filters_fits_nothing(self):
+        profile = NotificationProfileFactory(timeslot=TimeslotFactory(user=self.user))
+        matcher = SubscriptionMatcher.build()
+        self.assertNotIn(get_profile_group(profile.pk), matcher.groups(self.incident1))
+
+    def test_matcher_is_rebuilt_when_a_filter_is_changed(self):
+        matcher = get_subscription_matcher()
+        self.assertIs(get_subscription_matcher(), matcher)
+        self.level_filter.filter = {"maxlevel": 5}
+        self.level_filter.save()
+        matcher = get_subscription_matcher()
+        self.assertIn(get_filter_group(self.level_filter.pk), matcher.groups(self.incident2))
+
+    def test_facts_are_checked_like_the_incident(self):
+        facts = subscriptions.IncidentFromFacts(get_facts(self.incident1))
+        for filter_ in (self.source_filter, self.level_filter):
+            wrapper = subscriptions.filter_backend.FilterWrapper(filter_.filter)
+            self.assertTrue(wrapper.incident_fits(facts))
+
+
+class PublishToSubscriptionsTests(SubscriptionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(SUBSCRIBED_OPEN_INCIDENTS, self.channel_name)
+
+    def tearDown(self):
+        async_to_sync(self.channel_layer.flush)()
+        super().tearDown()
+
+    def test_changes_are_sent_with_the_groups_they_fit(self):
+        publish_incidents({self.incident1.pk: False, self.incident2.pk: False})
+        message = async_to_sync(self.channel_layer.receive)(self.channel_name)
+        groups = {content["payload"]["pk"]: groups for content, groups in zip(message["contents"], message["groups"])}
+        self.assertIn(get_filter_group(self.source_filter.pk), groups[self.incident1.pk])
+        self.assertEqual(groups[self.incident2.pk], [])